@@ -1,186 +1,593 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, Response, current_app, request, jsonify, session, stream_with_context
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+import json
 import time
+import asyncio
+import threading
 import logging
 from datetime import datetime, timedelta
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
 
 from services.openai_service import OpenAIService
 from services.context_service import ContextService
 from services.financial_data_service import FinancialDataService
+from services.market_snapshot_service import MarketSnapshotService
 from services.cache_service import CacheService
+from services.intent_classifier import IntentClassifier
+from services.message_writer import MessageWriter
+from services.request_coalescer import RequestCoalescer
 from utils.rate_limiter import RateLimiter
-from utils.validators import validate_message_input, validate_session_id
-from app import redis_client
+from utils.validators import validate_message_input, validate_session_id, validate_history_fields
+from utils.async_runner import async_runner
+from utils.text_similarity import is_follow_up
+from app import app, redis_client
 
 chat_bp = Blueprint('chat', __name__)
 logger = logging.getLogger(__name__)
 
 # Initialize services
-openai_service = OpenAIService()
-context_service = ContextService()
-financial_data_service = FinancialDataService()
 cache_service = CacheService(redis_client)
+openai_service = OpenAIService(RequestCoalescer(cache_service))
+message_writer = MessageWriter(app)
+context_service = ContextService(cache_service, message_writer)
+financial_data_service = FinancialDataService(cache_service=cache_service)
+market_snapshot_service = MarketSnapshotService(financial_data_service.market_provider, cache_service)
+intent_classifier = IntentClassifier()
 rate_limiter = RateLimiter(redis_client)
 
-# Thread pool for async operations
-executor = ThreadPoolExecutor(max_workers=10)
+# Index cache keys written before per-session key indexes existed (SCAN-based, runs once)
+threading.Thread(target=cache_service.migrate_session_key_index, daemon=True).start()
+
+# Warm the market snapshot so the first market question does not wait on upstream
+market_snapshot_service.start()
+
+# Upstream timeouts (seconds)
+INTENT_TIMEOUT = 10
+RESPONSE_TIMEOUT = 15
+# Longest a portfolio answer waits for Monte Carlo risk numbers (seconds)
+RISK_BUDGET = 0.75
+
+# Sessions with a summary refresh running in this process
+_summaries_in_flight = set()
+_summaries_lock = threading.Lock()
+
+def _sse_event(event: str, data: dict) -> str:
+    """Format a Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _wants_event_stream() -> bool:
+    """Check whether the client asked for a streamed response"""
+    return 'text/event-stream' in request.headers.get('Accept', '')
+
+def _with_rate_limit_headers(response, message_info: dict):
+    """Attach RateLimit-* headers for the request's reservation"""
+    response.headers.update(rate_limiter.get_rate_limit_headers(message_info['reservation']))
+    return response
+
+def _validate_message_request():
+    """Validate input, session and limits for a chat message.
+    
+    Returns (message_info, None) on success or (None, error_response) on failure.
+    """
+    data = request.get_json()
+    if not data:
+        return None, (jsonify({'error': 'No data provided'}), 400)
+    
+    validation_result = validate_message_input(data)
+    if not validation_result['valid']:
+        return None, (jsonify({'error': validation_result['error']}), 400)
+    
+    user_message = data['message']
+    session_id = session.get('session_id')
+    
+    if not session_id:
+        return None, (jsonify({'error': 'No session found'}), 400)
+    
+    # Check and reserve the per-minute and daily limits in one atomic step
+    user_tier = session.get('user_tier', 1)
+    reservation = rate_limiter.reserve(session_id, user_tier)
+    if not reservation['allowed']:
+        if reservation['reason'] == 'daily':
+            limit = rate_limiter.daily_limits.get(user_tier, 10)
+            message = f"Daily message limit reached ({limit} messages). Please upgrade your tier for more messages."
+        else:
+            message = 'Rate limit exceeded. Please try again later.'
+        
+        response = jsonify({'error': message, 'retry_after': reservation['retry_after']})
+        response.headers.update(rate_limiter.get_rate_limit_headers(reservation))
+        return None, (response, 429)
+    
+    # Check the token budget (charged with actual usage once the reply is done)
+    token_budget = rate_limiter.check_token_budget(session_id, user_tier)
+    if not token_budget['allowed']:
+        rate_limiter.release(session_id, reservation)
+        period = 'Daily' if token_budget['reason'] == 'daily_tokens' else 'Per-minute'
+        message = f"{period} token budget reached ({token_budget['limit']} tokens). Please try again later or upgrade your tier."
+        response = jsonify({'error': message, 'retry_after': token_budget['retry_after']})
+        response.headers['Retry-After'] = str(token_budget['retry_after'])
+        return None, (response, 429)
+    
+    return {
+        'user_message': user_message,
+        'session_id': session_id,
+        'user_tier': user_tier,
+        'reservation': reservation
+    }, None
+
+async def _classify_intent(user_message: str, local_result: dict) -> dict:
+    """Use the local classification when confident, otherwise fall back to the LLM"""
+    if intent_classifier.is_confident(local_result):
+        return local_result
+    
+    intent_result = await openai_service.classify_user_intent(user_message)
+    intent_result['source'] = 'llm'
+    return intent_result
+
+async def _run_in_thread(app, func, *args):
+    """Run a blocking service call in a worker thread with its own app context"""
+    def call():
+        with app.app_context():
+            return func(*args)
+    return await asyncio.to_thread(call)
+
+async def _fetch_portfolio_analysis(app, session_id: str, context_task: asyncio.Task) -> dict:
+    """Portfolio analytics, plus Monte Carlo VaR/CVaR when it is ready within RISK_BUDGET.
+    
+    The saved portfolio comes from the context already being loaded by
+    `context_task` ({} means the demo portfolio is analysed). A simulation that
+    misses the budget keeps running and caches its result, so a follow-up
+    question about the same portfolio gets the risk numbers.
+    """
+    # Shielded: a cancelled prefetch must not cancel the shared context load
+    context = await asyncio.shield(context_task)
+    portfolio_data = context.get('user_context', {}).get('portfolio_data') or {}
+    # Quotes and histories are fetched once for both the analytics and the simulation
+    inputs = await _run_in_thread(app, financial_data_service.get_portfolio_inputs, portfolio_data)
+    if not inputs['success']:
+        return inputs
+    
+    analysis = await _run_in_thread(
+        app, financial_data_service.get_portfolio_analysis, portfolio_data, inputs['data']
+    )
+    if not analysis['success']:
+        return analysis
+    
+    try:
+        risk = await asyncio.wait_for(
+            _run_in_thread(app, lambda: financial_data_service.get_portfolio_risk(portfolio_data, inputs=inputs['data'])),
+            timeout=RISK_BUDGET
+        )
+        if risk['success']:
+            analysis['data']['risk'] = risk['data']
+    except asyncio.TimeoutError:
+        logger.info(f"Portfolio risk for session {session_id} missed the {RISK_BUDGET}s budget")
+    return analysis
+
+async def _fetch_intent_data(app, intent: str, session_id: str, context_task: asyncio.Task):
+    """Load the data an intent's handler needs (market overview, portfolio analytics, learning level)"""
+    if intent == 'market_data':
+        return await _run_in_thread(app, market_snapshot_service.get_market_overview)
+    if intent == 'portfolio_analysis':
+        return await _fetch_portfolio_analysis(app, session_id, context_task)
+    if intent == 'educational':
+        return await _run_in_thread(app, context_service.get_user_learning_progress, session_id)
+    return None
+
+async def _gather_message_inputs(app, session_id: str, user_message: str, context: dict = None) -> dict:
+    """Load everything the response handler needs, running independent stages concurrently.
+    
+    Context loading (skipped when `context` was already loaded) and intent
+    classification start together (the session itself is upserted with the
+    message in _finalize_message).
+    Data for the locally predicted intent is prefetched speculatively so it is usually
+    ready by the time the (possibly LLM-backed) classification settles.
+    """
+    timings = {}
+    gather_start = time.perf_counter()
+    
+    async def timed(stage, awaitable):
+        stage_start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            timings[stage] = round((time.perf_counter() - stage_start) * 1000, 1)
+    
+    local_intent = intent_classifier.classify(user_message)
+    
+    if context is not None:
+        context_task = asyncio.get_running_loop().create_future()
+        context_task.set_result(context)
+    else:
+        context_task = asyncio.create_task(timed('context', _run_in_thread(
+            app, context_service.get_session_context, session_id
+        )))
+    intent_task = asyncio.create_task(timed('intent', _classify_intent(user_message, local_intent)))
+    
+    prefetch_tasks = {
+        local_intent['intent']: asyncio.create_task(timed(
+            f"prefetch_{local_intent['intent']}", _fetch_intent_data(app, local_intent['intent'], session_id, context_task)
+        ))
+    }
+    
+    try:
+        intent_result = await intent_task
+        
+        intent = intent_result['intent']
+        if intent not in prefetch_tasks:
+            prefetch_tasks[intent] = asyncio.create_task(timed(
+                f"fetch_{intent}", _fetch_intent_data(app, intent, session_id, context_task)
+            ))
+        
+        context, intent_data = await asyncio.gather(context_task, prefetch_tasks[intent])
+    finally:
+        # Wrong speculative guesses (or failures) must not leave tasks behind
+        for task in [context_task, *prefetch_tasks.values()]:
+            if not task.done():
+                task.cancel()
+    
+    timings['critical_path'] = round((time.perf_counter() - gather_start) * 1000, 1)
+    
+    return {
+        'context': context,
+        'intent': intent_result,
+        'intent_data': intent_data,
+        'timings': timings
+    }
+
+async def _refresh_conversation_summary(app, session_id: str):
+    """Fold older messages into the session's rolling summary when a refresh is due"""
+    try:
+        batch = await _run_in_thread(app, context_service.get_messages_to_summarize, session_id)
+        if not batch:
+            return
+        
+        result = await openai_service.summarize_conversation(batch['summary'], batch['turns'])
+        await _run_in_thread(app, rate_limiter.record_tokens, session_id, result['tokens_used'])
+        if result['summary']:
+            await _run_in_thread(app, context_service.store_summary, session_id, result['summary'], batch)
+    except Exception as e:
+        logger.error(f"Error refreshing conversation summary: {e}")
+    finally:
+        with _summaries_lock:
+            _summaries_in_flight.discard(session_id)
+
+def _schedule_summary_refresh(session_id: str):
+    """Start a background summary refresh unless one is already running for the session"""
+    with _summaries_lock:
+        if session_id in _summaries_in_flight:
+            return
+        _summaries_in_flight.add(session_id)
+    async_runner.submit(_refresh_conversation_summary(current_app._get_current_object(), session_id))
+
+def _shared_cache_scope(intent: str, context: dict, user_message: str, learning_level: str = 'beginner'):
+    """Cross-session cache scope for a message, or None when its answer depends on the session.
+    
+    Only standalone questions at the start of a conversation are shared;
+    educational answers are shared per learning level.
+    """
+    if context.get('recent_messages') or is_follow_up(user_message):
+        return None
+    if intent == 'educational':
+        return f"educational:{learning_level}"
+    if intent == 'general_financial':
+        return 'general_financial'
+    return None
+
+def _build_response_plan(session_id: str, user_message: str, user_tier: int, context: dict = None):
+    """Gather context, classify intent and pick the OpenAI handler for a message.
+    
+    The plan exposes the handler both as a coroutine factory (`complete`) and as an
+    async token stream factory (`stream`) so the JSON and SSE endpoints share routing.
+    Both run on the shared async runner loop. `shared_cache_scope` is set when the
+    answer does not depend on the session, so it can be served from the cross-session cache.
+    """
+    inputs = async_runner.run(
+        _gather_message_inputs(current_app._get_current_object(), session_id, user_message, context),
+        timeout=INTENT_TIMEOUT
+    )
+    logger.info(f"Message input stage timings for session {session_id}: {inputs['timings']}")
+    
+    context = inputs['context']
+    intent_result = inputs['intent']
+    intent_data = inputs['intent_data']
+    timings = inputs['timings']
+    
+    # Extract context from current message
+    message_context = context_service.extract_context_from_message(user_message)
+    context.update(message_context)
+    # The request's tier: a new session's context has no session_info yet
+    context['user_tier'] = user_tier
+    
+    if intent_result['intent'] == 'market_data':
+        # Get market data and interpret
+        market_data = intent_data
+        if market_data['success']:
+            return {
+                'intent': intent_result,
+                'timings': timings,
+                'context_used': {'market_data': market_data['data'], 'intent': intent_result},
+                'complete': lambda: openai_service.get_market_interpretation(
+                    market_data['data'], user_message, context
+                ),
+                'stream': lambda: openai_service.stream_market_interpretation(
+                    market_data['data'], user_message, context
+                )
+            }
+    
+    elif intent_result['intent'] == 'portfolio_analysis':
+        # Analytics of the saved (or demo) portfolio; fall back to the raw saved data
+        if intent_data and intent_data['success']:
+            portfolio_data = intent_data['data']
+        else:
+            portfolio_data = context.get('user_context', {}).get('portfolio_data', {})
+        
+        return {
+            'intent': intent_result,
+            'timings': timings,
+            'context_used': {'portfolio_data': portfolio_data, 'intent': intent_result},
+            'complete': lambda: openai_service.analyze_portfolio_question(
+                user_message, portfolio_data, context
+            ),
+            'stream': lambda: openai_service.stream_portfolio_question(
+                user_message, portfolio_data, context
+            )
+        }
+    
+    elif intent_result['intent'] == 'educational':
+        # Get user's learning level
+        learning_progress = intent_data
+        user_level = learning_progress.get('level', 'beginner')
+        
+        # Extract topic from message
+        topic = user_message  # Simplified - in production, extract specific topic
+        
+        return {
+            'intent': intent_result,
+            'timings': timings,
+            'shared_cache_scope': _shared_cache_scope('educational', context, user_message, user_level),
+            'context_used': {'learning_level': user_level, 'topic': topic, 'intent': intent_result},
+            'complete': lambda: openai_service.generate_educational_response(topic, user_level, context),
+            'stream': lambda: openai_service.stream_educational_response(topic, user_level, context)
+        }
+    
+    # General financial query (also used when market data is unavailable)
+    return {
+        'intent': intent_result,
+        'timings': timings,
+        'shared_cache_scope': _shared_cache_scope(intent_result['intent'], context, user_message),
+        'context_used': {'intent': intent_result},
+        'complete': lambda: openai_service.process_financial_query(user_message, context),
+        'stream': lambda: openai_service.stream_financial_query(user_message, context)
+    }
+
+def _finalize_message(session_id: str, user_message: str, ai_response: str, plan: dict, start_time: float,
+                      user_tier: int, tokens_used: int = 0, cache_shared: bool = False) -> int:
+    """Persist, cache and charge tokens for a completed exchange; returns the response time in ms.
+    
+    The message itself was already counted when the rate limit reservation was made.
+    """
+    # Calculate response time
+    response_time_ms = int((time.time() - start_time) * 1000)
+    
+    # Upsert the session and save the message in one transaction
+    saved_message = context_service.save_message(
+        session_id, user_message, ai_response, plan['context_used'], response_time_ms, tokens_used,
+        user_tier=user_tier
+    )
+    
+    # Charge the token budget
+    rate_limiter.record_tokens(session_id, tokens_used)
+    
+    if not saved_message:
+        logger.error("Failed to save message to database")
+    else:
+        # Keeps prompt size flat on long sessions; runs off the request path
+        _schedule_summary_refresh(session_id)
+    
+    # Cache the response
+    cache_service.cache_response(session_id, user_message, ai_response)
+    if cache_shared and plan.get('shared_cache_scope'):
+        cache_service.cache_shared_response(user_message, user_tier, plan['shared_cache_scope'], ai_response)
+    
+    return response_time_ms
+
+def _get_shared_response(user_message: str, user_tier: int, plan: dict, checked_scope: str = None):
+    """Look up the cross-session cache for plans that allow it (unless that scope was already checked)"""
+    if not plan.get('shared_cache_scope') or plan['shared_cache_scope'] == checked_scope:
+        return None
+    return cache_service.get_shared_response(user_message, user_tier, plan['shared_cache_scope'])
+
+def _plan_from_shared_cache(session_id: str, user_message: str, user_tier: int):
+    """Serve a standalone question from the cross-session cache before intent and data loading.
+    
+    Uses only the local classifier, so a hit costs no LLM call and no prefetch.
+    Returns (plan, response, context): the plan is None when the message cannot
+    be shared, the response None on a miss, and a loaded context is reused by
+    _build_response_plan.
+    """
+    local_intent = intent_classifier.classify(user_message)
+    if (local_intent['intent'] not in ('educational', 'general_financial')
+            or not intent_classifier.is_confident(local_intent) or is_follow_up(user_message)):
+        return None, None, None
+    
+    context = context_service.get_session_context(session_id)
+    learning_level = ((context.get('user_context') or {}).get('learning_progress') or {}).get('level', 'beginner')
+    scope = _shared_cache_scope(local_intent['intent'], context, user_message, learning_level)
+    if not scope:
+        return None, None, context
+    
+    context_used = {'intent': local_intent}
+    if local_intent['intent'] == 'educational':
+        context_used.update(learning_level=learning_level, topic=user_message)
+    plan = {'intent': local_intent, 'timings': {}, 'shared_cache_scope': scope, 'context_used': context_used}
+    return plan, cache_service.get_shared_response(user_message, user_tier, scope), context
 
 @chat_bp.route('/chat/message', methods=['POST'])
 def send_message():
     """Send a message to the AI assistant"""
+    if _wants_event_stream():
+        return stream_message()
+    
+    message_info = None
     try:
-        # Validate input
-        data = request.get_json()
-        if not data:
-            return jsonify({'error': 'No data provided'}), 400
-        
-        validation_result = validate_message_input(data)
-        if not validation_result['valid']:
-            return jsonify({'error': validation_result['error']}), 400
-        
-        user_message = data['message']
-        session_id = session.get('session_id')
-        
-        if not session_id:
-            return jsonify({'error': 'No session found'}), 400
+        message_info, error_response = _validate_message_request()
+        if error_response:
+            return error_response
         
-        # Check rate limits
-        user_tier = session.get('user_tier', 1)
-        if not rate_limiter.check_rate_limit(session_id, user_tier):
-            return jsonify({'error': 'Rate limit exceeded. Please try again later.'}), 429
-        
-        # Check daily message limits
-        if not rate_limiter.check_daily_limit(session_id, user_tier):
-            tier_limits = {1: 10, 2: 50, 3: 100, 4: 200, 5: 500, 6: 1000, 7: -1}
-            limit = tier_limits.get(user_tier, 10)
-            message = f"Daily message limit reached ({limit} messages). Please upgrade your tier for more messages."
-            return jsonify({'error': message}), 429
+        user_message = message_info['user_message']
+        session_id = message_info['session_id']
         
-        # Check for cached response
+        # Check for cached response (served without using quota)
         cached_response = cache_service.get_cached_response(session_id, user_message)
         if cached_response:
             logger.info(f"Returning cached response for session {session_id}")
-            return jsonify({
+            rate_limiter.release(session_id, message_info['reservation'])
+            return _with_rate_limit_headers(jsonify({
                 'response': cached_response,
                 'cached': True,
                 'timestamp': datetime.now().isoformat()
-            })
+            }), message_info)
         
         start_time = time.time()
         
-        # Get or create session
-        chat_session = context_service.create_or_update_session(session_id, user_tier)
-        if not chat_session:
-            return jsonify({'error': 'Failed to create session'}), 500
-        
-        # Get session context
-        context = context_service.get_session_context(session_id)
-        
-        # Extract context from current message
-        message_context = context_service.extract_context_from_message(user_message)
-        context.update(message_context)
-        
-        # Classify user intent
-        def classify_intent():
-            return asyncio.run(openai_service.classify_user_intent(user_message))
-        
-        intent_result = executor.submit(classify_intent).result(timeout=10)
-        
-        # Route to appropriate handler based on intent
-        ai_response = None
-        context_used = {}
-        
-        if intent_result['intent'] == 'market_data':
-            # Get market data and interpret
-            market_data = financial_data_service.get_market_overview()
-            if market_data['success']:
-                def get_market_interpretation():
-                    return asyncio.run(openai_service.get_market_interpretation(
-                        market_data['data'], user_message, context
-                    ))
-                
-                response_result = executor.submit(get_market_interpretation).result(timeout=15)
-                ai_response = response_result['response']
-                context_used = {'market_data': market_data['data'], 'intent': intent_result}
-        
-        elif intent_result['intent'] == 'portfolio_analysis':
-            # Get portfolio data from context
-            portfolio_data = context.get('user_context', {}).get('portfolio_data', {})
-            if not portfolio_data:
-                # Generate mock portfolio for demonstration
-                portfolio_data = financial_data_service.get_portfolio_analysis({})['data']
-            
-            def analyze_portfolio():
-                return asyncio.run(openai_service.analyze_portfolio_question(
-                    user_message, portfolio_data, context
-                ))
-            
-            response_result = executor.submit(analyze_portfolio).result(timeout=15)
-            ai_response = response_result['response']
-            context_used = {'portfolio_data': portfolio_data, 'intent': intent_result}
-        
-        elif intent_result['intent'] == 'educational':
-            # Get user's learning level
-            learning_progress = context_service.get_user_learning_progress(session_id)
-            user_level = learning_progress.get('level', 'beginner')
-            
-            # Extract topic from message
-            topic = user_message  # Simplified - in production, extract specific topic
-            
-            def get_educational_response():
-                return asyncio.run(openai_service.generate_educational_response(
-                    topic, user_level, context
-                ))
-            
-            response_result = executor.submit(get_educational_response).result(timeout=15)
-            ai_response = response_result['response']
-            context_used = {'learning_level': user_level, 'topic': topic, 'intent': intent_result}
-        
+        user_tier = message_info['user_tier']
+        shared_plan, shared_response, context = _plan_from_shared_cache(session_id, user_message, user_tier)
+        if shared_response:
+            plan = shared_plan
         else:
-            # General financial query
-            def get_financial_response():
-                return asyncio.run(openai_service.process_financial_query(user_message, context))
-            
-            response_result = executor.submit(get_financial_response).result(timeout=15)
+            plan = _build_response_plan(session_id, user_message, user_tier, context)
+            shared_response = _get_shared_response(
+                user_message, user_tier, plan, shared_plan and shared_plan['shared_cache_scope']
+            )
+        response_result = {}
+        if shared_response:
+            ai_response = shared_response
+        else:
+            response_result = async_runner.run(plan['complete'](), timeout=RESPONSE_TIMEOUT)
             ai_response = response_result['response']
-            context_used = {'intent': intent_result}
-        
-        # Calculate response time
-        response_time_ms = int((time.time() - start_time) * 1000)
         
-        # Save message to database
-        saved_message = context_service.save_message(
-            session_id, user_message, ai_response, context_used, response_time_ms
+        tokens_used = plan['intent'].get('tokens_used', 0) + response_result.get('tokens_used', 0)
+        response_time_ms = _finalize_message(
+            session_id, user_message, ai_response, plan, start_time, user_tier, tokens_used,
+            cache_shared=not shared_response and 'error' not in response_result
         )
         
-        if not saved_message:
-            logger.error("Failed to save message to database")
-        
-        # Cache the response
-        cache_service.cache_response(session_id, user_message, ai_response)
-        
-        # Update rate limiter
-        rate_limiter.increment_usage(session_id)
+        # Upstream failures are answered with an apology but do not use quota
+        if 'error' in response_result:
+            rate_limiter.release(session_id, message_info['reservation'])
         
-        return jsonify({
+        return _with_rate_limit_headers(jsonify({
             'response': ai_response,
             'response_time_ms': response_time_ms,
-            'intent': intent_result['intent'],
-            'context_used': bool(context_used),
+            'tokens_used': tokens_used,
+            'intent': plan['intent']['intent'],
+            'context_used': bool(plan['context_used']),
+            'stage_timings_ms': plan['timings'],
             'timestamp': datetime.now().isoformat(),
-            'cached': False
-        })
+            'cached': bool(shared_response)
+        }), message_info)
     
+    except Exception as e:
+        logger.error(f"Error processing message: {e}")
+        if message_info:
+            rate_limiter.release(message_info['session_id'], message_info['reservation'])
+        return jsonify({'error': 'An error occurred while processing your message'}), 500
+
+@chat_bp.route('/chat/message/stream', methods=['POST'])
+def stream_message():
+    """Send a message to the AI assistant and stream the reply as Server-Sent Events"""
+    try:
+        message_info, error_response = _validate_message_request()
+        if error_response:
+            return error_response
     except Exception as e:
         logger.error(f"Error processing message: {e}")
         return jsonify({'error': 'An error occurred while processing your message'}), 500
+    
+    user_message = message_info['user_message']
+    session_id = message_info['session_id']
+    
+    def generate():
+        try:
+            # Check for cached response
+            cached_response = cache_service.get_cached_response(session_id, user_message)
+            if cached_response:
+                logger.info(f"Returning cached response for session {session_id}")
+                rate_limiter.release(session_id, message_info['reservation'])
+                yield _sse_event('token', {'content': cached_response})
+                yield _sse_event('done', {
+                    'response': cached_response,
+                    'cached': True,
+                    'timestamp': datetime.now().isoformat()
+                })
+                return
+            
+            start_time = time.time()
+            
+            user_tier = message_info['user_tier']
+            shared_plan, shared_response, context = _plan_from_shared_cache(session_id, user_message, user_tier)
+            if shared_response:
+                plan = shared_plan
+            else:
+                plan = _build_response_plan(session_id, user_message, user_tier, context)
+                shared_response = _get_shared_response(
+                    user_message, user_tier, plan, shared_plan and shared_plan['shared_cache_scope']
+                )
+            
+            yield _sse_event('meta', {'intent': plan['intent']['intent']})
+            stream_failed = False
+            tokens_used = plan['intent'].get('tokens_used', 0)
+            if shared_response:
+                ai_response = shared_response
+                yield _sse_event('token', {'content': shared_response})
+            else:
+                ai_response = ''
+                for event in async_runner.iterate(plan['stream'](), timeout=RESPONSE_TIMEOUT):
+                    if event['type'] == 'token':
+                        yield _sse_event('token', {'content': event['content']})
+                    else:
+                        ai_response = event['response']
+                        tokens_used += event.get('tokens_used', 0)
+                        stream_failed = 'error' in event
+            
+            response_time_ms = _finalize_message(
+                session_id, user_message, ai_response, plan, start_time, user_tier, tokens_used,
+                cache_shared=not shared_response and not stream_failed
+            )
+            
+            # Upstream failures are answered with an apology but do not use quota
+            if stream_failed:
+                rate_limiter.release(session_id, message_info['reservation'])
+            
+            yield _sse_event('done', {
+                'response': ai_response,
+                'response_time_ms': response_time_ms,
+                'tokens_used': tokens_used,
+                'intent': plan['intent']['intent'],
+                'context_used': bool(plan['context_used']),
+                'stage_timings_ms': plan['timings'],
+                'timestamp': datetime.now().isoformat(),
+                'cached': bool(shared_response)
+            })
+        
+        except Exception as e:
+            logger.error(f"Error streaming message: {e}")
+            rate_limiter.release(session_id, message_info['reservation'])
+            yield _sse_event('error', {'error': 'An error occurred while processing your message'})
+    
+    return _with_rate_limit_headers(Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    ), message_info)
 
 @chat_bp.route('/chat/history/<session_id>', methods=['GET'])
 def get_chat_history(session_id):
-    """Get chat history for a session"""
+    """Get a page of chat history for a session.
+    
+    Query params: limit (max 100), cursor (from next_cursor) and fields
+    (comma-separated projection, e.g. user_message,ai_response,timestamp).
+    """
     try:
         # Validate session ID
         if not validate_session_id(session_id):
@@ -191,15 +598,31 @@ def get_chat_history(session_id):
             return jsonify({'error': 'Unauthorized'}), 401
         
         limit = request.args.get('limit', 20, type=int)
-        limit = min(limit, 100)  # Cap at 100 messages
+        limit = max(1, min(limit, 100))  # Cap at 100 messages per page
         
-        history = context_service.get_conversation_history(session_id, limit)
+        fields_validation = validate_history_fields(request.args.get('fields', ''))
+        if not fields_validation['valid']:
+            return jsonify({'error': fields_validation['error']}), 400
         
-        return jsonify({
-            'history': history,
+        try:
+            page = context_service.get_history_page(
+                session_id, limit, request.args.get('cursor'), fields_validation['fields']
+            )
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        
+        response = jsonify({
+            'history': page['messages'],
             'session_id': session_id,
-            'total_messages': len(history)
+            'total_messages': len(page['messages']),
+            'next_cursor': page['next_cursor'],
+            'has_more': page['has_more']
         })
+        
+        # Let clients revalidate unchanged pages with If-None-Match
+        response.add_etag()
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
     
     except Exception as e:
         logger.error(f"Error getting chat history: {e}")
@@ -306,12 +729,14 @@ def get_chat_status():
         user_tier = session.get('user_tier', 1)
         
         # Get usage statistics
-        usage_stats = rate_limiter.get_usage_stats(session_id)
+        usage_stats = rate_limiter.get_usage_stats(session_id, user_tier)
         
         return jsonify({
             'session_id': session_id,
             'user_tier': user_tier,
             'usage_stats': usage_stats,
+            'shared_cache_stats': cache_service.get_shared_cache_stats(),
+            'cache_stats': cache_service.get_cache_stats(),
             'timestamp': datetime.now().isoformat()
         })
     
@@ -77,7 +77,10 @@ def internal_error(error):
 # Initialize database
 with app.app_context():
     import models  # noqa: F401
-    db.create_all()
+    from utils.schema import schema_lock, upgrade_schema
+    with schema_lock(db):
+        db.create_all()
+        upgrade_schema(db)
     app.logger.info("Database initialized")
 
 if __name__ == "__main__":
@@ -0,0 +1,73 @@
+"""Benchmark provider HTTP calls against the local stub provider server.
+
+Compares a naive requests.get per call (new connection each time, no
+retries) with PolygonMarketDataProvider on the pooled, retrying HttpClient.
+No network access or API keys are needed:
+
+    python benchmarks/provider_http_benchmark.py --requests 2000 --workers 16 --latency 0.005
+
+Pass --error-rate to have the stub answer a share of requests with 503 and
+see how many calls still succeed with retries.
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+from services.market_providers import PolygonMarketDataProvider  # noqa: E402
+from benchmarks.stub_provider_server import start_server  # noqa: E402
+
+SYMBOLS = ["AAPL", "MSFT", "GOOGL", "AMZN", "NVDA", "META", "TSLA", "JPM"]
+
+def naive_quote(base_url: str, symbol: str) -> dict:
+    """One-off request without a session, the way a plain requests.get integration would do it"""
+    response = requests.get(f"{base_url}/v2/snapshot/locale/us/markets/stocks/tickers/{symbol}", timeout=10)
+    response.raise_for_status()
+    return response.json()
+
+def measure(label: str, func, total: int, workers: int):
+    """Run `func` `total` times across a thread pool and print throughput and latency percentiles"""
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            func(SYMBOLS[i % len(SYMBOLS)])
+            ok = True
+        except Exception:
+            ok = False
+        return (time.perf_counter() - start) * 1000, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(timed, range(total)))
+    elapsed = time.perf_counter() - started
+
+    samples = sorted(latency for latency, _ in results)
+    failures = sum(1 for _, ok in results if not ok)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:<16} {total / elapsed:8.1f} req/s   p50 {statistics.median(samples):7.2f} ms   "
+          f"p95 {p95:7.2f} ms   failed {failures}/{total}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.0, help="stub server latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of stub responses that are 503")
+    args = parser.parse_args()
+
+    server = start_server(latency=args.latency, error_rate=args.error_rate)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    print(f"Stub provider server on {base_url}, {args.requests} requests, {args.workers} workers")
+
+    provider = PolygonMarketDataProvider(api_key="benchmark", base_url=base_url)
+    measure("naive requests", lambda symbol: naive_quote(base_url, symbol), args.requests, args.workers)
+    measure("pooled client", provider.fetch_quote, args.requests, args.workers)
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Benchmark the session context database path.
+
+Seeds a database with many sessions and messages, then compares the
+original three-query context load with ContextService.load_session_bundle.
+
+Run against a throwaway database, for example:
+
+    DATABASE_URL=sqlite:///benchmark.db python benchmarks/session_context_benchmark.py --sessions 2000 --messages 500
+
+Pass --drop-index to measure without the (session_id, timestamp) index.
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, text  # noqa: E402
+from app import app, db  # noqa: E402
+from models import ChatSession, ChatMessage, UserContext  # noqa: E402
+from services.context_service import ContextService  # noqa: E402
+
+def seed(sessions: int, messages: int, batch_size: int = 5000) -> list:
+    """Insert sessions, one user context each and `messages` messages per session"""
+    session_ids = [str(uuid.uuid4()) for _ in range(sessions)]
+    now = datetime.utcnow()
+
+    db.session.execute(insert(ChatSession), [
+        {"id": sid, "user_tier": 1, "session_type": "general", "created_at": now, "updated_at": now}
+        for sid in session_ids
+    ])
+    db.session.execute(insert(UserContext), [
+        {"id": str(uuid.uuid4()), "session_id": sid, "user_preferences": {}, "portfolio_data": {},
+         "recent_activity": {}, "learning_progress": {}, "created_at": now, "updated_at": now}
+        for sid in session_ids
+    ])
+
+    batch = []
+    for sid in session_ids:
+        for i in range(messages):
+            batch.append({
+                "id": str(uuid.uuid4()),
+                "session_id": sid,
+                "user_message": f"Benchmark question {i}",
+                "ai_response": "Benchmark answer " * 20,
+                "context_used": {},
+                "response_time_ms": 0,
+                "tokens_used": 0,
+                "timestamp": now - timedelta(seconds=messages - i)
+            })
+            if len(batch) >= batch_size:
+                db.session.execute(insert(ChatMessage), batch)
+                batch = []
+    if batch:
+        db.session.execute(insert(ChatMessage), batch)
+
+    db.session.commit()
+    return session_ids
+
+def legacy_load(session_id: str, context_window: int) -> dict:
+    """The original per-entity queries"""
+    session = ChatSession.query.filter_by(id=session_id).first()
+    recent_messages = ChatMessage.query.filter_by(
+        session_id=session_id
+    ).order_by(ChatMessage.timestamp.desc()).limit(context_window).all()
+    user_context = UserContext.query.filter_by(session_id=session_id).first()
+    return {
+        "session_info": session.to_dict(),
+        "recent_messages": [msg.to_dict() for msg in reversed(recent_messages)],
+        "user_context": user_context.to_dict() if user_context else {}
+    }
+
+def measure(label: str, func, session_ids: list, iterations: int):
+    """Time `func` over random sessions and print latency percentiles"""
+    samples = []
+    for _ in range(iterations):
+        sid = random.choice(session_ids)
+        db.session.expire_all()
+        start = time.perf_counter()
+        func(sid)
+        samples.append((time.perf_counter() - start) * 1000)
+
+    samples.sort()
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:<16} mean {statistics.mean(samples):7.2f} ms   p50 {statistics.median(samples):7.2f} ms   p95 {p95:7.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=200, help="messages per session")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--drop-index", action="store_true")
+    args = parser.parse_args()
+
+    with app.app_context():
+        print(f"Seeding {args.sessions} sessions x {args.messages} messages into {db.engine.url}")
+        session_ids = seed(args.sessions, args.messages)
+
+        if args.drop_index:
+            db.session.execute(text("DROP INDEX IF EXISTS ix_chat_messages_session_timestamp"))
+            db.session.commit()
+
+        context_service = ContextService()
+        measure("legacy queries", lambda sid: legacy_load(sid, context_service.context_window), session_ids, args.iterations)
+        measure("session bundle", context_service.load_session_bundle, session_ids, args.iterations)
+
+if __name__ == "__main__":
+    main()
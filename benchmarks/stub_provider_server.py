@@ -0,0 +1,118 @@
+"""Local HTTP server imitating the Polygon and MarketAux endpoints we call.
+
+Serves canned JSON with configurable latency and a configurable share of
+503 responses, so provider adapters can be exercised and benchmarked
+offline. Point the adapters at it with:
+
+    python benchmarks/stub_provider_server.py --port 8099 --latency 0.02
+    POLYGON_BASE_URL=http://127.0.0.1:8099 MARKETAUX_BASE_URL=http://127.0.0.1:8099 \\
+        MARKET_DATA_PROVIDER=polygon NEWS_PROVIDER=marketaux python main.py
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def ticker_snapshot(ticker: str) -> dict:
+    """A Polygon-shaped ticker snapshot with deterministic prices per ticker"""
+    rng = random.Random(ticker)
+    close = round(rng.uniform(20, 500), 2)
+    change = round(rng.uniform(-0.03, 0.03) * close, 2)
+    return {
+        "ticker": ticker,
+        "todaysChange": change,
+        "todaysChangePerc": round(change / (close - change) * 100, 2),
+        "updated": time.time_ns(),
+        "day": {"o": close - change, "h": close * 1.01, "l": close * 0.99, "c": close, "v": rng.randint(10**5, 10**8)},
+        "prevDay": {"c": round(close - change, 2)},
+        "lastTrade": {"p": close}
+    }
+
+class StubProviderHandler(BaseHTTPRequestHandler):
+    """Routes the provider endpoints; settings live on the server object"""
+
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real providers
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        server = self.server
+        with server.stats_lock:
+            server.requests_served += 1
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and random.random() < server.error_rate:
+            self._send(503, {"status": "ERROR", "error": "stub overloaded"})
+            return
+
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path == "/v2/snapshot/locale/us/markets/stocks/tickers":
+            tickers = params.get("tickers", [""])[0].split(",")
+            self._send(200, {"status": "OK", "tickers": [ticker_snapshot(t) for t in tickers if t]})
+        elif url.path.startswith("/v2/snapshot/locale/us/markets/stocks/tickers/"):
+            self._send(200, {"status": "OK", "ticker": ticker_snapshot(url.path.rsplit("/", 1)[-1])})
+        elif url.path.startswith("/v2/aggs/ticker/"):
+            ticker = url.path.split("/")[4]
+            rng = random.Random(ticker)
+            close = ticker_snapshot(ticker)["day"]["c"]
+            closes = []
+            for _ in range(252):
+                closes.append(round(close, 2))
+                close /= 1 + rng.gauss(0.0004, 0.015)
+            bars = [{"c": c, "t": day} for day, c in enumerate(reversed(closes))]
+            self._send(200, {"status": "OK", "ticker": ticker, "results": bars})
+        elif url.path == "/v1/news/all":
+            limit = int(params.get("limit", ["3"])[0])
+            symbols = params.get("symbols", ["SPY"])[0].split(",")
+            self._send(200, {"data": [
+                {
+                    "title": f"Stub article {i} about {symbols[i % len(symbols)]}",
+                    "description": "Generated by the stub provider server.",
+                    "source": "stub.local",
+                    "published_at": datetime.now().isoformat(),
+                    "url": f"https://stub.local/news/{i}",
+                    "entities": [{"symbol": symbols[i % len(symbols)], "match_score": 50.0, "sentiment_score": 0.2}]
+                }
+                for i in range(limit)
+            ]})
+        else:
+            self._send(404, {"status": "NOT_FOUND"})
+
+def start_server(port: int = 0, latency: float = 0.0, error_rate: float = 0.0) -> ThreadingHTTPServer:
+    """Start the stub server in a daemon thread; port 0 picks a free port"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubProviderHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.error_rate = error_rate
+    server.requests_served = 0
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, name="stub-provider-server", daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.latency, args.error_rate)
+    print(f"Stub provider server listening on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
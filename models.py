@@ -1,6 +1,11 @@
 from app import db
-from sqlalchemy import String, Text, Integer, DateTime, JSON
+from sqlalchemy import String, Text, Integer, DateTime, JSON, Index
 from datetime import datetime
+from collections import OrderedDict
+from typing import Dict, Any, List, Tuple
+import threading
+import hashlib
+import json
 import uuid
 
 class ChatSession(db.Model):
@@ -40,21 +45,27 @@ class ChatMessage(db.Model):
     timestamp = db.Column(DateTime, default=datetime.utcnow)
     context_used = db.Column(JSON, default=dict)
     response_time_ms = db.Column(Integer, default=0)
+    tokens_used = db.Column(Integer, default=0)  # Total OpenAI tokens spent on this exchange
     
-    def to_dict(self):
+    def to_dict(self, resolve_snapshots: bool = True):
         return {
             'id': self.id,
             'session_id': self.session_id,
             'user_message': self.user_message,
             'ai_response': self.ai_response,
             'timestamp': self.timestamp.isoformat(),
-            'context_used': self.context_used,
-            'response_time_ms': self.response_time_ms
+            'context_used': ContextSnapshot.resolve(self.context_used) if resolve_snapshots else self.context_used,
+            'response_time_ms': self.response_time_ms,
+            'tokens_used': self.tokens_used or 0
         }
 
 class UserContext(db.Model):
     """User context model for storing user preferences and state"""
     __tablename__ = 'user_contexts'
+    __table_args__ = (
+        # One context row per session (a unique index so it can also be added to existing databases)
+        Index('uq_user_contexts_session_id', 'session_id', unique=True),
+    )
     
     id = db.Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     session_id = db.Column(String(36), db.ForeignKey('chat_sessions.id'), nullable=False)
@@ -76,3 +87,137 @@ class UserContext(db.Model):
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
+
+class ContextSnapshot(db.Model):
+    """Content-addressed store for large context_used values (market overviews, portfolios).
+    
+    Messages keep a {"$snapshot": hash} reference in place of each large value,
+    so identical snapshots are stored once however many messages use them.
+    """
+    __tablename__ = 'context_snapshots'
+    
+    REFERENCE_KEY = '$snapshot'
+    MIN_SIZE = 256  # Canonical JSON bytes below which values stay inline
+    CACHE_SIZE = 1024
+    
+    hash = db.Column(String(64), primary_key=True)  # sha256 of the canonical JSON
+    data = db.Column(JSON, nullable=False)
+    created_at = db.Column(DateTime, default=datetime.utcnow)
+    
+    # Snapshots never change, so contents can be cached per process indefinitely.
+    # The cache holds canonical JSON so every reader gets its own copy to mutate.
+    _cache = OrderedDict()
+    _persisted = OrderedDict()
+    _lock = threading.Lock()
+    
+    @staticmethod
+    def canonical_json(value: Any) -> str:
+        return json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+    
+    @classmethod
+    def _remember(cls, entries: OrderedDict, key: str, value: Any):
+        with cls._lock:
+            entries[key] = value
+            entries.move_to_end(key)
+            while len(entries) > cls.CACHE_SIZE:
+                entries.popitem(last=False)
+    
+    @classmethod
+    def dehydrate(cls, context_used: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Replace large values with references; returns (context, {hash: data} to store)"""
+        if not isinstance(context_used, dict):
+            return context_used, {}
+        
+        dehydrated, snapshots = {}, {}
+        for key, value in context_used.items():
+            if isinstance(value, (dict, list)):
+                canonical = cls.canonical_json(value)
+                if len(canonical) >= cls.MIN_SIZE:
+                    digest = hashlib.sha256(canonical.encode()).hexdigest()
+                    snapshots[digest] = value
+                    cls._remember(cls._cache, digest, canonical)
+                    value = {cls.REFERENCE_KEY: digest}
+            dehydrated[key] = value
+        return dehydrated, snapshots
+    
+    @classmethod
+    def insert_missing(cls, snapshots: Dict[str, Any]):
+        """Insert snapshots not yet stored, in the current transaction (no commit)"""
+        with cls._lock:
+            missing = {digest: data for digest, data in snapshots.items() if digest not in cls._persisted}
+        if not missing:
+            return
+        
+        rows = [{'hash': digest, 'data': data, 'created_at': datetime.utcnow()} for digest, data in missing.items()]
+        dialect_name = db.engine.dialect.name
+        if dialect_name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        elif dialect_name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            for row in rows:
+                if not db.session.get(cls, row['hash']):
+                    db.session.add(cls(**row))
+            db.session.flush()
+            return
+        
+        db.session.execute(dialect_insert(cls.__table__).values(rows).on_conflict_do_nothing(index_elements=['hash']))
+    
+    @classmethod
+    def mark_persisted(cls, snapshots: Dict[str, Any]):
+        """Record committed snapshots so later messages skip re-inserting them"""
+        for digest in snapshots:
+            cls._remember(cls._persisted, digest, True)
+    
+    @classmethod
+    def _references(cls, context_used: Any) -> Dict[str, str]:
+        """Map context keys holding a snapshot reference to the referenced hash"""
+        if not isinstance(context_used, dict):
+            return {}
+        return {
+            key: value[cls.REFERENCE_KEY] for key, value in context_used.items()
+            if isinstance(value, dict) and len(value) == 1 and cls.REFERENCE_KEY in value
+        }
+    
+    @classmethod
+    def resolve_many(cls, contexts: List[Any]) -> List[Any]:
+        """Replace snapshot references in several context_used values (one query for all cache misses).
+        
+        Resolved values are fresh copies, so callers may change them freely.
+        """
+        references = [cls._references(context_used) for context_used in contexts]
+        digests = {digest for context_references in references for digest in context_references.values()}
+        if not digests:
+            return contexts
+        
+        with cls._lock:
+            found = {digest: cls._cache[digest] for digest in digests if digest in cls._cache}
+        missing = digests - set(found)
+        if missing:
+            for snapshot in cls.query.filter(cls.hash.in_(sorted(missing))).all():
+                found[snapshot.hash] = cls.canonical_json(snapshot.data)
+                cls._remember(cls._cache, snapshot.hash, found[snapshot.hash])
+                cls._remember(cls._persisted, snapshot.hash, True)
+        
+        resolved = []
+        for context_used, context_references in zip(contexts, references):
+            if context_references:
+                context_used = dict(context_used)
+                for key, digest in context_references.items():
+                    if digest in found:
+                        context_used[key] = json.loads(found[digest])
+            resolved.append(context_used)
+        return resolved
+    
+    @classmethod
+    def resolve(cls, context_used: Dict[str, Any]) -> Dict[str, Any]:
+        """Replace snapshot references with their contents (one query for any cache misses)"""
+        return cls.resolve_many([context_used])[0]
+
+# History and context queries filter on session_id and sort newest first (with id as tie-breaker)
+Index(
+    'ix_chat_messages_session_timestamp',
+    ChatMessage.session_id,
+    ChatMessage.timestamp.desc(),
+    ChatMessage.id.desc()
+)
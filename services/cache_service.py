@@ -1,15 +1,123 @@
+import os
 import json
+import time
+import uuid
+import hashlib
 import logging
-from typing import Any, Optional
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
 from datetime import timedelta
+from redis.exceptions import WatchError
+from utils.text_similarity import normalize_text, minhash_signature, lsh_band_hashes, estimate_similarity, key_tokens, term_similarity
+
+# Redis channel used to tell every worker to drop local copies of changed keys
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+# Deletes a lock only if it is still held by the caller's token
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+class LocalCache:
+    """Bounded in-process LRU cache with per-entry TTL and an approximate memory cap.
+    
+    Values are kept as the serialized JSON read from Redis, so callers always get
+    a fresh object and cannot mutate each other's copies.
+    """
+    
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 32 * 1024 * 1024, max_ttl: int = 60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_ttl = max_ttl
+        self._entries = OrderedDict()  # key -> (expires_at, raw_value)
+        self._size = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[bytes]:
+        """Get a raw value if present and not expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, raw_value = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return raw_value
+    
+    def set(self, key: str, raw_value: bytes, ttl: float):
+        """Store a raw value for at most `max_ttl` seconds"""
+        ttl = min(ttl, self.max_ttl)
+        if ttl <= 0 or len(raw_value) > self.max_bytes:
+            return
+        
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, raw_value)
+            self._size += len(raw_value)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+    
+    def delete(self, key: str):
+        """Drop a key"""
+        with self._lock:
+            self._remove(key)
+    
+    def clear(self):
+        """Drop every key"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+    
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    @property
+    def size_bytes(self) -> int:
+        return self._size
 
 class CacheService:
     """Service for caching responses and data"""
     
-    def __init__(self, redis_client=None):
+    def __init__(self, redis_client=None, local_cache_enabled: bool = None):
         self.redis_client = redis_client
         self.logger = logging.getLogger(__name__)
         self.default_timeout = 300  # 5 minutes
+        self.shared_response_timeout = 86400  # 24 hours
+        self.session_index_timeout = 86400  # Must be >= the TTL of any session-scoped key
+        self.similarity_threshold = 0.7  # Minimum estimated shingle similarity for a near-duplicate candidate
+        self.term_similarity_threshold = 0.8  # Minimum content-term overlap for a near-duplicate hit
+        
+        # Optional per-process tier in front of Redis
+        if local_cache_enabled is None:
+            local_cache_enabled = os.environ.get("LOCAL_CACHE_ENABLED", "false").lower() == "true"
+        self.local_cache = None
+        if local_cache_enabled and redis_client:
+            self.local_cache = LocalCache(
+                max_entries=int(os.environ.get("LOCAL_CACHE_MAX_ENTRIES", "10000")),
+                max_bytes=int(os.environ.get("LOCAL_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+                max_ttl=int(os.environ.get("LOCAL_CACHE_MAX_TTL", "60"))
+            )
+        self.instance_id = uuid.uuid4().hex
+        self._subscriber_pid = None
+        self._subscriber_lock = threading.Lock()
+        
+        # Hit/miss counters per key family (prefix before the first ':')
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        
+        self.release_lock_script = redis_client.register_script(RELEASE_LOCK_SCRIPT) if redis_client else None
     
     def get(self, key: str) -> Optional[Any]:
         """Get cached value"""
@@ -17,40 +125,348 @@ class CacheService:
             return None
         
         try:
-            cached_value = self.redis_client.get(key)
+            if self.local_cache is not None:
+                self._ensure_invalidation_listener()
+                raw_value = self.local_cache.get(key)
+                if raw_value is not None:
+                    self._record_lookup(key, 'local_hits')
+                    return json.loads(raw_value)
+                
+                # Fetch the value and its remaining TTL in one round trip
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.get(key)
+                pipe.pttl(key)
+                cached_value, ttl_ms = pipe.execute()
+                if cached_value and ttl_ms and ttl_ms > 0:
+                    self.local_cache.set(key, cached_value, ttl_ms / 1000)
+            else:
+                cached_value = self.redis_client.get(key)
+            
             if cached_value:
+                self._record_lookup(key, 'redis_hits')
                 return json.loads(cached_value)
+            self._record_lookup(key, 'misses')
             return None
         except Exception as e:
             self.logger.error(f"Error getting cached value for key {key}: {e}")
             return None
     
-    def set(self, key: str, value: Any, timeout: int = None) -> bool:
-        """Set cached value"""
+    def set(self, key: str, value: Any, timeout: int = None, session_id: str = None) -> bool:
+        """Set cached value.
+        
+        Pass `session_id` for session-scoped keys so they are registered in the
+        session's key index (in the same round trip) and removed by clear_session_cache.
+        """
         if not self.redis_client:
             return False
         
         try:
             timeout = timeout or self.default_timeout
             serialized_value = json.dumps(value, default=str)
-            self.redis_client.setex(key, timeout, serialized_value)
+            if self.local_cache is None and not session_id:
+                self.redis_client.setex(key, timeout, serialized_value)
+                return True
+            
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.setex(key, timeout, serialized_value)
+            if session_id:
+                self._register_session_key(pipe, session_id, key)
+            if self.local_cache is not None:
+                self._publish_invalidation(pipe, [key])
+            pipe.execute()
+            if self.local_cache is not None:
+                self.local_cache.set(key, serialized_value.encode(), timeout)
             return True
         except Exception as e:
             self.logger.error(f"Error setting cached value for key {key}: {e}")
             return False
     
+    def update(self, key: str, mutate, timeout: int = None, session_id: str = None, max_retries: int = 5) -> bool:
+        """Apply `mutate` to a cached value atomically with WATCH/MULTI.
+        
+        `mutate` changes the value in place and may run more than once if another
+        writer gets in first. Missing keys stay missing. If the retries run out
+        the key is deleted so the next reader rebuilds it instead of seeing a
+        lost update. Returns True if the value was written.
+        """
+        if not self.redis_client:
+            return False
+        
+        try:
+            timeout = timeout or self.default_timeout
+            for _ in range(max_retries):
+                with self.redis_client.pipeline() as pipe:
+                    try:
+                        pipe.watch(key)
+                        cached_value = pipe.get(key)
+                        if not cached_value:
+                            return False
+                        value = json.loads(cached_value)
+                        mutate(value)
+                        
+                        pipe.multi()
+                        pipe.setex(key, timeout, json.dumps(value, default=str))
+                        if session_id:
+                            self._register_session_key(pipe, session_id, key)
+                        if self.local_cache is not None:
+                            self._publish_invalidation(pipe, [key])
+                        pipe.execute()
+                    except WatchError:
+                        continue
+                # Dropped rather than refreshed: a concurrent writer may already have replaced it
+                if self.local_cache is not None:
+                    self.local_cache.delete(key)
+                return True
+            
+            self.logger.warning(f"Gave up updating {key} after {max_retries} conflicts")
+            self.delete(key)
+            return False
+        except Exception as e:
+            self.logger.error(f"Error updating cached value for key {key}: {e}")
+            self.delete(key)
+            return False
+    
+    def load_and_set(self, key: str, loader, version_key: str, timeout: int = None,
+                     session_id: str = None) -> Optional[Any]:
+        """Load a value with `loader` and cache it unless `version_key` changed meanwhile.
+        
+        Writers that find nothing cached to update call bump_version, so a value
+        loaded before their write cannot overwrite it. The loaded value is
+        returned whether or not it was cached.
+        """
+        if not self.redis_client:
+            return loader()
+        
+        with self.redis_client.pipeline() as pipe:
+            try:
+                pipe.watch(version_key)
+            except Exception as e:
+                self.logger.error(f"Error watching {version_key}: {e}")
+                return loader()
+            
+            value = loader()
+            if value is None:
+                return None
+            
+            try:
+                serialized_value = json.dumps(value, default=str)
+                timeout = timeout or self.default_timeout
+                pipe.multi()
+                pipe.setex(key, timeout, serialized_value)
+                if session_id:
+                    self._register_session_key(pipe, session_id, key)
+                if self.local_cache is not None:
+                    self._publish_invalidation(pipe, [key])
+                pipe.execute()
+                if self.local_cache is not None:
+                    self.local_cache.set(key, serialized_value.encode(), timeout)
+            except WatchError:
+                self.logger.debug(f"{key} changed while loading, not caching it")
+            except Exception as e:
+                self.logger.error(f"Error setting cached value for key {key}: {e}")
+        return value
+    
+    def bump_version(self, version_key: str, timeout: int = None) -> bool:
+        """Mark data as changed so in-progress load_and_set calls for it do not cache"""
+        if not self.redis_client:
+            return False
+        
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.incr(version_key)
+            pipe.expire(version_key, timeout or self.default_timeout)
+            pipe.execute()
+            return True
+        except Exception as e:
+            self.logger.error(f"Error bumping version {version_key}: {e}")
+            return False
+    
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Get several cached values in one round trip; missing keys are left out"""
+        if not self.redis_client or not keys:
+            return {}
+        
+        try:
+            found = {}
+            remote_keys = keys
+            if self.local_cache is not None:
+                self._ensure_invalidation_listener()
+                remote_keys = []
+                for key in keys:
+                    raw_value = self.local_cache.get(key)
+                    if raw_value is not None:
+                        self._record_lookup(key, 'local_hits')
+                        found[key] = json.loads(raw_value)
+                    else:
+                        remote_keys.append(key)
+                if not remote_keys:
+                    return found
+                
+                # Values and remaining TTLs together so local copies expire with Redis
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.mget(remote_keys)
+                for key in remote_keys:
+                    pipe.pttl(key)
+                cached_values, *ttls = pipe.execute()
+                for key, cached_value, ttl_ms in zip(remote_keys, cached_values, ttls):
+                    if cached_value and ttl_ms and ttl_ms > 0:
+                        self.local_cache.set(key, cached_value, ttl_ms / 1000)
+            else:
+                cached_values = self.redis_client.mget(remote_keys)
+            
+            for key, cached_value in zip(remote_keys, cached_values):
+                if cached_value:
+                    self._record_lookup(key, 'redis_hits')
+                    found[key] = json.loads(cached_value)
+                else:
+                    self._record_lookup(key, 'misses')
+            return found
+        except Exception as e:
+            self.logger.error(f"Error getting {len(keys)} cached values: {e}")
+            return {}
+    
+    def set_many(self, values: Dict[str, Any], timeout: int = None) -> bool:
+        """Set several cached values with the same timeout in one round trip"""
+        if not self.redis_client or not values:
+            return False
+        
+        try:
+            timeout = timeout or self.default_timeout
+            serialized_values = {key: json.dumps(value, default=str) for key, value in values.items()}
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key, serialized_value in serialized_values.items():
+                pipe.setex(key, timeout, serialized_value)
+            if self.local_cache is not None:
+                self._publish_invalidation(pipe, list(serialized_values))
+            pipe.execute()
+            if self.local_cache is not None:
+                for key, serialized_value in serialized_values.items():
+                    self.local_cache.set(key, serialized_value.encode(), timeout)
+            return True
+        except Exception as e:
+            self.logger.error(f"Error setting {len(values)} cached values: {e}")
+            return False
+    
     def delete(self, key: str) -> bool:
         """Delete cached value"""
         if not self.redis_client:
             return False
         
         try:
-            self.redis_client.delete(key)
+            if self.local_cache is not None:
+                self.local_cache.delete(key)
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.delete(key)
+                self._publish_invalidation(pipe, [key])
+                pipe.execute()
+            else:
+                self.redis_client.delete(key)
             return True
         except Exception as e:
             self.logger.error(f"Error deleting cached value for key {key}: {e}")
             return False
     
+    def acquire_lock(self, name: str, timeout_ms: int) -> Optional[str]:
+        """Take a short-lived cross-process lock; returns a release token or None if it is held.
+        
+        Without Redis there is nothing to coordinate with, so the lock is always granted.
+        """
+        token = uuid.uuid4().hex
+        if not self.redis_client:
+            return token
+        
+        try:
+            if self.redis_client.set(f"lock:{name}", token, nx=True, px=timeout_ms):
+                return token
+            return None
+        except Exception as e:
+            self.logger.error(f"Error acquiring lock {name}: {e}")
+            return token  # Fail open: a duplicate upstream call beats a stalled request
+    
+    def release_lock(self, name: str, token: str) -> bool:
+        """Release a lock taken with acquire_lock (no-op if it expired or changed hands)"""
+        if not self.redis_client:
+            return True
+        
+        try:
+            return bool(self.release_lock_script(keys=[f"lock:{name}"], args=[token]))
+        except Exception as e:
+            self.logger.error(f"Error releasing lock {name}: {e}")
+            return False
+    
+    def _publish_invalidation(self, pipe, keys: List[str]):
+        """Queue an invalidation broadcast for other workers on a pipeline"""
+        pipe.publish(INVALIDATION_CHANNEL, json.dumps({"origin": self.instance_id, "keys": keys}))
+    
+    def _ensure_invalidation_listener(self):
+        """Start the pub/sub listener thread once per process"""
+        if self._subscriber_pid == os.getpid():
+            return
+        
+        with self._subscriber_lock:
+            if self._subscriber_pid == os.getpid():
+                return
+            # Anything cached before a fork may have missed invalidations
+            self.local_cache.clear()
+            thread = threading.Thread(target=self._listen_for_invalidations, name="cache-invalidation", daemon=True)
+            thread.start()
+            self._subscriber_pid = os.getpid()
+    
+    def _listen_for_invalidations(self):
+        """Drop local copies of keys changed by other workers"""
+        while True:
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                for message in pubsub.listen():
+                    payload = json.loads(message["data"])
+                    if payload.get("origin") == self.instance_id:
+                        continue
+                    for key in payload.get("keys", []):
+                        self.local_cache.delete(key)
+            except Exception as e:
+                self.logger.error(f"Cache invalidation listener error: {e}")
+                # Updates may have been missed while disconnected
+                self.local_cache.clear()
+                time.sleep(1)
+    
+    def _record_lookup(self, key: str, outcome: str):
+        """Count a lookup outcome (local_hits, redis_hits or misses) for the key's family"""
+        family = key.split(":", 1)[0]
+        with self._stats_lock:
+            family_stats = self.stats.setdefault(family, {'local_hits': 0, 'redis_hits': 0, 'misses': 0})
+            family_stats[outcome] += 1
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Get per-family hit/miss statistics for this process"""
+        with self._stats_lock:
+            families = {}
+            for family, counts in self.stats.items():
+                lookups = sum(counts.values())
+                hits = counts['local_hits'] + counts['redis_hits']
+                families[family] = {
+                    **counts,
+                    'hit_rate': round(hits / lookups, 4) if lookups else 0.0
+                }
+        
+        return {
+            'local_cache_enabled': self.local_cache is not None,
+            'local_entries': len(self.local_cache) if self.local_cache is not None else 0,
+            'local_bytes': self.local_cache.size_bytes if self.local_cache is not None else 0,
+            'families': families
+        }
+    
+    def get_session_index_key(self, session_id: str) -> str:
+        """Generate key for the set of cache keys belonging to a session"""
+        return f"session_keys:{session_id}"
+    
+    def _register_session_key(self, pipe, session_id: str, key: str):
+        """Queue adding a key to its session's index on a pipeline"""
+        index_key = self.get_session_index_key(session_id)
+        pipe.sadd(index_key, key)
+        # Outlives every session-scoped entry; stale members are harmless on delete
+        pipe.expire(index_key, self.session_index_timeout)
+    
     def get_conversation_cache_key(self, session_id: str, message_hash: str) -> str:
         """Generate cache key for conversation responses"""
         return f"conversation:{session_id}:{message_hash}"
@@ -63,6 +479,14 @@ class CacheService:
         """Generate cache key for news data"""
         return f"news:{symbols}"
     
+    def get_shared_response_cache_key(self, user_tier: int, scope: str, text_hash: str) -> str:
+        """Generate cache key for cross-session responses"""
+        return f"shared_response:{user_tier}:{scope}:{text_hash}"
+    
+    def get_shared_bucket_cache_key(self, user_tier: int, scope: str, band: int, band_hash: str) -> str:
+        """Generate cache key for a near-duplicate (LSH) bucket"""
+        return f"shared_bucket:{user_tier}:{scope}:{band}:{band_hash}"
+    
     def cache_response(self, session_id: str, user_message: str, ai_response: str, timeout: int = None) -> bool:
         """Cache AI response for similar queries"""
         try:
@@ -77,7 +501,7 @@ class CacheService:
                 "timestamp": str(timedelta(seconds=timeout or self.default_timeout))
             }
             
-            return self.set(key, cache_data, timeout)
+            return self.set(key, cache_data, timeout, session_id=session_id)
         except Exception as e:
             self.logger.error(f"Error caching response: {e}")
             return False
@@ -97,6 +521,123 @@ class CacheService:
             self.logger.error(f"Error getting cached response: {e}")
             return None
     
+    def get_shared_response(self, user_message: str, user_tier: int, scope: str) -> Optional[str]:
+        """Get a cross-session response for a context-independent question.
+        
+        Tries the normalized text first, then near-duplicates found through the
+        MinHash/LSH buckets. A near-duplicate only counts when its numbers and
+        tickers match exactly and its content terms nearly all match, so
+        "10-year treasury" never gets the "30-year treasury" answer. `scope`
+        separates answers that differ by audience, such as the learning level
+        for educational questions.
+        """
+        if not self.redis_client:
+            return None
+        
+        try:
+            normalized = normalize_text(user_message)
+            text_hash = hashlib.sha1(normalized.encode()).hexdigest()
+            
+            cached_data = self.get(self.get_shared_response_cache_key(user_tier, scope, text_hash))
+            if cached_data:
+                self._record_shared_lookup(user_tier, scope, 'hits')
+                return cached_data.get("ai_response")
+            
+            # Near-duplicate lookup: candidates share at least one LSH band
+            signature = minhash_signature(normalized)
+            pipe = self.redis_client.pipeline()
+            for band, band_hash in enumerate(lsh_band_hashes(signature)):
+                pipe.smembers(self.get_shared_bucket_cache_key(user_tier, scope, band, band_hash))
+            candidates = set()
+            for members in pipe.execute():
+                candidates.update(m.decode() if isinstance(m, bytes) else m for m in members)
+            
+            # All candidates in one MGET
+            candidate_keys = [self.get_shared_response_cache_key(user_tier, scope, candidate_hash) for candidate_hash in candidates]
+            tokens = key_tokens(user_message)
+            best_response, best_similarity = None, 0.0
+            for candidate in self.get_many(candidate_keys).values():
+                if key_tokens(candidate.get("user_message", "")) != tokens:
+                    continue
+                if term_similarity(normalized, candidate.get("normalized", "")) < self.term_similarity_threshold:
+                    continue
+                similarity = estimate_similarity(signature, candidate.get("signature", []))
+                if similarity >= self.similarity_threshold and similarity > best_similarity:
+                    best_response, best_similarity = candidate.get("ai_response"), similarity
+            
+            if best_response:
+                self._record_shared_lookup(user_tier, scope, 'near_hits')
+                return best_response
+            
+            self._record_shared_lookup(user_tier, scope, 'misses')
+            return None
+        except Exception as e:
+            self.logger.error(f"Error getting shared response: {e}")
+            return None
+    
+    def cache_shared_response(self, user_message: str, user_tier: int, scope: str, ai_response: str, timeout: int = None) -> bool:
+        """Cache a response for reuse across sessions and index it for near-duplicate lookups"""
+        if not self.redis_client:
+            return False
+        
+        try:
+            timeout = timeout or self.shared_response_timeout
+            normalized = normalize_text(user_message)
+            text_hash = hashlib.sha1(normalized.encode()).hexdigest()
+            signature = minhash_signature(normalized)
+            
+            cache_data = {
+                "user_message": user_message,
+                "normalized": normalized,
+                "signature": signature,
+                "ai_response": ai_response
+            }
+            if not self.set(self.get_shared_response_cache_key(user_tier, scope, text_hash), cache_data, timeout):
+                return False
+            
+            pipe = self.redis_client.pipeline()
+            for band, band_hash in enumerate(lsh_band_hashes(signature)):
+                bucket_key = self.get_shared_bucket_cache_key(user_tier, scope, band, band_hash)
+                pipe.sadd(bucket_key, text_hash)
+                pipe.expire(bucket_key, timeout)
+            pipe.execute()
+            return True
+        except Exception as e:
+            self.logger.error(f"Error caching shared response: {e}")
+            return False
+    
+    def _record_shared_lookup(self, user_tier: int, scope: str, outcome: str):
+        """Count a shared cache lookup outcome (hits, near_hits or misses)"""
+        try:
+            pipe = self.redis_client.pipeline()
+            pipe.hincrby("shared_response:stats", outcome, 1)
+            pipe.hincrby("shared_response:stats", f"{user_tier}:{scope}:{outcome}", 1)
+            pipe.execute()
+        except Exception as e:
+            self.logger.error(f"Error recording shared cache stats: {e}")
+    
+    def get_shared_cache_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters for the shared response cache"""
+        if not self.redis_client:
+            return {}
+        
+        try:
+            raw_stats = self.redis_client.hgetall("shared_response:stats")
+            stats = {
+                (k.decode() if isinstance(k, bytes) else k): int(v)
+                for k, v in raw_stats.items()
+            }
+            lookups = stats.get('hits', 0) + stats.get('near_hits', 0) + stats.get('misses', 0)
+            hit_rate = (stats.get('hits', 0) + stats.get('near_hits', 0)) / lookups if lookups else 0.0
+            return {
+                'lookups': lookups,
+                'hit_rate': round(hit_rate, 4),
+                'counters': stats
+            }
+        except Exception as e:
+            self.logger.error(f"Error getting shared cache stats: {e}")
+            return {}
+    
     def cache_market_data(self, symbol: str, data: Any, timeout: int = 60) -> bool:
         """Cache market data with shorter timeout"""
         key = self.get_market_data_cache_key(symbol)
@@ -107,17 +648,74 @@ class CacheService:
         key = self.get_market_data_cache_key(symbol)
         return self.get(key)
     
+    def cache_market_data_many(self, data_by_symbol: Dict[str, Any], timeout: int = 60) -> bool:
+        """Cache market data for several symbols in one round trip"""
+        return self.set_many(
+            {self.get_market_data_cache_key(symbol): data for symbol, data in data_by_symbol.items()},
+            timeout
+        )
+    
+    def get_cached_market_data_many(self, symbols: List[str]) -> Dict[str, Any]:
+        """Get cached market data for several symbols with one MGET, keyed by symbol"""
+        keys = {self.get_market_data_cache_key(symbol): symbol for symbol in symbols}
+        return {keys[key]: data for key, data in self.get_many(list(keys)).items()}
+    
     def clear_session_cache(self, session_id: str) -> bool:
-        """Clear all cached data for a session"""
+        """Clear all cached data for a session.
+        
+        Reads the session's key index instead of pattern-matching the keyspace,
+        so the cost is proportional to the session's own entries.
+        """
         if not self.redis_client:
             return False
         
         try:
-            pattern = f"conversation:{session_id}:*"
-            keys = self.redis_client.keys(pattern)
+            index_key = self.get_session_index_key(session_id)
+            keys = [k.decode() if isinstance(k, bytes) else k for k in self.redis_client.smembers(index_key)]
+            
+            pipe = self.redis_client.pipeline(transaction=False)
             if keys:
-                self.redis_client.delete(*keys)
+                pipe.delete(*keys)
+            pipe.delete(index_key)
+            if self.local_cache is not None and keys:
+                self._publish_invalidation(pipe, keys)
+            pipe.execute()
+            
+            if self.local_cache is not None:
+                for key in keys:
+                    self.local_cache.delete(key)
             return True
         except Exception as e:
             self.logger.error(f"Error clearing session cache: {e}")
             return False
+    
+    def migrate_session_key_index(self, batch_size: int = 1000) -> int:
+        """Index session-scoped keys written before the session key index existed.
+        
+        Walks the keyspace incrementally with SCAN (never KEYS) and runs at most
+        once per Redis database. Returns the number of keys indexed.
+        """
+        if not self.redis_client:
+            return 0
+        
+        try:
+            if not self.redis_client.set("session_keys:migrated", 1, nx=True):
+                return 0
+            
+            indexed = 0
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key in self.redis_client.scan_iter(match="conversation:*", count=batch_size):
+                key = key.decode() if isinstance(key, bytes) else key
+                session_id = key.split(":")[1]
+                self._register_session_key(pipe, session_id, key)
+                indexed += 1
+                if indexed % batch_size == 0:
+                    pipe.execute()
+            pipe.execute()
+            
+            self.logger.info(f"Indexed {indexed} existing session cache keys")
+            return indexed
+        except Exception as e:
+            self.logger.error(f"Error migrating session key index: {e}")
+            self.redis_client.delete("session_keys:migrated")
+            return 0
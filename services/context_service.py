@@ -1,43 +1,262 @@
+import uuid
+import base64
 import logging
-from typing import Dict, Any, List
-from models import ChatSession, ChatMessage, UserContext
+from typing import Dict, Any, List, Optional
+from sqlalchemy import select, or_, and_
+from sqlalchemy.orm import aliased
+from models import ChatSession, ChatMessage, UserContext, ContextSnapshot
+from utils.validators import HISTORY_FIELDS
 from app import db
 from datetime import datetime, timedelta
 
+# A session's updated_at is only rewritten once it is older than this
+SESSION_TOUCH_INTERVAL = timedelta(minutes=5)
+
+def session_row(session_id: str, user_tier: int = 1, session_type: str = 'general') -> Dict[str, Any]:
+    """Build the chat_sessions values used to upsert a session"""
+    now = datetime.utcnow()
+    return {
+        "id": session_id,
+        "user_tier": user_tier,
+        "session_type": session_type,
+        "context_data": {},
+        "created_at": now,
+        "updated_at": now
+    }
+
+def resolve_message_snapshots(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Resolve the context_used snapshot references of several messages with one query"""
+    resolved = ContextSnapshot.resolve_many([message.get('context_used') for message in messages])
+    return [
+        {**message, 'context_used': context_used} if 'context_used' in message else message
+        for message, context_used in zip(messages, resolved)
+    ]
+
+def encode_history_cursor(timestamp: datetime, message_id: str) -> str:
+    """Encode a (timestamp, id) keyset position as an opaque cursor"""
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{message_id}".encode()).decode().rstrip("=")
+
+def decode_history_cursor(cursor: str) -> tuple:
+    """Decode a history cursor; raises ValueError for malformed cursors"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, message_id = raw.split("|", 1)
+        return datetime.fromisoformat(timestamp), message_id
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid history cursor: {cursor}") from e
+
+def upsert_sessions(session_rows: List[Dict[str, Any]]):
+    """Create or update sessions in the current transaction (no commit).
+    
+    Uses INSERT ... ON CONFLICT on PostgreSQL and SQLite. Existing rows are
+    only written when the tier or type changed or updated_at is older than
+    SESSION_TOUCH_INTERVAL. Other dialects fall back to SELECT + merge.
+    """
+    if not session_rows:
+        return
+    
+    dialect_name = db.engine.dialect.name
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        for row in session_rows:
+            session = db.session.get(ChatSession, row["id"])
+            if not session:
+                db.session.add(ChatSession(**row))
+            elif (session.user_tier != row["user_tier"] or session.session_type != row["session_type"]
+                  or session.updated_at < row["updated_at"] - SESSION_TOUCH_INTERVAL):
+                session.user_tier = row["user_tier"]
+                session.session_type = row["session_type"]
+                session.updated_at = row["updated_at"]
+        db.session.flush()
+        return
+    
+    table = ChatSession.__table__
+    touch_before = min(row["updated_at"] for row in session_rows) - SESSION_TOUCH_INTERVAL
+    statement = dialect_insert(table).values(session_rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.id],
+        set_={
+            "user_tier": statement.excluded.user_tier,
+            "session_type": statement.excluded.session_type,
+            "updated_at": statement.excluded.updated_at
+        },
+        where=or_(
+            table.c.user_tier != statement.excluded.user_tier,
+            table.c.session_type != statement.excluded.session_type,
+            table.c.updated_at < touch_before
+        )
+    )
+    db.session.execute(statement)
+
 class ContextService:
     """Service for managing user context and conversation history"""
     
-    def __init__(self):
+    def __init__(self, cache_service=None, message_writer=None):
         self.logger = logging.getLogger(__name__)
+        self.cache_service = cache_service
+        self.snapshot_timeout = 3600  # 1 hour
+        self.message_writer = message_writer  # Optional write-behind buffer for messages
+        self.memory_exchanges = 3  # Recent exchanges always sent to the model as role/content turns
+        self.turn_max_chars = 600  # Per-turn trim for the memory window
+        self.summary_refresh_turns = 6  # Messages past the memory window folded into the summary per refresh
+        # Recent messages included in the session context: the memory window plus a pending summary batch
+        self.context_window = self.memory_exchanges + self.summary_refresh_turns
+    
+    def get_snapshot_cache_key(self, session_id: str) -> str:
+        """Generate cache key for a session context snapshot"""
+        return f"session_context:{session_id}"
+    
+    def get_snapshot_version_key(self, session_id: str) -> str:
+        """Generate key bumped by writes that found no snapshot to update"""
+        return f"session_context_version:{session_id}"
+    
+    def _get_snapshot(self, session_id: str) -> Dict[str, Any]:
+        """Read the cached session snapshot, if any"""
+        if not self.cache_service:
+            return None
+        return self.cache_service.get(self.get_snapshot_cache_key(session_id))
+    
+    def _update_snapshot(self, session_id: str, mutate):
+        """Apply `mutate` to the cached snapshot atomically, if one is cached.
+        
+        Without a cached snapshot the version is bumped instead, so a snapshot
+        being loaded concurrently (from before this write) is not cached.
+        """
+        if not self.cache_service:
+            return
+        if not self.cache_service.update(
+            self.get_snapshot_cache_key(session_id), mutate, self.snapshot_timeout, session_id=session_id
+        ):
+            self.cache_service.bump_version(self.get_snapshot_version_key(session_id), self.snapshot_timeout)
+    
+    def _to_turns(self, messages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """Reduce messages to trimmed user/assistant role/content turns"""
+        turns = []
+        for message in messages:
+            for role, field in (("user", "user_message"), ("assistant", "ai_response")):
+                content = (message.get(field) or "").strip()
+                if len(content) > self.turn_max_chars:
+                    content = content[:self.turn_max_chars].rstrip() + "..."
+                turns.append({"role": role, "content": content})
+        return turns
+    
+    def _context_from_snapshot(self, snapshot: Dict[str, Any]) -> Dict[str, Any]:
+        """Expand a snapshot into the context shape used by prompts.
+        
+        `conversation_summary` and `recent_turns` are the bounded conversation
+        memory: a rolling summary of older messages plus trimmed role/content
+        turns for the last memory_exchanges messages and any older ones the
+        summary does not cover yet.
+        """
+        created_at = datetime.fromisoformat(snapshot["session_info"]["created_at"])
+        summary = (snapshot["session_info"].get("context_data") or {}).get("conversation_summary", {})
+        recent_messages = snapshot["recent_messages"]
+        unsummarized = len(recent_messages)
+        if summary.get("through_id"):
+            summarized_through = (datetime.fromisoformat(summary["through_timestamp"]), summary["through_id"])
+            unsummarized = sum(
+                1 for message in recent_messages
+                if (datetime.fromisoformat(message["timestamp"]), message["id"]) > summarized_through
+            )
+        return {
+            "session_info": snapshot["session_info"],
+            "recent_messages": recent_messages,
+            "conversation_summary": summary.get("text", ""),
+            "recent_turns": self._to_turns(recent_messages[-max(self.memory_exchanges, unsummarized):]),
+            "user_context": snapshot["user_context"],
+            "conversation_length": len(snapshot["recent_messages"]),
+            "session_duration": (datetime.utcnow() - created_at).total_seconds() / 3600  # in hours
+        }
+    
+    def _merge_pending_messages(self, session_id: str, messages: List[Dict[str, Any]],
+                                limit: int) -> List[Dict[str, Any]]:
+        """Add queued write-behind messages (snapshot references unresolved) to messages read from the database"""
+        if not self.message_writer:
+            return messages
+        
+        pending = self.message_writer.get_pending(session_id)
+        if not pending:
+            return messages
+        
+        merged = {msg['id']: msg for msg in messages}
+        for row in pending:
+            merged.setdefault(row['id'], ChatMessage(**row).to_dict(resolve_snapshots=False))
+        
+        ordered = sorted(merged.values(), key=lambda msg: (msg['timestamp'], msg['id']))
+        return ordered[-limit:]
     
     def get_session_context(self, session_id: str) -> Dict[str, Any]:
-        """Get comprehensive context for a session"""
+        """Get comprehensive context for a session.
+        
+        Served from the cached snapshot when present; otherwise loaded from the
+        database and cached, unless a write landed during the load.
+        save_message and update_user_context keep the snapshot current.
+        """
         try:
-            session = ChatSession.query.filter_by(id=session_id).first()
-            if not session:
-                return {}
+            snapshot = self._get_snapshot(session_id)
+            if snapshot:
+                return self._context_from_snapshot(snapshot)
             
-            # Get recent messages for conversation context
-            recent_messages = ChatMessage.query.filter_by(
-                session_id=session_id
-            ).order_by(ChatMessage.timestamp.desc()).limit(5).all()
-            
-            # Get user context
-            user_context = UserContext.query.filter_by(session_id=session_id).first()
-            
-            context = {
-                "session_info": session.to_dict(),
-                "recent_messages": [msg.to_dict() for msg in reversed(recent_messages)],
-                "user_context": user_context.to_dict() if user_context else {},
-                "conversation_length": len(recent_messages),
-                "session_duration": (datetime.utcnow() - session.created_at).total_seconds() / 3600  # in hours
-            }
+            if self.cache_service:
+                snapshot = self.cache_service.load_and_set(
+                    self.get_snapshot_cache_key(session_id), lambda: self.load_session_bundle(session_id),
+                    self.get_snapshot_version_key(session_id), self.snapshot_timeout, session_id=session_id
+                )
+            else:
+                snapshot = self.load_session_bundle(session_id)
+            if snapshot is None:
+                return {}
             
-            return context
+            return self._context_from_snapshot(snapshot)
         except Exception as e:
             self.logger.error(f"Error getting session context: {e}")
             return {}
     
+    def load_session_bundle(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Load a session, its user context and its recent messages in one query.
+        
+        The recent messages come from a LIMITed subquery served by the
+        (session_id, timestamp DESC) index and are outer-joined to the session
+        together with the user context, so sessions without messages or
+        context still produce a row. Returns None if the session does not exist.
+        """
+        recent_subquery = (
+            select(ChatMessage)
+            .where(ChatMessage.session_id == session_id)
+            .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+            .limit(self.context_window)
+            .subquery()
+        )
+        recent_message = aliased(ChatMessage, recent_subquery)
+        
+        rows = db.session.execute(
+            select(ChatSession, UserContext, recent_message)
+            .outerjoin(UserContext, UserContext.session_id == ChatSession.id)
+            .outerjoin(recent_message, recent_message.session_id == ChatSession.id)
+            .where(ChatSession.id == session_id)
+        ).all()
+        
+        if not rows:
+            return None
+        
+        session, user_context = rows[0][0], rows[0][1]
+        recent_messages = sorted(
+            (row[2] for row in rows if row[2] is not None),
+            key=lambda msg: (msg.timestamp, msg.id)
+        )
+        
+        return {
+            "session_info": session.to_dict(),
+            "recent_messages": self._merge_pending_messages(
+                session_id, [msg.to_dict(resolve_snapshots=False) for msg in recent_messages],
+                self.context_window
+            ),
+            "user_context": user_context.to_dict() if user_context else {}
+        }
+    
     def update_user_context(self, session_id: str, context_updates: Dict[str, Any]) -> bool:
         """Update user context with new information"""
         try:
@@ -61,8 +280,12 @@ class ContextService:
                 user_context.learning_progress.update(context_updates['learning_progress'])
             
             user_context.updated_at = datetime.utcnow()
+            db.session.flush()
+            user_context_data = user_context.to_dict()
             db.session.commit()
             
+            self._update_snapshot(session_id, lambda snapshot: snapshot.update(user_context=user_context_data))
+            
             return True
         except Exception as e:
             self.logger.error(f"Error updating user context: {e}")
@@ -74,51 +297,183 @@ class ContextService:
         try:
             messages = ChatMessage.query.filter_by(
                 session_id=session_id
-            ).order_by(ChatMessage.timestamp.desc()).limit(limit).all()
+            ).order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(limit).all()
             
-            return [msg.to_dict() for msg in reversed(messages)]
+            return resolve_message_snapshots(self._merge_pending_messages(
+                session_id, [msg.to_dict(resolve_snapshots=False) for msg in reversed(messages)], limit
+            ))
         except Exception as e:
             self.logger.error(f"Error getting conversation history: {e}")
             return []
     
-    def create_or_update_session(self, session_id: str, user_tier: int = 1, session_type: str = 'general') -> ChatSession:
-        """Create or update a chat session"""
+    def get_messages_to_summarize(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Return the next batch of messages to fold into the rolling summary, if one is due.
+        
+        A batch is due once summary_refresh_turns messages that have left the
+        memory window (the last memory_exchanges messages) have not been
+        summarized yet. Until then the prompt still sends those messages as
+        turns (see _context_from_snapshot), so no message is in neither.
+        """
+        session = db.session.get(ChatSession, session_id)
+        if not session:
+            return None
+        
+        summary = (session.context_data or {}).get("conversation_summary", {})
+        query = select(ChatMessage.id, ChatMessage.timestamp, ChatMessage.user_message, ChatMessage.ai_response).where(
+            ChatMessage.session_id == session_id
+        )
+        if summary.get("through_id"):
+            through_timestamp = datetime.fromisoformat(summary["through_timestamp"])
+            query = query.where(or_(
+                ChatMessage.timestamp > through_timestamp,
+                and_(ChatMessage.timestamp == through_timestamp, ChatMessage.id > summary["through_id"])
+            ))
+        
+        rows = db.session.execute(
+            query.order_by(ChatMessage.timestamp, ChatMessage.id).limit(self.summary_refresh_turns + self.memory_exchanges)
+        ).all()
+        if len(rows) < self.summary_refresh_turns + self.memory_exchanges:
+            return None
+        
+        batch = [dict(row._mapping) for row in rows[:self.summary_refresh_turns]]
+        return {
+            "summary": summary.get("text", ""),
+            "turns": self._to_turns(batch),
+            "through_timestamp": batch[-1]["timestamp"].isoformat(),
+            "through_id": batch[-1]["id"],
+            "messages_summarized": summary.get("messages_summarized", 0) + len(batch)
+        }
+    
+    def store_summary(self, session_id: str, summary_text: str, batch: Dict[str, Any]) -> bool:
+        """Save a refreshed rolling summary for the batch from get_messages_to_summarize"""
         try:
-            session = ChatSession.query.filter_by(id=session_id).first()
-            
+            session = db.session.get(ChatSession, session_id)
             if not session:
-                session = ChatSession(
-                    id=session_id,
-                    user_tier=user_tier,
-                    session_type=session_type,
-                    context_data={}
-                )
-                db.session.add(session)
-            else:
-                session.updated_at = datetime.utcnow()
-                session.user_tier = user_tier
-                session.session_type = session_type
+                return False
             
+            # Assign a new dict so the JSON column change is detected
+            context_data = dict(session.context_data or {})
+            context_data["conversation_summary"] = {
+                "text": summary_text,
+                "through_timestamp": batch["through_timestamp"],
+                "through_id": batch["through_id"],
+                "messages_summarized": batch["messages_summarized"],
+                "updated_at": datetime.utcnow().isoformat()
+            }
+            session.context_data = context_data
             db.session.commit()
-            return session
+            
+            self._update_snapshot(
+                session_id, lambda snapshot: snapshot["session_info"].update(context_data=context_data)
+            )
+            return True
         except Exception as e:
-            self.logger.error(f"Error creating/updating session: {e}")
+            self.logger.error(f"Error storing conversation summary: {e}")
             db.session.rollback()
-            return None
+            return False
     
-    def save_message(self, session_id: str, user_message: str, ai_response: str, context_used: Dict[str, Any] = None, response_time_ms: int = 0) -> ChatMessage:
-        """Save a chat message to the database"""
+    def get_history_page(self, session_id: str, limit: int = 20, cursor: str = None,
+                         fields: List[str] = None) -> Dict[str, Any]:
+        """Get one page of conversation history, newest page first.
+        
+        Pages are keyset-paginated on (timestamp, id) so deep pages cost the
+        same as the first one, and only the requested columns are loaded.
+        Messages within a page are in chronological order; `next_cursor`
+        points at the next older page. Snapshot references in context_used
+        are resolved for the whole page with one query.
+        Raises ValueError for a bad cursor.
+        """
+        fields = fields or HISTORY_FIELDS
+        selected = list(dict.fromkeys(['id', 'timestamp'] + fields))  # Keyset columns are always needed
+        
+        query = select(*[getattr(ChatMessage, field) for field in selected]).where(
+            ChatMessage.session_id == session_id
+        )
+        if cursor:
+            cursor_timestamp, cursor_id = decode_history_cursor(cursor)
+            query = query.where(or_(
+                ChatMessage.timestamp < cursor_timestamp,
+                and_(ChatMessage.timestamp == cursor_timestamp, ChatMessage.id < cursor_id)
+            ))
+        
+        # One extra row tells whether an older page exists
+        rows = [dict(row._mapping) for row in db.session.execute(
+            query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(limit + 1)
+        )]
+        
+        # Queued write-behind messages are newer than anything committed, so only the first page sees them
+        if not cursor and self.message_writer:
+            known_ids = {row['id'] for row in rows}
+            pending = [row for row in self.message_writer.get_pending(session_id) if row['id'] not in known_ids]
+            if pending:
+                rows = sorted(rows + pending, key=lambda row: (row['timestamp'], row['id']), reverse=True)
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = encode_history_cursor(rows[-1]['timestamp'], rows[-1]['id']) if has_more else None
+        
+        messages = []
+        for row in reversed(rows):
+            message = {field: row[field] for field in fields}
+            if 'timestamp' in message:
+                message['timestamp'] = message['timestamp'].isoformat()
+            if 'context_used' in message:
+                message['context_used'] = message['context_used'] or {}
+            if 'tokens_used' in message:
+                message['tokens_used'] = message['tokens_used'] or 0
+            messages.append(message)
+        if 'context_used' in fields:
+            messages = resolve_message_snapshots(messages)
+        
+        return {
+            "messages": messages,
+            "next_cursor": next_cursor,
+            "has_more": has_more
+        }
+    
+    def save_message(self, session_id: str, user_message: str, ai_response: str, context_used: Dict[str, Any] = None,
+                     response_time_ms: int = 0, tokens_used: int = 0, user_tier: int = None,
+                     session_type: str = 'general') -> ChatMessage:
+        """Save a chat message to the database.
+        
+        When user_tier is given the session is upserted in the same
+        transaction, so one commit covers session bookkeeping and the message.
+        With a message writer both are queued for a batched background write
+        instead, unless its queue is full. Either way the returned message is
+        fully populated.
+        """
         try:
-            message = ChatMessage(
-                session_id=session_id,
-                user_message=user_message,
-                ai_response=ai_response,
-                context_used=context_used or {},
-                response_time_ms=response_time_ms
-            )
+            row = {
+                "id": str(uuid.uuid4()),
+                "session_id": session_id,
+                "user_message": user_message,
+                "ai_response": ai_response,
+                "timestamp": datetime.utcnow(),
+                "context_used": context_used or {},
+                "response_time_ms": response_time_ms,
+                "tokens_used": tokens_used
+            }
+            # Large context values are stored once in context_snapshots and referenced by hash
+            row["context_used"], snapshots = ContextSnapshot.dehydrate(row["context_used"])
+            session_values = session_row(session_id, user_tier, session_type) if user_tier is not None else None
+            message = ChatMessage(**row)
+            # Serialized up front so committing does not force a reload
+            message_data = message.to_dict(resolve_snapshots=False)
             
-            db.session.add(message)
-            db.session.commit()
+            if not (self.message_writer and self.message_writer.enqueue(row, session_values, snapshots)):
+                if session_values:
+                    upsert_sessions([session_values])
+                ContextSnapshot.insert_missing(snapshots)
+                db.session.add(message)
+                db.session.commit()
+                ContextSnapshot.mark_persisted(snapshots)
+            
+            # Append to the snapshot and trim it to the context window
+            def append_message(snapshot):
+                if session_values:
+                    snapshot["session_info"].update(user_tier=user_tier, session_type=session_type)
+                snapshot["recent_messages"] = (snapshot["recent_messages"] + [message_data])[-self.context_window:]
+            self._update_snapshot(session_id, append_message)
             
             return message
         except Exception as e:
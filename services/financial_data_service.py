@@ -1,77 +1,140 @@
-import os
 import logging
-import requests
 from typing import Dict, Any, List
-from datetime import datetime, timedelta
-import json
+from datetime import datetime
+import numpy as np
+from services.market_providers import MarketDataProvider, NewsProvider, create_market_provider, create_news_provider
+from services.portfolio_analytics import PortfolioAnalytics, BENCHMARK_SYMBOL
+from services.portfolio_risk import PortfolioRiskEngine
+
+# Analysed when a session has no saved portfolio, so portfolio questions still get concrete numbers
+DEMO_PORTFOLIO = {
+    "positions": [
+        {"symbol": "AAPL", "quantity": 120, "price": 150.00},
+        {"symbol": "MSFT", "quantity": 60, "price": 310.00},
+        {"symbol": "GOOGL", "quantity": 80, "price": 125.00},
+        {"symbol": "JNJ", "quantity": 90, "price": 160.00},
+        {"symbol": "UNH", "quantity": 25, "price": 480.00},
+        {"symbol": "JPM", "quantity": 100, "price": 140.00},
+        {"symbol": "V", "quantity": 50, "price": 230.00},
+        {"symbol": "PG", "quantity": 70, "price": 150.00},
+        {"symbol": "XOM", "quantity": 110, "price": 100.00},
+        {"symbol": "BND", "quantity": 150, "price": 72.00}
+    ]
+}
 
 class FinancialDataService:
     """Service for fetching financial data from various APIs"""
     
-    def __init__(self):
-        self.polygon_api_key = os.environ.get("POLYGON_API_KEY", "demo_key")
-        self.marketaux_api_key = os.environ.get("MARKETAUX_API_KEY", "demo_key")
+    def __init__(self, market_provider: MarketDataProvider = None, news_provider: NewsProvider = None, cache_service=None):
+        self.market_provider = market_provider or create_market_provider()
+        self.news_provider = news_provider or create_news_provider()
+        self.cache_service = cache_service
+        self.quote_cache_timeout = 15  # Seconds a cached quote is served
+        self.history_cache_timeout = 3600  # Daily closes only change once a day
+        self.history_days = 252  # One trading year of closes for portfolio analytics
+        self.max_quote_symbols = 2000
+        self.analytics = PortfolioAnalytics()
+        self.risk_engine = PortfolioRiskEngine(cache_service)
         self.logger = logging.getLogger(__name__)
     
     def get_stock_quote(self, symbol: str) -> Dict[str, Any]:
-        """Get current stock quote (mock implementation)"""
-        try:
-            # Mock data for demonstration - in production, use real API
-            mock_data = {
-                "symbol": symbol.upper(),
-                "price": 150.25,
-                "change": 2.50,
-                "change_percent": 1.69,
-                "volume": 1234567,
-                "previous_close": 147.75,
-                "open": 148.00,
-                "high": 151.00,
-                "low": 147.50,
-                "timestamp": datetime.now().isoformat(),
-                "market_cap": 2500000000,
-                "pe_ratio": 15.5,
-                "dividend_yield": 2.1
+        """Get current stock quote (served from the quote cache when fresh)"""
+        result = self.get_stock_quotes([symbol])
+        if not result["success"]:
+            return result
+        
+        quote = result["data"].get(symbol.strip().upper())
+        if quote is None:
+            return {
+                "success": False,
+                "error": f"No quote available for {symbol.upper()}",
+                "data": None
             }
+        return {
+            "success": True,
+            "data": quote,
+            "source": result["source"]
+        }
+    
+    def get_stock_quotes(self, symbols: List[str]) -> Dict[str, Any]:
+        """Get current quotes for a batch of symbols.
+        
+        Cached quotes are read with a single MGET and only the misses are
+        requested upstream, in one batched provider call. `data` maps each
+        symbol to its quote; symbols the provider could not quote are listed
+        under `missing`.
+        """
+        try:
+            # Normalize and de-duplicate, keeping the caller's order
+            symbols = list(dict.fromkeys(symbol.strip().upper() for symbol in symbols if symbol and symbol.strip()))
+            if len(symbols) > self.max_quote_symbols:
+                return {
+                    "success": False,
+                    "error": f"At most {self.max_quote_symbols} symbols per request",
+                    "data": None
+                }
+            
+            quotes = {}
+            if self.cache_service and symbols:
+                cached = self.cache_service.get_cached_market_data_many([f"quote:{symbol}" for symbol in symbols])
+                quotes = {key.split(":", 1)[1]: quote for key, quote in cached.items()}
+            
+            misses = [symbol for symbol in symbols if symbol not in quotes]
+            if misses:
+                fetched = self.market_provider.fetch_quotes(misses)
+                if self.cache_service and fetched:
+                    self.cache_service.cache_market_data_many(
+                        {f"quote:{symbol}": quote for symbol, quote in fetched.items()},
+                        timeout=self.quote_cache_timeout
+                    )
+                quotes.update(fetched)
             
-            self.logger.info(f"Retrieved stock quote for {symbol}")
+            self.logger.info(f"Retrieved {len(quotes)} stock quotes ({len(symbols) - len(misses)} cached)")
             return {
                 "success": True,
-                "data": mock_data,
-                "source": "mock_polygon"
+                "data": {symbol: quotes[symbol] for symbol in symbols if symbol in quotes},
+                "missing": [symbol for symbol in symbols if symbol not in quotes],
+                "cached": len(symbols) - len(misses),
+                "source": self.market_provider.name
             }
         except Exception as e:
-            self.logger.error(f"Error fetching stock quote for {symbol}: {e}")
+            self.logger.error(f"Error fetching stock quotes for {len(symbols)} symbols: {e}")
             return {
                 "success": False,
                 "error": str(e),
                 "data": None
             }
     
+    def get_price_histories(self, symbols: List[str], days: int = None) -> Dict[str, List[float]]:
+        """Daily closes per symbol (oldest first), cached per symbol like quotes"""
+        days = days or self.history_days
+        histories = {}
+        if self.cache_service and symbols:
+            cached = self.cache_service.get_cached_market_data_many([f"history:{days}:{symbol}" for symbol in symbols])
+            histories = {key.rsplit(":", 1)[1]: closes for key, closes in cached.items()}
+        
+        misses = [symbol for symbol in symbols if symbol not in histories]
+        if misses:
+            fetched = self.market_provider.fetch_price_history(misses, days)
+            if self.cache_service and fetched:
+                self.cache_service.cache_market_data_many(
+                    {f"history:{days}:{symbol}": closes for symbol, closes in fetched.items()},
+                    timeout=self.history_cache_timeout
+                )
+            histories.update(fetched)
+        return histories
+    
     def get_market_overview(self) -> Dict[str, Any]:
-        """Get general market overview (mock implementation)"""
+        """Get general market overview straight from the provider (uncached).
+        
+        Request handlers should read MarketSnapshotService instead, which
+        serves a background-refreshed copy.
+        """
         try:
-            # Mock market data
-            mock_data = {
-                "indices": {
-                    "SPY": {"price": 445.67, "change": 1.23, "change_percent": 0.28},
-                    "QQQ": {"price": 378.45, "change": -0.89, "change_percent": -0.23},
-                    "IWM": {"price": 198.32, "change": 0.45, "change_percent": 0.23}
-                },
-                "sectors": {
-                    "Technology": {"change_percent": 0.5},
-                    "Healthcare": {"change_percent": -0.2},
-                    "Finance": {"change_percent": 0.8},
-                    "Energy": {"change_percent": 1.2}
-                },
-                "market_sentiment": "neutral",
-                "vix": 18.45,
-                "timestamp": datetime.now().isoformat()
-            }
-            
             return {
                 "success": True,
-                "data": mock_data,
-                "source": "mock_market_data"
+                "data": self.market_provider.fetch_market_overview(),
+                "source": self.market_provider.name
             }
         except Exception as e:
             self.logger.error(f"Error fetching market overview: {e}")
@@ -82,43 +145,12 @@ class FinancialDataService:
             }
     
     def get_financial_news(self, symbols: List[str] = None, limit: int = 10) -> Dict[str, Any]:
-        """Get financial news (mock implementation)"""
+        """Get financial news from the news provider"""
         try:
-            # Mock news data
-            mock_news = [
-                {
-                    "title": "Market Analysis: Tech Stocks Show Resilience",
-                    "description": "Technology stocks continue to outperform expectations despite market volatility...",
-                    "source": "Financial Times",
-                    "published_at": (datetime.now() - timedelta(hours=2)).isoformat(),
-                    "url": "https://example.com/news/1",
-                    "sentiment": "positive",
-                    "relevance_score": 0.85
-                },
-                {
-                    "title": "Federal Reserve Signals Interest Rate Stability",
-                    "description": "The Federal Reserve indicated that interest rates will remain stable in the near term...",
-                    "source": "Wall Street Journal",
-                    "published_at": (datetime.now() - timedelta(hours=4)).isoformat(),
-                    "url": "https://example.com/news/2",
-                    "sentiment": "neutral",
-                    "relevance_score": 0.92
-                },
-                {
-                    "title": "Cryptocurrency Market Sees Mixed Signals",
-                    "description": "Bitcoin and other cryptocurrencies show mixed performance as institutional adoption continues...",
-                    "source": "CoinDesk",
-                    "published_at": (datetime.now() - timedelta(hours=6)).isoformat(),
-                    "url": "https://example.com/news/3",
-                    "sentiment": "mixed",
-                    "relevance_score": 0.78
-                }
-            ]
-            
             return {
                 "success": True,
-                "data": mock_news[:limit],
-                "source": "mock_marketaux"
+                "data": self.news_provider.fetch_news(symbols, limit),
+                "source": self.news_provider.name
             }
         except Exception as e:
             self.logger.error(f"Error fetching financial news: {e}")
@@ -156,41 +188,80 @@ class FinancialDataService:
                 "data": None
             }
     
-    def get_portfolio_analysis(self, portfolio_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Analyze portfolio performance (mock implementation)"""
+    def _portfolio_inputs(self, portfolio_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Position arrays, current prices and aligned price histories for a portfolio.
+        
+        Uses the demo portfolio when `portfolio_data` has no positions. Quotes
+        and histories for every position come from two batched, cached
+        provider calls. Raises when quotes cannot be fetched.
+        """
+        positions = (portfolio_data or {}).get("positions") or DEMO_PORTFOLIO["positions"]
+        holdings = self.analytics.aggregate_positions(positions)
+        symbols = holdings["symbols"]
+        
+        quotes_result = self.get_stock_quotes(symbols)
+        if not quotes_result["success"]:
+            raise ValueError(quotes_result["error"])
+        quotes = quotes_result["data"]
+        histories = self.get_price_histories(symbols + [BENCHMARK_SYMBOL])
+        
+        # Positions without a live quote are valued at the price they were entered with
+        prices = np.array([
+            (quotes.get(symbol) or {}).get("price") or entry_price
+            for symbol, entry_price in zip(symbols, holdings["entry_prices"].tolist())
+        ], dtype=float)
+        previous_closes = np.array([
+            (quotes.get(symbol) or {}).get("previous_close") or price
+            for symbol, price in zip(symbols, prices.tolist())
+        ], dtype=float)
+        
+        aligned = self.analytics.align_histories(symbols, histories, prices)
+        benchmark = histories.get(BENCHMARK_SYMBOL) or []
+        window = aligned["closes"].shape[1]
+        
+        return {
+            "holdings": holdings,
+            "prices": prices,
+            "previous_closes": previous_closes,
+            "closes": aligned["closes"],
+            "benchmark_closes": np.array(benchmark[-window:], dtype=float) if len(benchmark) >= window else None,
+            "is_demo": not (portfolio_data or {}).get("positions"),
+            "missing_quotes": quotes_result["missing"],
+            "missing_history": aligned["missing"]
+        }
+    
+    def get_portfolio_inputs(self, portfolio_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the inputs for get_portfolio_analysis and get_portfolio_risk once, to pass to both"""
         try:
-            # Mock portfolio analysis
-            mock_analysis = {
-                "total_value": 125000.00,
-                "daily_change": 1250.00,
-                "daily_change_percent": 1.01,
-                "diversification_score": 0.78,
-                "risk_level": "moderate",
-                "sectors": {
-                    "Technology": 35.0,
-                    "Healthcare": 20.0,
-                    "Finance": 15.0,
-                    "Consumer": 12.0,
-                    "Energy": 8.0,
-                    "Other": 10.0
-                },
-                "top_performers": [
-                    {"symbol": "AAPL", "return": 8.5},
-                    {"symbol": "MSFT", "return": 6.2},
-                    {"symbol": "GOOGL", "return": 4.8}
-                ],
-                "recommendations": [
-                    "Consider rebalancing technology allocation",
-                    "Diversify into international markets",
-                    "Review bond allocation for age-appropriate risk"
-                ],
-                "timestamp": datetime.now().isoformat()
+            return {
+                "success": True,
+                "data": self._portfolio_inputs(portfolio_data),
+                "source": "portfolio_inputs"
+            }
+        except Exception as e:
+            self.logger.error(f"Error loading portfolio inputs: {e}")
+            return {
+                "success": False,
+                "error": str(e),
+                "data": None
             }
+    
+    def get_portfolio_analysis(self, portfolio_data: Dict[str, Any], inputs: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Analyze portfolio performance from live quotes and price history (see PortfolioAnalytics)"""
+        try:
+            inputs = inputs or self._portfolio_inputs(portfolio_data)
+            analysis = self.analytics.analyze(
+                inputs["holdings"], inputs["prices"], inputs["previous_closes"],
+                inputs["closes"], inputs["benchmark_closes"]
+            )
+            analysis["is_demo"] = inputs["is_demo"]
+            analysis["missing_quotes"] = inputs["missing_quotes"]
+            analysis["missing_history"] = inputs["missing_history"]
             
             return {
                 "success": True,
-                "data": mock_analysis,
-                "source": "mock_portfolio_analysis"
+                "data": analysis,
+                "source": "portfolio_analytics"
             }
         except Exception as e:
             self.logger.error(f"Error analyzing portfolio: {e}")
@@ -200,6 +271,30 @@ class FinancialDataService:
                 "data": None
             }
     
+    def get_portfolio_risk(self, portfolio_data: Dict[str, Any], paths: int = None,
+                           horizons: List[int] = None, confidences: List[float] = None,
+                           inputs: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Monte Carlo VaR/CVaR for a portfolio (see PortfolioRiskEngine), cached by portfolio hash"""
+        try:
+            inputs = inputs or self._portfolio_inputs(portfolio_data)
+            risk = self.risk_engine.compute(
+                inputs["holdings"]["symbols"], inputs["holdings"]["quantities"], inputs["prices"],
+                inputs["closes"], paths=paths, horizons=horizons, confidences=confidences
+            )
+            
+            return {
+                "success": True,
+                "data": risk,
+                "source": "monte_carlo"
+            }
+        except Exception as e:
+            self.logger.error(f"Error computing portfolio risk: {e}")
+            return {
+                "success": False,
+                "error": str(e),
+                "data": None
+            }
+    
     def search_financial_instruments(self, query: str) -> Dict[str, Any]:
         """Search for financial instruments (mock implementation)"""
         try:
@@ -0,0 +1,108 @@
+import os
+import re
+import logging
+from typing import Dict, Any, List, Tuple
+
+class IntentClassifier:
+    """Local rule-based intent classifier used before falling back to the LLM"""
+
+    # Intents whose handlers need session or market context
+    CONTEXT_INTENTS = {'market_data', 'portfolio_analysis'}
+
+    def __init__(self, confidence_threshold: float = None):
+        self.logger = logging.getLogger(__name__)
+
+        if confidence_threshold is None:
+            confidence_threshold = float(os.environ.get("INTENT_CONFIDENCE_THRESHOLD", "0.7"))
+        self.confidence_threshold = confidence_threshold
+
+        # Smoothing added to the denominator so a single weak match stays below threshold
+        self.smoothing = 1.0
+
+        # Weighted patterns per intent (pattern, weight)
+        self.intent_patterns = {
+            'market_data': [
+                (r"\b(markets?|stocks?) (today|now|right now|this week)\b", 3.0),
+                (r"\bmarket (overview|update|summary|analysis|news)\b", 3.0),
+                (r"\bwhat'?s happening\b", 2.5),
+                (r"\b(s&p( 500)?|sp500|dow( jones)?|nasdaq|russell 2000|vix|spy|qqq|iwm)\b", 2.0),
+                (r"\b(price of|quote for|trading at|share price)\b", 2.0),
+                (r"\bsector (performance|trends?)\b", 1.5),
+                (r"\b(today|currently|current|latest|right now)\b", 1.0),
+            ],
+            'portfolio_analysis': [
+                (r"\bmy (portfolio|holdings|positions|investments|stocks|allocation)\b", 3.5),
+                (r"\bportfolio\b", 2.0),
+                (r"\b(how risky|my returns|performance of my|am i diversified)\b", 2.0),
+                (r"\b(rebalanc\w*|allocation|diversif\w*)\b", 1.5),
+            ],
+            'educational': [
+                (r"^\s*(what is|what are|what's an?|whats an?|what does)\b", 2.5),
+                (r"\b(explain|define|definition of|meaning of|teach me|learn about|understand)\b", 2.5),
+                (r"\bhow (does|do) .+ work\b", 2.5),
+                (r"\bdifference between\b", 2.0),
+                (r"\b(beginner|basics?|for dummies)\b", 1.5),
+            ],
+            'strategy_help': [
+                (r"\bstrateg(y|ies)\b", 2.5),
+                (r"\bhow (do|should|can) i (start )?(invest|buy|save|trade)\w*\b", 2.5),
+                (r"\b(should i|is it a good time to)\b", 2.0),
+                (r"\b(dollar[- ]cost averaging|value investing|growth investing|dividend investing|options trading)\b", 1.5),
+            ],
+        }
+
+        self.compiled_patterns = {
+            intent: [(re.compile(pattern, re.IGNORECASE), weight) for pattern, weight in patterns]
+            for intent, patterns in self.intent_patterns.items()
+        }
+
+    def _score(self, user_message: str) -> Tuple[Dict[str, float], Dict[str, List[str]]]:
+        """Score each intent by summing the weights of matching patterns"""
+        scores = {}
+        keywords = {}
+
+        for intent, patterns in self.compiled_patterns.items():
+            for pattern, weight in patterns:
+                match = pattern.search(user_message)
+                if match:
+                    scores[intent] = scores.get(intent, 0.0) + weight
+                    keywords.setdefault(intent, []).append(match.group(0).strip().lower())
+
+        return scores, keywords
+
+    def classify(self, user_message: str) -> Dict[str, Any]:
+        """Classify a message locally.
+
+        Returns the same shape as OpenAIService.classify_user_intent plus a
+        `source` field. Messages with no matching rule get general_financial
+        with zero confidence.
+        """
+        scores, keywords = self._score(user_message)
+
+        if not scores:
+            return {
+                "intent": "general_financial",
+                "confidence": 0.0,
+                "keywords": [],
+                "requires_context": False,
+                "source": "local"
+            }
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        intent, top_score = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+
+        # Confidence falls as the runner-up intent gets closer to the winner
+        confidence = top_score / (top_score + runner_up + self.smoothing)
+
+        return {
+            "intent": intent,
+            "confidence": round(min(confidence, 0.99), 3),
+            "keywords": keywords[intent],
+            "requires_context": intent in self.CONTEXT_INTENTS,
+            "source": "local"
+        }
+
+    def is_confident(self, intent_result: Dict[str, Any]) -> bool:
+        """Check whether a local classification is good enough to skip the LLM"""
+        return intent_result.get("confidence", 0.0) >= self.confidence_threshold
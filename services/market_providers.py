@@ -0,0 +1,368 @@
+import os
+import time
+import zlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from typing import Dict, Any, List
+from datetime import datetime, timedelta
+from utils.http_client import HttpClient
+
+class MarketDataProvider:
+    """Upstream source of market data.
+
+    Providers return the data itself and raise on failure; caching and
+    response envelopes are handled by the callers, connection pooling and
+    retries by HttpClient.
+    """
+
+    name = "base"
+
+    def fetch_market_overview(self) -> Dict[str, Any]:
+        """Fetch indices, sector performance, sentiment and VIX"""
+        raise NotImplementedError
+    
+    def fetch_quote(self, symbol: str) -> Dict[str, Any]:
+        """Fetch the latest quote for one symbol"""
+        raise NotImplementedError
+    
+    def fetch_daily_closes(self, symbol: str, days: int) -> List[float]:
+        """Fetch up to `days` daily closes for one symbol, oldest first"""
+        raise NotImplementedError
+
+    # Concurrent single-symbol requests when a provider has no batch endpoint
+    max_fanout = 8
+
+    def _fan_out(self, fetch, symbols: List[str]) -> Dict[str, Any]:
+        """Call `fetch(symbol)` over a small thread pool; symbols that fail are left out"""
+        def fetch_one(symbol):
+            try:
+                return symbol, fetch(symbol)
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"{self.name}: no data for {symbol}: {e}")
+                return symbol, None
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_fanout, len(symbols)))) as executor:
+            return {symbol: result for symbol, result in executor.map(fetch_one, symbols) if result is not None}
+
+    def fetch_quotes(self, symbols: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Fetch quotes for several symbols, keyed by symbol; symbols that fail are left out.
+
+        Providers with a batch endpoint override this; the default fans out
+        fetch_quote.
+        """
+        return self._fan_out(self.fetch_quote, symbols)
+
+    def fetch_price_history(self, symbols: List[str], days: int) -> Dict[str, List[float]]:
+        """Fetch daily closes for several symbols, keyed by symbol, oldest first"""
+        return self._fan_out(lambda symbol: self.fetch_daily_closes(symbol, days), symbols)
+
+class NewsProvider:
+    """Upstream source of financial news; raises on failure like MarketDataProvider"""
+
+    name = "base"
+
+    def fetch_news(self, symbols: List[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        """Fetch recent articles, optionally filtered by symbols"""
+        raise NotImplementedError
+
+class StubMarketDataProvider(MarketDataProvider):
+    """Local provider returning fixed demo data, with optional latency and failures for tests"""
+
+    name = "stub"
+
+    def __init__(self, latency: float = 0.0, fail: bool = False):
+        self.logger = logging.getLogger(__name__)
+        self.latency = latency
+        self.fail = fail
+        self.calls = 0
+
+    def _call(self):
+        """Count the call and apply the configured latency or failure"""
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail:
+            raise RuntimeError("Stub market data provider configured to fail")
+
+    def fetch_market_overview(self) -> Dict[str, Any]:
+        """Return the demo market overview"""
+        self._call()
+
+        return {
+            "indices": {
+                "SPY": {"price": 445.67, "change": 1.23, "change_percent": 0.28},
+                "QQQ": {"price": 378.45, "change": -0.89, "change_percent": -0.23},
+                "IWM": {"price": 198.32, "change": 0.45, "change_percent": 0.23}
+            },
+            "sectors": {
+                "Technology": {"change_percent": 0.5},
+                "Healthcare": {"change_percent": -0.2},
+                "Finance": {"change_percent": 0.8},
+                "Energy": {"change_percent": 1.2}
+            },
+            "market_sentiment": "neutral",
+            "vix": 18.45,
+            "timestamp": datetime.now().isoformat()
+        }
+
+    def fetch_quote(self, symbol: str) -> Dict[str, Any]:
+        """Return a demo quote"""
+        self._call()
+        return self._demo_quote(symbol)
+
+    def fetch_quotes(self, symbols: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Return demo quotes for all symbols as one call"""
+        self._call()
+        return {symbol: self._demo_quote(symbol) for symbol in symbols}
+
+    def fetch_price_history(self, symbols: List[str], days: int) -> Dict[str, List[float]]:
+        """Return deterministic demo closes from a one-factor model, ending at the demo quote price.
+
+        Each symbol gets its own beta to a shared market series (SPY has beta
+        1), so analytics and risk numbers come out correlated like real data.
+        """
+        self._call()
+        market = np.random.default_rng(0).normal(0.0004, 0.01, days - 1)
+        histories = {}
+        for symbol in symbols:
+            rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+            beta = 1.0 if symbol == "SPY" else rng.uniform(0.5, 1.6)
+            noise = 0.001 if symbol == "SPY" else rng.uniform(0.005, 0.02)
+            log_returns = np.log1p(beta * market + rng.normal(0, noise, days - 1))
+            path = np.concatenate(([0.0], np.cumsum(log_returns)))
+            histories[symbol] = (self._demo_quote(symbol)["price"] * np.exp(path - path[-1])).round(2).tolist()
+        return histories
+
+    @staticmethod
+    def _demo_quote(symbol: str) -> Dict[str, Any]:
+        return {
+            "symbol": symbol.upper(),
+            "price": 150.25,
+            "change": 2.50,
+            "change_percent": 1.69,
+            "volume": 1234567,
+            "previous_close": 147.75,
+            "open": 148.00,
+            "high": 151.00,
+            "low": 147.50,
+            "timestamp": datetime.now().isoformat(),
+            "market_cap": 2500000000,
+            "pe_ratio": 15.5,
+            "dividend_yield": 2.1
+        }
+
+class StubNewsProvider(NewsProvider):
+    """Local news provider returning fixed demo articles"""
+
+    name = "stub"
+
+    def fetch_news(self, symbols: List[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        """Return the demo articles"""
+        return [
+            {
+                "title": "Market Analysis: Tech Stocks Show Resilience",
+                "description": "Technology stocks continue to outperform expectations despite market volatility...",
+                "source": "Financial Times",
+                "published_at": (datetime.now() - timedelta(hours=2)).isoformat(),
+                "url": "https://example.com/news/1",
+                "sentiment": "positive",
+                "relevance_score": 0.85
+            },
+            {
+                "title": "Federal Reserve Signals Interest Rate Stability",
+                "description": "The Federal Reserve indicated that interest rates will remain stable in the near term...",
+                "source": "Wall Street Journal",
+                "published_at": (datetime.now() - timedelta(hours=4)).isoformat(),
+                "url": "https://example.com/news/2",
+                "sentiment": "neutral",
+                "relevance_score": 0.92
+            },
+            {
+                "title": "Cryptocurrency Market Sees Mixed Signals",
+                "description": "Bitcoin and other cryptocurrencies show mixed performance as institutional adoption continues...",
+                "source": "CoinDesk",
+                "published_at": (datetime.now() - timedelta(hours=6)).isoformat(),
+                "url": "https://example.com/news/3",
+                "sentiment": "mixed",
+                "relevance_score": 0.78
+            }
+        ][:limit]
+
+class PolygonMarketDataProvider(MarketDataProvider):
+    """Polygon.io stock snapshots.
+
+    Index levels come from the SPY/QQQ/IWM ETFs and sector performance from
+    the SPDR sector ETFs, all in one snapshot request. VIX is not part of the
+    stock snapshot and is reported as None.
+    """
+
+    name = "polygon"
+    MAX_TICKERS_PER_REQUEST = 250  # Keeps the query string well under URL length limits
+    INDEX_TICKERS = ["SPY", "QQQ", "IWM"]
+    SECTOR_TICKERS = {"XLK": "Technology", "XLV": "Healthcare", "XLF": "Finance", "XLE": "Energy"}
+
+    def __init__(self, api_key: str = None, base_url: str = None, client: HttpClient = None):
+        self.api_key = api_key or os.environ.get("POLYGON_API_KEY", "demo_key")
+        self.client = client or HttpClient(
+            self.name,
+            base_url or os.environ.get("POLYGON_BASE_URL", "https://api.polygon.io"),
+            max_concurrency=int(os.environ.get("POLYGON_MAX_CONCURRENCY", "8"))
+        )
+
+    def _snapshots(self, tickers: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Snapshot several tickers in one request, keyed by ticker"""
+        payload = self.client.get_json(
+            "/v2/snapshot/locale/us/markets/stocks/tickers",
+            {"tickers": ",".join(tickers), "apiKey": self.api_key}
+        )
+        return {item["ticker"]: item for item in payload.get("tickers") or []}
+
+    @staticmethod
+    def _to_quote(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+        """Map a Polygon ticker snapshot to our quote shape"""
+        day = snapshot.get("day") or {}
+        price = (snapshot.get("lastTrade") or {}).get("p") or day.get("c")
+        updated = snapshot.get("updated")
+        return {
+            "symbol": snapshot["ticker"],
+            "price": price,
+            "change": snapshot.get("todaysChange"),
+            "change_percent": snapshot.get("todaysChangePerc"),
+            "volume": day.get("v"),
+            "previous_close": (snapshot.get("prevDay") or {}).get("c"),
+            "open": day.get("o"),
+            "high": day.get("h"),
+            "low": day.get("l"),
+            "timestamp": datetime.fromtimestamp(updated / 1e9).isoformat() if updated else datetime.now().isoformat()
+        }
+
+    def fetch_market_overview(self) -> Dict[str, Any]:
+        """Fetch index and sector ETF snapshots in a single request"""
+        snapshots = self._snapshots(self.INDEX_TICKERS + list(self.SECTOR_TICKERS))
+
+        indices = {}
+        for ticker in self.INDEX_TICKERS:
+            if ticker in snapshots:
+                quote = self._to_quote(snapshots[ticker])
+                indices[ticker] = {key: quote[key] for key in ("price", "change", "change_percent")}
+        sectors = {
+            sector: {"change_percent": snapshots[ticker].get("todaysChangePerc")}
+            for ticker, sector in self.SECTOR_TICKERS.items() if ticker in snapshots
+        }
+
+        changes = [index["change_percent"] for index in indices.values() if index["change_percent"] is not None]
+        average_change = sum(changes) / len(changes) if changes else 0.0
+        sentiment = "bullish" if average_change > 0.5 else "bearish" if average_change < -0.5 else "neutral"
+
+        return {
+            "indices": indices,
+            "sectors": sectors,
+            "market_sentiment": sentiment,
+            "vix": None,
+            "timestamp": datetime.now().isoformat()
+        }
+
+    def fetch_quote(self, symbol: str) -> Dict[str, Any]:
+        """Fetch one ticker snapshot"""
+        payload = self.client.get_json(
+            f"/v2/snapshot/locale/us/markets/stocks/tickers/{symbol.upper()}",
+            {"apiKey": self.api_key}
+        )
+        if not payload.get("ticker"):
+            raise ValueError(f"No quote for {symbol.upper()}")
+        return self._to_quote(payload["ticker"])
+
+    def fetch_daily_closes(self, symbol: str, days: int) -> List[float]:
+        """Fetch adjusted daily closes from the aggregates endpoint"""
+        end = datetime.now().date()
+        start = end - timedelta(days=int(days * 1.5) + 7)  # Calendar days covering `days` sessions
+        payload = self.client.get_json(
+            f"/v2/aggs/ticker/{symbol.upper()}/range/1/day/{start.isoformat()}/{end.isoformat()}",
+            {"adjusted": "true", "sort": "asc", "limit": 50000, "apiKey": self.api_key}
+        )
+        closes = [bar["c"] for bar in payload.get("results") or []]
+        if not closes:
+            raise ValueError(f"No price history for {symbol.upper()}")
+        return closes[-days:]
+
+    def fetch_quotes(self, symbols: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Fetch many tickers with one snapshot request per MAX_TICKERS_PER_REQUEST symbols"""
+        quotes = {}
+        for start in range(0, len(symbols), self.MAX_TICKERS_PER_REQUEST):
+            chunk = symbols[start:start + self.MAX_TICKERS_PER_REQUEST]
+            for ticker, snapshot in self._snapshots(chunk).items():
+                quotes[ticker] = self._to_quote(snapshot)
+        return quotes
+
+class MarketAuxNewsProvider(NewsProvider):
+    """MarketAux news feed with per-article sentiment from its entity scores"""
+
+    name = "marketaux"
+
+    def __init__(self, api_key: str = None, base_url: str = None, client: HttpClient = None):
+        self.api_key = api_key or os.environ.get("MARKETAUX_API_KEY", "demo_key")
+        self.client = client or HttpClient(
+            self.name,
+            base_url or os.environ.get("MARKETAUX_BASE_URL", "https://api.marketaux.com"),
+            max_concurrency=int(os.environ.get("MARKETAUX_MAX_CONCURRENCY", "4"))
+        )
+
+    @staticmethod
+    def _sentiment(entities: List[Dict[str, Any]]) -> str:
+        """Label an article from the average sentiment score of its entities"""
+        scores = [entity["sentiment_score"] for entity in entities if entity.get("sentiment_score") is not None]
+        if not scores:
+            return "neutral"
+        average = sum(scores) / len(scores)
+        return "positive" if average > 0.15 else "negative" if average < -0.15 else "neutral"
+
+    def fetch_news(self, symbols: List[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        """Fetch recent English articles, optionally filtered by symbols"""
+        params = {"api_token": self.api_key, "language": "en", "limit": limit}
+        if symbols:
+            params["symbols"] = ",".join(symbol.upper() for symbol in symbols)
+        payload = self.client.get_json("/v1/news/all", params)
+
+        articles = []
+        for article in payload.get("data") or []:
+            entities = article.get("entities") or []
+            match_scores = [entity["match_score"] for entity in entities if entity.get("match_score") is not None]
+            articles.append({
+                "title": article.get("title"),
+                "description": article.get("description"),
+                "source": article.get("source"),
+                "published_at": article.get("published_at"),
+                "url": article.get("url"),
+                "sentiment": self._sentiment(entities),
+                "relevance_score": round(max(match_scores) / 100, 2) if match_scores else None
+            })
+        return articles[:limit]
+
+# Providers selectable with MARKET_DATA_PROVIDER and NEWS_PROVIDER
+PROVIDERS = {
+    "stub": StubMarketDataProvider,
+    "polygon": PolygonMarketDataProvider
+}
+NEWS_PROVIDERS = {
+    "stub": StubNewsProvider,
+    "marketaux": MarketAuxNewsProvider
+}
+
+def create_market_provider(name: str = None) -> MarketDataProvider:
+    """Create the configured market data provider (stub by default)"""
+    name = name or os.environ.get("MARKET_DATA_PROVIDER", "stub")
+    provider_class = PROVIDERS.get(name)
+    if provider_class is None:
+        logging.getLogger(__name__).warning(f"Unknown market data provider {name}, using stub")
+        provider_class = StubMarketDataProvider
+    return provider_class()
+
+def create_news_provider(name: str = None) -> NewsProvider:
+    """Create the configured news provider (stub by default)"""
+    name = name or os.environ.get("NEWS_PROVIDER", "stub")
+    provider_class = NEWS_PROVIDERS.get(name)
+    if provider_class is None:
+        logging.getLogger(__name__).warning(f"Unknown news provider {name}, using stub")
+        provider_class = StubNewsProvider
+    return provider_class()
@@ -0,0 +1,194 @@
+import os
+import time
+import logging
+import threading
+from typing import Dict, Any, Optional
+from services.market_providers import MarketDataProvider
+
+class MarketSnapshotService:
+    """Serves the market overview from a versioned snapshot kept fresh in the background.
+
+    Readers get the in-process copy, falling back to the Redis copy shared by
+    all workers. A background thread refreshes the snapshot on a schedule;
+    only one process fetches upstream per refresh (Redis lock) and only one
+    thread per process fetches on a miss (single flight). Snapshots older
+    than `max_age` are still served while a refresh runs; past `max_stale`
+    they are no longer used.
+    """
+
+    SNAPSHOT_NAME = "overview"
+
+    def __init__(self, provider: MarketDataProvider, cache_service=None, refresh_interval: float = None):
+        self.logger = logging.getLogger(__name__)
+        self.provider = provider
+        self.cache_service = cache_service
+
+        if refresh_interval is None:
+            refresh_interval = float(os.environ.get("MARKET_SNAPSHOT_REFRESH_SECONDS", "15"))
+        self.refresh_interval = refresh_interval
+        self.max_age = refresh_interval * 2  # Older snapshots trigger a refresh when read
+        self.max_stale = 300  # Never serve snapshots older than 5 minutes
+        self.fetch_wait = 10  # Seconds a reader waits on another thread's fetch
+
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self._fetch_done: Optional[threading.Event] = None  # Set while a fetch is in flight
+        self._refresh_pending = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def _age(self, snapshot: Optional[Dict[str, Any]]) -> float:
+        return time.time() - snapshot["fetched_at"] if snapshot else float("inf")
+
+    def start(self):
+        """Start the background refresher (idempotent, restarted after a fork)"""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="market-snapshot", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        """Stop the background refresher"""
+        self._stop.set()
+
+    def _run(self):
+        """Refresh loop"""
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                self.logger.error(f"Error refreshing market snapshot: {e}")
+            self._stop.wait(self.refresh_interval)
+
+    def _read_shared(self) -> Optional[Dict[str, Any]]:
+        """Read the snapshot another worker published, if it is newer than ours"""
+        if not self.cache_service:
+            return None
+        snapshot = self.cache_service.get_cached_market_data(self.SNAPSHOT_NAME)
+        if snapshot and self._age(snapshot) <= self.max_stale:
+            with self._lock:
+                if not self._snapshot or snapshot["version"] > self._snapshot["version"]:
+                    self._snapshot = snapshot
+            return snapshot
+        return None
+
+    def _fetch(self) -> Optional[Dict[str, Any]]:
+        """Fetch upstream once across threads; concurrent callers wait for the same result"""
+        with self._lock:
+            in_flight = self._fetch_done
+            if in_flight is None:
+                self._fetch_done = threading.Event()
+
+        if in_flight is not None:
+            in_flight.wait(self.fetch_wait)
+            return self._snapshot
+
+        try:
+            # Other workers may already be fetching; if so, use what they publish
+            lock_token = None
+            if self.cache_service:
+                lock_token = self.cache_service.acquire_lock(
+                    f"market_snapshot:{self.SNAPSHOT_NAME}", int(self.fetch_wait * 1000)
+                )
+                if lock_token is None:
+                    return self._wait_for_shared()
+
+            try:
+                data = self.provider.fetch_market_overview()
+                fetched_at = time.time()
+                snapshot = {
+                    "version": int(fetched_at * 1000),
+                    "fetched_at": fetched_at,
+                    "source": self.provider.name,
+                    "data": data
+                }
+                with self._lock:
+                    self._snapshot = snapshot
+                if self.cache_service:
+                    self.cache_service.cache_market_data(self.SNAPSHOT_NAME, snapshot, timeout=self.max_stale)
+                return snapshot
+            finally:
+                if lock_token is not None:
+                    self.cache_service.release_lock(f"market_snapshot:{self.SNAPSHOT_NAME}", lock_token)
+        except Exception as e:
+            self.logger.error(f"Error fetching market overview: {e}")
+            return self._snapshot
+        finally:
+            with self._lock:
+                done, self._fetch_done = self._fetch_done, None
+            done.set()
+
+    def _wait_for_shared(self) -> Optional[Dict[str, Any]]:
+        """Poll Redis briefly for the snapshot another worker is fetching"""
+        current_version = self._snapshot["version"] if self._snapshot else 0
+        deadline = time.monotonic() + self.fetch_wait
+        while time.monotonic() < deadline:
+            snapshot = self._read_shared()
+            if snapshot and snapshot["version"] > current_version:
+                return snapshot
+            time.sleep(0.05)
+        return self._snapshot
+
+    def refresh(self) -> Optional[Dict[str, Any]]:
+        """Bring the snapshot up to date, fetching upstream only if no worker has a fresh copy"""
+        shared = self._read_shared()
+        if shared and self._age(shared) < self.refresh_interval:
+            return shared
+        return self._fetch()
+
+    def _refresh_in_background(self):
+        """Kick off one refresh without blocking the reader"""
+        with self._lock:
+            if self._refresh_pending or self._fetch_done is not None:
+                return
+            self._refresh_pending = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._refresh_pending = False
+
+        threading.Thread(target=run, name="market-snapshot-refresh", daemon=True).start()
+
+    def get_snapshot(self) -> Optional[Dict[str, Any]]:
+        """Return the current snapshot, fetching only when nothing usable is available"""
+        self.start()
+
+        snapshot = self._snapshot
+        if self._age(snapshot) > self.max_age:
+            snapshot = self._read_shared() or snapshot
+
+        age = self._age(snapshot)
+        if age <= self.max_age:
+            return snapshot
+        if age <= self.max_stale:
+            # Stale while revalidate
+            self._refresh_in_background()
+            return snapshot
+        return self._fetch()
+
+    def get_market_overview(self) -> Dict[str, Any]:
+        """Market overview in the FinancialDataService response shape, plus snapshot metadata"""
+        snapshot = self.get_snapshot()
+        if not snapshot or self._age(snapshot) > self.max_stale:
+            return {
+                "success": False,
+                "error": "Market data unavailable",
+                "data": None
+            }
+
+        return {
+            "success": True,
+            "data": snapshot["data"],
+            "source": snapshot["source"],
+            "version": snapshot["version"],
+            "age_seconds": round(self._age(snapshot), 1),
+            "stale": self._age(snapshot) > self.max_age
+        }
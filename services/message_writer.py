@@ -0,0 +1,178 @@
+import os
+import queue
+import atexit
+import threading
+import logging
+from typing import Dict, Any, List, Optional
+from sqlalchemy import insert
+from models import ChatMessage, ContextSnapshot
+from services.context_service import upsert_sessions
+from app import db
+
+class MessageWriter:
+    """Write-behind buffer for ChatMessage rows.
+
+    Rows are queued in memory and bulk-inserted by a background thread when
+    a batch fills up or the flush interval passes, so the request path does
+    not wait on a commit. Each batch upserts the sessions it touches, stores
+    new context snapshots and inserts its messages in one transaction.
+    Queued rows stay readable through get_pending() until they are written.
+    When the queue is full, enqueue() returns False and the caller writes
+    synchronously.
+    """
+
+    def __init__(self, app=None, enabled: bool = None):
+        self.logger = logging.getLogger(__name__)
+        self.app = app
+
+        if enabled is None:
+            enabled = os.environ.get("MESSAGE_WRITE_BEHIND_ENABLED", "false").lower() == "true"
+        self.enabled = enabled and app is not None
+
+        self.max_queue_size = int(os.environ.get("MESSAGE_WRITE_BEHIND_MAX_QUEUE", "10000"))
+        self.batch_size = int(os.environ.get("MESSAGE_WRITE_BEHIND_BATCH_SIZE", "500"))
+        self.flush_interval = float(os.environ.get("MESSAGE_WRITE_BEHIND_FLUSH_INTERVAL", "0.5"))
+        self.enqueue_timeout = float(os.environ.get("MESSAGE_WRITE_BEHIND_ENQUEUE_TIMEOUT", "0.05"))
+
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._pending: Dict[str, Dict[str, Dict[str, Any]]] = {}  # session_id -> {message id: row}
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        """Start the flusher thread on first use (and again after a fork)"""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            atexit.register(self.close)
+            self.logger.info("Message write-behind flusher started")
+
+    def enqueue(self, row: Dict[str, Any], session_values: Dict[str, Any] = None,
+                snapshots: Dict[str, Any] = None) -> bool:
+        """Queue a fully populated chat_messages row with optional session upsert values
+        and the context snapshots it references.
+        
+        Returns False if the caller must write synchronously.
+        """
+        if not self.enabled:
+            return False
+
+        self._ensure_started()
+
+        # Register before queueing so the flusher can never finish the row first
+        with self._pending_lock:
+            self._pending.setdefault(row["session_id"], {})[row["id"]] = row
+
+        try:
+            self._queue.put((row, session_values, snapshots or {}), timeout=self.enqueue_timeout)
+            return True
+        except queue.Full:
+            self._forget([row])
+            self.logger.warning("Message write-behind queue is full; writing synchronously")
+            return False
+
+    def get_pending(self, session_id: str) -> List[Dict[str, Any]]:
+        """Rows queued for a session that may not be in the database yet"""
+        with self._pending_lock:
+            return list(self._pending.get(session_id, {}).values())
+
+    def _forget(self, rows: List[Dict[str, Any]]):
+        """Drop rows from the pending index"""
+        with self._pending_lock:
+            for row in rows:
+                session_rows = self._pending.get(row["session_id"])
+                if session_rows is None:
+                    continue
+                session_rows.pop(row["id"], None)
+                if not session_rows:
+                    del self._pending[row["session_id"]]
+
+    def _drain(self, items: List[tuple] = None) -> List[tuple]:
+        """Top a batch up to batch_size with queued items without blocking"""
+        items = items if items is not None else []
+        while len(items) < self.batch_size:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        """Flusher loop: write a batch when it fills up or the interval passes"""
+        while not self._stop.is_set():
+            try:
+                first_item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            items = self._drain([first_item])
+            # Give a partial batch a moment to fill
+            if len(items) < self.batch_size and not self._stop.wait(self.flush_interval / 10):
+                items = self._drain(items)
+
+            with self._flush_lock:
+                self._write_batch(items)
+
+    def _write_batch(self, items: List[tuple]):
+        """Bulk-write a batch; on failure retry one by one so a bad row does not drop the batch"""
+        if not items:
+            return
+
+        rows = [row for row, _, _ in items]
+        # One upsert per session (the latest values win) ahead of the message inserts
+        sessions = {values["id"]: values for _, values, _ in items if values}
+        snapshots = {digest: data for _, _, item_snapshots in items for digest, data in item_snapshots.items()}
+
+        with self.app.app_context():
+            try:
+                upsert_sessions(list(sessions.values()))
+                ContextSnapshot.insert_missing(snapshots)
+                db.session.execute(insert(ChatMessage), rows)
+                db.session.commit()
+                ContextSnapshot.mark_persisted(snapshots)
+                self.logger.debug(f"Flushed {len(rows)} queued messages")
+            except Exception as e:
+                db.session.rollback()
+                self.logger.error(f"Error flushing {len(rows)} queued messages, retrying individually: {e}")
+                for row, session_values, item_snapshots in items:
+                    try:
+                        if session_values:
+                            upsert_sessions([session_values])
+                        ContextSnapshot.insert_missing(item_snapshots)
+                        db.session.execute(insert(ChatMessage), [row])
+                        db.session.commit()
+                        ContextSnapshot.mark_persisted(item_snapshots)
+                    except Exception as row_error:
+                        db.session.rollback()
+                        self.logger.error(f"Dropping queued message {row['id']}: {row_error}")
+
+        self._forget(rows)
+
+    def flush(self):
+        """Write everything queued so far from the calling thread"""
+        if not self.enabled:
+            return
+
+        with self._flush_lock:
+            while True:
+                items = self._drain()
+                if not items:
+                    break
+                self._write_batch(items)
+
+    def close(self, timeout: float = 5.0):
+        """Stop the flusher and write any remaining rows (registered with atexit)"""
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+        self.flush()
@@ -1,8 +1,9 @@
 import os
 import json
 import logging
-from openai import OpenAI
-from typing import Dict, List, Any
+from openai import AsyncOpenAI
+from typing import Dict, List, Any, AsyncIterator, Optional
+from services.request_coalescer import RequestCoalescer
 from utils.prompts import get_financial_assistant_prompt, get_educational_prompt, get_portfolio_analysis_prompt, get_market_interpretation_prompt
 
 # The newest OpenAI model is "gpt-4o" which was released May 13, 2024.
@@ -12,30 +13,131 @@ OPENAI_MODEL = "gpt-4o"
 class OpenAIService:
     """Service for interacting with OpenAI GPT-4o"""
     
-    def __init__(self):
-        self.client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    def __init__(self, coalescer: Optional[RequestCoalescer] = None):
+        self.client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
         self.model = OPENAI_MODEL
         self.logger = logging.getLogger(__name__)
+        self.coalescer = coalescer
     
-    async def process_financial_query(self, user_message: str, context: Dict[str, Any]) -> Dict[str, Any]:
-        """Process a general financial query with context"""
+    def _compose_messages(self, prompt: Dict[str, Any], user_content: str) -> List[Dict[str, str]]:
+        """Lay out chat messages in the same order for every request type.
+        
+        The static instruction prefix comes first and is byte-identical across
+        calls, so upstream prompt caching can reuse it. History turns follow as
+        user/assistant messages, then per-request context and the user's message.
+        """
+        messages = [{"role": "system", "content": prompt["prefix"]}]
+        messages.extend(prompt["turns"])
+        if prompt["context"]:
+            messages.append({"role": "system", "content": prompt["context"]})
+        messages.append({"role": "user", "content": user_content})
+        return messages
+    
+    def _financial_query_messages(self, user_message: str, context: Dict[str, Any]) -> List[Dict[str, str]]:
+        """Build chat messages for a general financial query"""
+        return self._compose_messages(get_financial_assistant_prompt(context), user_message)
+    
+    def _educational_messages(self, topic: str, user_level: str, context: Dict[str, Any]) -> List[Dict[str, str]]:
+        """Build chat messages for an educational explanation"""
+        user_prompt = f"Please explain the following financial topic: {topic}"
+        return self._compose_messages(get_educational_prompt(user_level, context), user_prompt)
+    
+    def _portfolio_messages(self, user_message: str, portfolio_data: Dict[str, Any], context: Dict[str, Any]) -> List[Dict[str, str]]:
+        """Build chat messages for a portfolio question"""
+        return self._compose_messages(get_portfolio_analysis_prompt(portfolio_data, context), user_message)
+    
+    def _market_messages(self, market_data: Dict[str, Any], user_query: str, context: Dict[str, Any]) -> List[Dict[str, str]]:
+        """Build chat messages for a market data interpretation"""
+        return self._compose_messages(get_market_interpretation_prompt(market_data), user_query)
+    
+    async def _complete(self, intent: str, messages: List[Dict[str, str]], max_tokens: int) -> Dict[str, Any]:
+        """Run a chat completion, sharing one upstream call between identical concurrent requests.
+        
+        Returns the content and tokens used; raises if the (possibly shared) call failed.
+        """
+        async def call():
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=0.8,  # Higher temperature for more conversational responses
+                max_tokens=max_tokens
+            )
+            return {
+                "content": response.choices[0].message.content,
+                "tokens_used": response.usage.total_tokens if response.usage else 0
+            }
+        
+        if not self.coalescer:
+            return await call()
+        
+        result = await self.coalescer.run(RequestCoalescer.fingerprint(intent, messages), call)
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        return result
+    
+    def _stream(self, intent: str, messages: List[Dict[str, str]], max_tokens: int, error_message: str) -> AsyncIterator[Dict[str, Any]]:
+        """Stream a chat completion, coalesced with identical in-flight requests"""
+        if not self.coalescer:
+            return self._stream_chat(messages, max_tokens, error_message)
+        return self.coalescer.stream(
+            RequestCoalescer.fingerprint(intent, messages),
+            lambda: self._stream_chat(messages, max_tokens, error_message),
+            error_message
+        )
+    
+    async def _stream_chat(self, messages: List[Dict[str, str]], max_tokens: int, error_message: str) -> AsyncIterator[Dict[str, Any]]:
+        """Stream a chat completion as token events followed by a final done event"""
+        chunks = []
+        tokens_used = 0
         try:
-            system_prompt = get_financial_assistant_prompt(context)
-            
-            response = self.client.chat.completions.create(
+            stream = await self.client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
+                messages=messages,
                 temperature=0.8,  # Higher temperature for more conversational responses
+                max_tokens=max_tokens,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            
+            async for chunk in stream:
+                if chunk.usage:
+                    tokens_used = chunk.usage.total_tokens
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    chunks.append(delta)
+                    yield {"type": "token", "content": delta}
+            
+            yield {
+                "type": "done",
+                "response": "".join(chunks),
+                "model_used": self.model,
+                "tokens_used": tokens_used
+            }
+        except Exception as e:
+            self.logger.error(f"Error streaming completion: {e}")
+            # Keep whatever was already sent to the client so the saved message matches it
+            yield {
+                "type": "done",
+                "response": "".join(chunks) or error_message,
+                "error": str(e),
+                "tokens_used": tokens_used
+            }
+    
+    async def process_financial_query(self, user_message: str, context: Dict[str, Any]) -> Dict[str, Any]:
+        """Process a general financial query with context"""
+        try:
+            completion = await self._complete(
+                "general_financial",
+                self._financial_query_messages(user_message, context),
                 max_tokens=1000
             )
             
             return {
-                "response": response.choices[0].message.content,
+                "response": completion["content"],
                 "model_used": self.model,
-                "tokens_used": response.usage.total_tokens if response.usage else 0
+                "tokens_used": completion["tokens_used"]
             }
         except Exception as e:
             self.logger.error(f"Error processing financial query: {e}")
@@ -44,28 +146,30 @@ class OpenAIService:
                 "error": str(e)
             }
     
+    def stream_financial_query(self, user_message: str, context: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Stream a general financial query response token by token"""
+        return self._stream(
+            "general_financial",
+            self._financial_query_messages(user_message, context),
+            max_tokens=1000,
+            error_message="I'm sorry, I'm having trouble processing your request right now. Please try again later."
+        )
+    
     async def generate_educational_response(self, topic: str, user_level: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Generate educational content based on topic and user level"""
         try:
-            system_prompt = get_educational_prompt(user_level, context)
-            user_prompt = f"Please explain the following financial topic: {topic}"
-            
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.8,  # Higher temperature for more conversational responses
+            completion = await self._complete(
+                "educational",
+                self._educational_messages(topic, user_level, context),
                 max_tokens=1200
             )
             
             return {
-                "response": response.choices[0].message.content,
+                "response": completion["content"],
                 "topic": topic,
                 "user_level": user_level,
                 "model_used": self.model,
-                "tokens_used": response.usage.total_tokens if response.usage else 0
+                "tokens_used": completion["tokens_used"]
             }
         except Exception as e:
             self.logger.error(f"Error generating educational response: {e}")
@@ -74,26 +178,29 @@ class OpenAIService:
                 "error": str(e)
             }
     
+    def stream_educational_response(self, topic: str, user_level: str, context: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Stream educational content token by token"""
+        return self._stream(
+            "educational",
+            self._educational_messages(topic, user_level, context),
+            max_tokens=1200,
+            error_message="I'm sorry, I couldn't generate educational content right now. Please try again later."
+        )
+    
     async def analyze_portfolio_question(self, user_message: str, portfolio_data: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
         """Analyze portfolio-related questions"""
         try:
-            system_prompt = get_portfolio_analysis_prompt(portfolio_data, context)
-            
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=0.8,  # Higher temperature for more conversational responses
+            completion = await self._complete(
+                "portfolio_analysis",
+                self._portfolio_messages(user_message, portfolio_data, context),
                 max_tokens=1000
             )
             
             return {
-                "response": response.choices[0].message.content,
+                "response": completion["content"],
                 "portfolio_analyzed": True,
                 "model_used": self.model,
-                "tokens_used": response.usage.total_tokens if response.usage else 0
+                "tokens_used": completion["tokens_used"]
             }
         except Exception as e:
             self.logger.error(f"Error analyzing portfolio question: {e}")
@@ -102,26 +209,29 @@ class OpenAIService:
                 "error": str(e)
             }
     
+    def stream_portfolio_question(self, user_message: str, portfolio_data: Dict[str, Any], context: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Stream a portfolio analysis response token by token"""
+        return self._stream(
+            "portfolio_analysis",
+            self._portfolio_messages(user_message, portfolio_data, context),
+            max_tokens=1000,
+            error_message="I'm sorry, I couldn't analyze your portfolio question right now. Please try again later."
+        )
+    
     async def get_market_interpretation(self, market_data: Dict[str, Any], user_query: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Interpret market data based on user query"""
         try:
-            system_prompt = get_market_interpretation_prompt(market_data)
-            
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_query}
-                ],
-                temperature=0.8,  # Higher temperature for more conversational responses
+            completion = await self._complete(
+                "market_data",
+                self._market_messages(market_data, user_query, context),
                 max_tokens=800
             )
             
             return {
-                "response": response.choices[0].message.content,
+                "response": completion["content"],
                 "market_data_used": True,
                 "model_used": self.model,
-                "tokens_used": response.usage.total_tokens if response.usage else 0
+                "tokens_used": completion["tokens_used"]
             }
         except Exception as e:
             self.logger.error(f"Error interpreting market data: {e}")
@@ -130,6 +240,47 @@ class OpenAIService:
                 "error": str(e)
             }
     
+    def stream_market_interpretation(self, market_data: Dict[str, Any], user_query: str, context: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Stream a market data interpretation token by token"""
+        return self._stream(
+            "market_data",
+            self._market_messages(market_data, user_query, context),
+            max_tokens=800,
+            error_message="I'm sorry, I couldn't interpret the market data right now. Please try again later."
+        )
+    
+    async def summarize_conversation(self, previous_summary: str, turns: List[Dict[str, str]]) -> Dict[str, Any]:
+        """Fold conversation turns into a rolling summary"""
+        try:
+            transcript = "\n".join(f"{turn['role'].capitalize()}: {turn['content']}" for turn in turns)
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": (
+                        "You maintain a running summary of a conversation between a user and a financial assistant. "
+                        "Merge the new exchanges into the existing summary. Keep the user's goals, holdings, "
+                        "preferences, experience level, open questions and anything the assistant committed to. "
+                        "Drop pleasantries and details of generic explanations. Reply with the updated summary only, "
+                        "in at most 150 words."
+                    )},
+                    {"role": "user", "content": f"Existing summary:\n{previous_summary or '(none)'}\n\nNew exchanges:\n{transcript}"}
+                ],
+                temperature=0.3,
+                max_tokens=300
+            )
+            
+            return {
+                "summary": response.choices[0].message.content.strip(),
+                "tokens_used": response.usage.total_tokens if response.usage else 0
+            }
+        except Exception as e:
+            self.logger.error(f"Error summarizing conversation: {e}")
+            return {
+                "summary": "",
+                "error": str(e),
+                "tokens_used": 0
+            }
+    
     async def classify_user_intent(self, user_message: str) -> Dict[str, Any]:
         """Classify user intent to route to appropriate handler"""
         try:
@@ -150,7 +301,7 @@ class OpenAIService:
                 "requires_context": true/false
             }"""
             
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.model,
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -162,6 +313,7 @@ class OpenAIService:
             )
             
             result = json.loads(response.choices[0].message.content)
+            result["tokens_used"] = response.usage.total_tokens if response.usage else 0
             return result
         except Exception as e:
             self.logger.error(f"Error classifying user intent: {e}")
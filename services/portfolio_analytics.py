@@ -0,0 +1,205 @@
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+import numpy as np
+
+TRADING_DAYS = 252
+BENCHMARK_SYMBOL = "SPY"
+MAX_PERFORMERS = 5
+
+# Sector for common tickers when a position does not carry its own
+SECTOR_BY_SYMBOL = {
+    "AAPL": "Technology", "MSFT": "Technology", "NVDA": "Technology", "GOOGL": "Technology",
+    "GOOG": "Technology", "META": "Technology", "AVGO": "Technology", "ORCL": "Technology",
+    "CRM": "Technology", "ADBE": "Technology", "AMD": "Technology", "INTC": "Technology",
+    "AMZN": "Consumer", "TSLA": "Consumer", "HD": "Consumer", "MCD": "Consumer",
+    "NKE": "Consumer", "COST": "Consumer", "WMT": "Consumer", "PG": "Consumer", "KO": "Consumer",
+    "PEP": "Consumer",
+    "JNJ": "Healthcare", "UNH": "Healthcare", "LLY": "Healthcare", "PFE": "Healthcare",
+    "MRK": "Healthcare", "ABBV": "Healthcare",
+    "JPM": "Finance", "BAC": "Finance", "WFC": "Finance", "GS": "Finance", "MS": "Finance",
+    "V": "Finance", "MA": "Finance", "BRK.B": "Finance",
+    "XOM": "Energy", "CVX": "Energy", "COP": "Energy",
+    "BND": "Fixed Income", "AGG": "Fixed Income", "TLT": "Fixed Income",
+    "SPY": "Broad Market", "VOO": "Broad Market", "VTI": "Broad Market", "QQQ": "Broad Market",
+}
+
+class PortfolioAnalytics:
+    """Vectorized portfolio analytics over position and price-history arrays.
+
+    Positions become arrays of quantities and prices and price histories an
+    (n positions x T days) matrix, so every metric is a handful of NumPy
+    operations regardless of portfolio size. Inputs come from the provider
+    layer; this class does no I/O.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def aggregate_positions(positions: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Merge lots of the same symbol into position arrays.
+
+        Returns symbols, quantities, entry prices (quantity-weighted) and sectors.
+        """
+        raw_symbols = np.array([str(position["symbol"]).strip().upper() for position in positions])
+        raw_quantities = np.array([float(position["quantity"]) for position in positions])
+        raw_prices = np.array([float(position["price"]) for position in positions])
+
+        symbols, first_index, inverse = np.unique(raw_symbols, return_index=True, return_inverse=True)
+        quantities = np.bincount(inverse, weights=raw_quantities, minlength=len(symbols))
+        cost = np.bincount(inverse, weights=raw_quantities * raw_prices, minlength=len(symbols))
+        entry_prices = np.divide(cost, quantities, out=raw_prices[first_index].copy(), where=quantities != 0)
+
+        sectors = [
+            positions[index].get("sector") or SECTOR_BY_SYMBOL.get(symbol, "Other")
+            for symbol, index in zip(symbols.tolist(), first_index.tolist())
+        ]
+        return {
+            "symbols": symbols.tolist(),
+            "quantities": quantities,
+            "entry_prices": entry_prices,
+            "sectors": sectors
+        }
+
+    @staticmethod
+    def align_histories(symbols: List[str], histories: Dict[str, List[float]],
+                        fallback_prices: np.ndarray) -> Dict[str, Any]:
+        """Stack close histories into an (n x T) matrix over their common trailing window.
+
+        Symbols without a usable history get a flat series at their fallback
+        price, so they contribute value but no return or risk.
+        """
+        lengths = [len(histories.get(symbol) or []) for symbol in symbols]
+        usable = [length for length in lengths if length >= 2]
+        days = min(usable) if usable else 2
+
+        matrix = np.repeat(fallback_prices[:, None], days, axis=1)
+        missing = []
+        for row, symbol in enumerate(symbols):
+            closes = histories.get(symbol) or []
+            if len(closes) >= 2:
+                matrix[row] = closes[-days:]
+            else:
+                missing.append(symbol)
+        return {"closes": matrix, "missing": missing}
+
+    @staticmethod
+    def daily_returns(closes: np.ndarray) -> np.ndarray:
+        """Simple daily returns along the last axis"""
+        return np.diff(closes, axis=-1) / closes[..., :-1]
+
+    @staticmethod
+    def diversification(weights: np.ndarray) -> Dict[str, float]:
+        """Herfindahl concentration and a 0-1 diversification score (1 = equal weights)"""
+        herfindahl = float(np.sum(weights ** 2))
+        n = len(weights)
+        score = (1 - herfindahl) / (1 - 1 / n) if n > 1 else 0.0
+        return {
+            "herfindahl_index": herfindahl,
+            "effective_positions": 1 / herfindahl if herfindahl else 0.0,
+            "diversification_score": max(0.0, min(1.0, score))
+        }
+
+    @staticmethod
+    def risk_level(annual_volatility: float) -> str:
+        """Bucket annualized volatility into a risk label"""
+        if annual_volatility < 0.10:
+            return "low"
+        if annual_volatility < 0.18:
+            return "moderate"
+        if annual_volatility < 0.28:
+            return "high"
+        return "very high"
+
+    def analyze(self, positions: Dict[str, Any], prices: np.ndarray, previous_closes: np.ndarray,
+                closes: np.ndarray, benchmark_closes: Optional[np.ndarray] = None) -> Dict[str, Any]:
+        """Compute portfolio metrics.
+
+        `positions` comes from aggregate_positions; `prices` and
+        `previous_closes` are current quotes per position; `closes` is the
+        aligned (n x T) history and `benchmark_closes` the benchmark's closes
+        over the same window.
+        """
+        quantities = positions["quantities"]
+        symbols = positions["symbols"]
+
+        market_values = quantities * prices
+        total_value = float(market_values.sum())
+        weights = market_values / total_value if total_value else np.zeros_like(market_values)
+
+        daily_changes = quantities * (prices - previous_closes)
+        daily_change = float(daily_changes.sum())
+        previous_value = float((quantities * previous_closes).sum())
+
+        # Per-position and portfolio returns over the history window
+        returns = self.daily_returns(closes)  # n x (T-1)
+        portfolio_returns = weights @ returns
+        period_returns = closes[:, -1] / closes[:, 0] - 1
+        position_volatility = returns.std(axis=1, ddof=1) * np.sqrt(TRADING_DAYS) if returns.shape[1] > 1 else np.zeros(len(symbols))
+        volatility = float(portfolio_returns.std(ddof=1) * np.sqrt(TRADING_DAYS)) if len(portfolio_returns) > 1 else 0.0
+        unrealized = (prices - positions["entry_prices"]) / positions["entry_prices"]
+
+        beta = None
+        position_betas = np.full(len(symbols), np.nan)
+        if benchmark_closes is not None and len(benchmark_closes) == closes.shape[1] and closes.shape[1] > 2:
+            benchmark_returns = self.daily_returns(benchmark_closes)
+            centered_benchmark = benchmark_returns - benchmark_returns.mean()
+            benchmark_variance = float(centered_benchmark @ centered_benchmark)
+            if benchmark_variance > 0:
+                centered = returns - returns.mean(axis=1, keepdims=True)
+                position_betas = centered @ centered_benchmark / benchmark_variance
+                beta = float(weights @ position_betas)
+
+        # Sector exposure: sum weights per sector label
+        sector_names, sector_index = np.unique(positions["sectors"], return_inverse=True)
+        sector_weights = np.bincount(sector_index, weights=weights, minlength=len(sector_names))
+        sector_order = np.argsort(-sector_weights)
+
+        # Top and bottom performers over the window without sorting every position
+        k = min(MAX_PERFORMERS, len(symbols))
+        if len(symbols) > k:
+            top = np.argpartition(-period_returns, k - 1)[:k]
+            bottom = np.argpartition(period_returns, k - 1)[:k]
+        else:
+            top = bottom = np.arange(len(symbols))
+        top = top[np.argsort(-period_returns[top])]
+        bottom = bottom[np.argsort(period_returns[bottom])]
+
+        position_rows = [
+            {
+                "symbol": symbol,
+                "quantity": quantity,
+                "price": price,
+                "value": value,
+                "weight_percent": weight * 100,
+                "sector": sector,
+                "period_return_percent": period_return * 100,
+                "unrealized_return_percent": unrealized_return * 100,
+                "volatility_percent": position_vol * 100,
+                "beta": None if np.isnan(position_beta) else position_beta
+            }
+            for symbol, quantity, price, value, weight, sector, period_return, unrealized_return, position_vol, position_beta in zip(
+                symbols, quantities.tolist(), prices.tolist(), market_values.tolist(), weights.tolist(),
+                positions["sectors"], period_returns.tolist(), unrealized.tolist(),
+                position_volatility.tolist(), position_betas.tolist()
+            )
+        ]
+
+        return {
+            "total_value": total_value,
+            "daily_change": daily_change,
+            "daily_change_percent": daily_change / previous_value * 100 if previous_value else 0.0,
+            "period_days": int(closes.shape[1] - 1),
+            "period_return_percent": float(weights @ period_returns) * 100,
+            "volatility_percent": volatility * 100,
+            "beta": beta,
+            "risk_level": self.risk_level(volatility),
+            **self.diversification(weights),
+            "sectors": {str(sector_names[i]): float(sector_weights[i]) * 100 for i in sector_order},
+            "top_performers": [{"symbol": symbols[i], "return": float(period_returns[i]) * 100} for i in top],
+            "bottom_performers": [{"symbol": symbols[i], "return": float(period_returns[i]) * 100} for i in bottom],
+            "position_count": len(symbols),
+            "positions": position_rows,
+            "timestamp": datetime.now().isoformat()
+        }
@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import atexit
+import hashlib
+import logging
+import threading
+import multiprocessing
+from datetime import date
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+import numpy as np
+
+def _parse_list(value: str, cast) -> List:
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+def correlation_factor(returns: np.ndarray) -> Tuple[np.ndarray, str]:
+    """Factor L with L @ L.T equal to the sample covariance of daily returns (n x T).
+
+    Uses the Cholesky decomposition when the covariance is full rank. With
+    more positions than observations (or a singular matrix) the centered
+    returns themselves are an exact, cheaper factor.
+    """
+    n, observations = returns.shape
+    centered = returns - returns.mean(axis=1, keepdims=True)
+    if n < observations:
+        covariance = centered @ centered.T / (observations - 1)
+        try:
+            # Tiny ridge keeps near-singular matrices (e.g. duplicated tickers) decomposable
+            ridge = 1e-12 * np.trace(covariance) / n
+            return np.linalg.cholesky(covariance + ridge * np.eye(n)), "cholesky"
+        except np.linalg.LinAlgError:
+            pass
+    return centered / np.sqrt(observations - 1), "returns_factor"
+
+def simulate_portfolio_returns(weights: np.ndarray, mean: np.ndarray, factor: np.ndarray,
+                               horizons: List[int], paths: int, seed) -> np.ndarray:
+    """Simulated portfolio simple returns, one row per horizon.
+
+    Daily log returns are multivariate normal with the given mean and
+    covariance factor, so the log return over h days is one draw with mean
+    h * mean and factor sqrt(h) * factor. The same normal draws are reused
+    for every horizon (common random numbers). Module-level so process pool
+    workers can run it.
+    """
+    rng = np.random.default_rng(seed)
+    shocks = rng.standard_normal((paths, factor.shape[1])) @ factor.T  # paths x n
+    results = np.empty((len(horizons), paths))
+    for row, horizon in enumerate(horizons):
+        log_returns = horizon * mean + np.sqrt(horizon) * shocks
+        results[row] = np.expm1(log_returns) @ weights
+    return results
+
+class PortfolioRiskEngine:
+    """Monte Carlo VaR and CVaR for a portfolio.
+
+    Correlated returns are simulated from the covariance of the positions'
+    daily log returns (see correlation_factor) for several horizons and
+    confidence levels at once. Large simulations are split into chunks run
+    on a process pool with independent seeds. Results are cached as
+    returns, keyed by a hash of the positions, their rounded weights and the
+    settings (per day, since histories move daily), and converted to
+    currency at the current portfolio value on every read. Concurrent
+    requests for the same portfolio share one computation.
+    """
+
+    def __init__(self, cache_service=None):
+        self.logger = logging.getLogger(__name__)
+        self.cache_service = cache_service
+
+        self.paths = int(os.environ.get("PORTFOLIO_RISK_PATHS", "20000"))
+        self.horizons = _parse_list(os.environ.get("PORTFOLIO_RISK_HORIZONS", "1,10"), int)
+        self.confidences = _parse_list(os.environ.get("PORTFOLIO_RISK_CONFIDENCES", "0.95,0.99"), float)
+        self.pool_size = int(os.environ.get("PORTFOLIO_RISK_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.chunk_paths = 5000
+        self.parallel_threshold = 5_000_000  # paths x positions above which chunks go to the pool
+        self.cache_timeout = 3600
+
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_pid: Optional[int] = None
+        self._pool_lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+
+    def _get_pool(self) -> Optional[ProcessPoolExecutor]:
+        """Process pool for simulation chunks, created on first use and again after a fork"""
+        if self.pool_size <= 1:
+            return None
+        if self._pool is not None and self._pool_pid == os.getpid():
+            return self._pool
+
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                # Spawned workers avoid inheriting locks held by the app's background threads
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.pool_size, mp_context=multiprocessing.get_context("spawn")
+                )
+                self._pool_pid = os.getpid()
+                atexit.register(self.close)
+        return self._pool
+
+    def close(self):
+        """Shut the process pool down (registered with atexit)"""
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def portfolio_hash(self, symbols: List[str], quantities: np.ndarray, weights: np.ndarray, paths: int,
+                       horizons: List[int], confidences: List[float]) -> str:
+        """Cache key for a portfolio and simulation settings, valid for the current day.
+
+        Weights are rounded to whole percents: quote ticks keep the key, a
+        real shift in the mix changes it.
+        """
+        payload = json.dumps({
+            "positions": sorted(zip(symbols, np.round(quantities, 6).tolist(), np.round(weights, 2).tolist())),
+            "paths": paths,
+            "horizons": horizons,
+            "confidences": confidences,
+            "date": date.today().isoformat()
+        }, separators=(',', ':'))
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _simulate(self, weights: np.ndarray, mean: np.ndarray, factor: np.ndarray,
+                  horizons: List[int], paths: int, seed: Optional[int]) -> np.ndarray:
+        """Run the simulation in-process or as parallel chunks"""
+        seeds = np.random.SeedSequence(seed)
+        pool = self._get_pool() if paths * len(weights) >= self.parallel_threshold else None
+        if pool is None or paths <= self.chunk_paths:
+            return simulate_portfolio_returns(weights, mean, factor, horizons, paths, seeds)
+
+        chunks = [min(self.chunk_paths, paths - start) for start in range(0, paths, self.chunk_paths)]
+        futures = [
+            pool.submit(simulate_portfolio_returns, weights, mean, factor, horizons, chunk, child)
+            for chunk, child in zip(chunks, seeds.spawn(len(chunks)))
+        ]
+        return np.concatenate([future.result() for future in futures], axis=1)
+
+    def _risk_measures(self, simulated: np.ndarray, horizons: List[int],
+                       confidences: List[float]) -> List[Dict[str, Any]]:
+        """VaR and CVaR (expected shortfall) per horizon and confidence level, as positive percent losses"""
+        measures = []
+        for horizon, returns in zip(horizons, simulated):
+            losses = -returns
+            thresholds = np.quantile(losses, confidences)
+            for confidence, var in zip(confidences, thresholds.tolist()):
+                tail = losses[losses >= var]
+                cvar = float(tail.mean()) if tail.size else var
+                measures.append({
+                    "horizon_days": horizon,
+                    "confidence": confidence,
+                    "var_percent": var * 100,
+                    "cvar_percent": cvar * 100
+                })
+        return measures
+
+    @staticmethod
+    def _in_currency(result: Dict[str, Any], total_value: float) -> Dict[str, Any]:
+        """Add the portfolio value and VaR/CVaR amounts at that value to a cached result"""
+        return {
+            **result,
+            "total_value": total_value,
+            "measures": [
+                {**measure, "var": measure["var_percent"] / 100 * total_value,
+                 "cvar": measure["cvar_percent"] / 100 * total_value}
+                for measure in result["measures"]
+            ]
+        }
+
+    def compute(self, symbols: List[str], quantities: np.ndarray, prices: np.ndarray, closes: np.ndarray,
+                paths: int = None, horizons: List[int] = None, confidences: List[float] = None,
+                seed: Optional[int] = None) -> Dict[str, Any]:
+        """Simulate the portfolio and return VaR/CVaR for each horizon and confidence level.
+
+        `closes` is the aligned (n x T) daily close matrix from PortfolioAnalytics.
+        """
+        paths = paths or self.paths
+        horizons = horizons or self.horizons
+        confidences = confidences or self.confidences
+        market_values = quantities * prices
+        total_value = float(market_values.sum())
+        weights = market_values / total_value if total_value else np.zeros_like(market_values)
+        key = self.portfolio_hash(symbols, quantities, weights, paths, horizons, confidences)
+        cache_key = f"portfolio_risk:{key}"
+
+        if self.cache_service:
+            cached = self.cache_service.get(cache_key)
+            if cached:
+                return {**self._in_currency(cached, total_value), "cached": True}
+
+        # Single flight: concurrent requests for the same portfolio wait for one simulation
+        with self._inflight_lock:
+            in_flight = self._inflight.get(key)
+            if in_flight is None:
+                self._inflight[key] = Future()
+        if in_flight is not None:
+            return {**self._in_currency(in_flight.result(), total_value), "cached": True}
+
+        future = self._inflight[key]
+        try:
+            start = time.perf_counter()
+            log_returns = np.diff(np.log(closes), axis=1)
+            factor, method = correlation_factor(log_returns)
+            simulated = self._simulate(weights, log_returns.mean(axis=1), factor, horizons, paths, seed)
+
+            result = {
+                "portfolio_hash": key,
+                "paths": paths,
+                "observations": int(log_returns.shape[1]),
+                "covariance_method": method,
+                "measures": self._risk_measures(simulated, horizons, confidences),
+                "computed_ms": round((time.perf_counter() - start) * 1000, 1)
+            }
+            if self.cache_service:
+                self.cache_service.set(cache_key, result, self.cache_timeout)
+            future.set_result(result)
+            return self._in_currency(result, total_value)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
@@ -0,0 +1,317 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Redis key and channel prefix for finished upstream results
+RESULT_PREFIX = "llm_result:"
+
+class LeaderAbandoned(Exception):
+    """The request being waited on stopped before producing a result"""
+
+def normalize_request_text(text: str) -> str:
+    """Fold case, whitespace and trailing punctuation so trivially different texts match"""
+    return re.sub(r"\s+", " ", (text or "").lower()).strip().rstrip("?!. ")
+
+class RequestCoalescer:
+    """Single-flight coalescing of identical in-flight LLM requests.
+
+    Requests with the same fingerprint (intent, hash of the prompt messages,
+    normalized user text) share one upstream call: within a process through
+    a future on the shared event loop, and across workers and hosts through
+    a Redis lock held by the leader and a per-request pub/sub channel it
+    publishes the result on. Followers are charged no tokens. If the leader
+    goes away before finishing, it releases the lock and tells followers,
+    who then make their own call.
+
+    Results are dicts with `content` and `tokens_used`, or `error`.
+    """
+
+    def __init__(self, cache_service=None, wait_timeout: float = None):
+        self.logger = logging.getLogger(__name__)
+        self.cache_service = cache_service
+        self.redis_client = cache_service.redis_client if cache_service else None
+
+        # Well under the 15s response timeout, so a follower that gives up still has time for its own call
+        if wait_timeout is None:
+            wait_timeout = float(os.environ.get("LLM_COALESCE_WAIT_SECONDS", "8"))
+        self.wait_timeout = wait_timeout
+        self.lock_timeout_ms = 30000  # Outlives the leader's upstream call
+        self.result_timeout = 30  # Seconds a finished result stays readable for late followers
+        self.poll_interval = 0.05  # Seconds between subscription updates in the listener
+
+        self._inflight: Dict[str, asyncio.Future] = {}  # Local leaders, touched only on the event loop
+        # Fingerprint -> (subscribed, result) future pairs of local followers of other workers
+        self._remote_waiters: Dict[str, List[Tuple[asyncio.Future, asyncio.Future]]] = {}
+        self._subscribed = set()  # Fingerprints whose result channel is confirmed subscribed
+        self._waiters_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(intent: str, messages: List[Dict[str, str]]) -> str:
+        """Fingerprint a request from its intent, prompt messages and normalized user text"""
+        prompt_hash = hashlib.sha256(
+            json.dumps(messages[:-1], sort_keys=True, separators=(',', ':')).encode()
+        ).hexdigest()
+        user_text = normalize_request_text(messages[-1]["content"])
+        return hashlib.sha256(f"{intent}|{prompt_hash}|{user_text}".encode()).hexdigest()
+
+    @staticmethod
+    def _as_follower(result: Dict[str, Any]) -> Dict[str, Any]:
+        """A shared result as seen by a follower: nothing was spent on its behalf"""
+        return {**result, "tokens_used": 0, "coalesced": True}
+
+    def _lock_name(self, fingerprint: str) -> str:
+        return f"llm:{fingerprint}"
+
+    async def _claim(self, fingerprint: str) -> Optional[str]:
+        """Try to become the cross-process leader; returns a lock token if we are"""
+        if not self.redis_client:
+            return "local"
+        return await asyncio.to_thread(
+            self.cache_service.acquire_lock, self._lock_name(fingerprint), self.lock_timeout_ms
+        )
+
+    async def _wait_for_remote(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Wait for another worker's result; None if it does not arrive in time"""
+        self._ensure_listener()
+        loop = asyncio.get_running_loop()
+        entry = (loop.create_future(), loop.create_future())
+        with self._waiters_lock:
+            self._remote_waiters.setdefault(fingerprint, []).append(entry)
+            if fingerprint in self._subscribed:
+                entry[0].set_result(True)
+
+        try:
+            return await asyncio.wait_for(self._receive(fingerprint, *entry), self.wait_timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Timed out waiting for coalesced request {fingerprint[:12]}, calling upstream")
+            return None
+        finally:
+            with self._waiters_lock:
+                waiters = self._remote_waiters.get(fingerprint, [])
+                if entry in waiters:
+                    waiters.remove(entry)
+                if not waiters:
+                    self._remote_waiters.pop(fingerprint, None)
+
+    async def _receive(self, fingerprint: str, subscribed: asyncio.Future,
+                       waiter: asyncio.Future) -> Dict[str, Any]:
+        """Wait for the result channel subscription, then for the result"""
+        await subscribed
+        # The leader may have finished before we subscribed
+        raw = await asyncio.to_thread(self.redis_client.get, f"{RESULT_PREFIX}{fingerprint}")
+        if raw:
+            return json.loads(raw)
+        return await waiter
+
+    def _publish_result(self, fingerprint: str, result: Dict[str, Any], lock_token: Optional[str]):
+        """Share a leader's result with other workers and release the lock (blocking)"""
+        payload = json.dumps(result)
+        pipe = self.redis_client.pipeline(transaction=False)
+        # Errors go to current waiters only; they are not kept for later requests
+        if "error" not in result:
+            pipe.setex(f"{RESULT_PREFIX}{fingerprint}", self.result_timeout, payload)
+        pipe.publish(f"{RESULT_PREFIX}{fingerprint}", payload)
+        pipe.execute()
+        if lock_token:
+            self.cache_service.release_lock(self._lock_name(fingerprint), lock_token)
+
+    async def _publish(self, fingerprint: str, result: Dict[str, Any], lock_token: Optional[str]):
+        """Share a leader's result with other workers and release the lock"""
+        if not self.redis_client:
+            return
+        try:
+            await asyncio.to_thread(self._publish_result, fingerprint, result, lock_token)
+        except Exception as e:
+            self.logger.error(f"Error publishing coalesced result: {e}")
+
+    def _abandon(self, fingerprint: str, lock_token: Optional[str]):
+        """Release a cancelled leader's lock and tell other workers' followers to call upstream.
+
+        Runs in the background: it is called from cleanup code that may not await.
+        """
+        if not self.redis_client or not lock_token:
+            return
+
+        def abandon():
+            try:
+                self._publish_result(fingerprint, {"error": "leader abandoned", "abandoned": True}, lock_token)
+            except Exception as e:
+                self.logger.error(f"Error abandoning coalesced request: {e}")
+
+        asyncio.get_running_loop().run_in_executor(None, abandon)
+
+    def _ensure_listener(self):
+        """Start the result listener thread once per process"""
+        if self._listener_pid == os.getpid():
+            return
+        with self._listener_lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._loop = asyncio.get_running_loop()
+            thread = threading.Thread(target=self._listen_for_results, name="llm-coalescer", daemon=True)
+            thread.start()
+            self._listener_pid = os.getpid()
+
+    def _listen_for_results(self):
+        """Subscribe to the result channels local followers wait on and hand them the results.
+
+        PubSub objects are not thread safe, so every subscribe and unsubscribe
+        happens here: between reads the subscriptions are brought in line with
+        the fingerprints that currently have waiters.
+        """
+        while True:
+            pubsub = self.redis_client.pubsub()
+            channels = set()
+            try:
+                while True:
+                    with self._waiters_lock:
+                        wanted = {f"{RESULT_PREFIX}{fingerprint}" for fingerprint in self._remote_waiters}
+                        stale = channels - wanted
+                        self._subscribed.difference_update(channel[len(RESULT_PREFIX):] for channel in stale)
+                    if wanted - channels:
+                        pubsub.subscribe(*(wanted - channels))
+                    if stale:
+                        pubsub.unsubscribe(*stale)
+                    channels = wanted
+
+                    message = pubsub.get_message(timeout=self.poll_interval)
+                    if message is None or message["type"] not in ("subscribe", "message"):
+                        continue
+                    channel = message["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    fingerprint = channel[len(RESULT_PREFIX):]
+
+                    with self._waiters_lock:
+                        if message["type"] == "subscribe" and channel in channels:
+                            self._subscribed.add(fingerprint)
+                        entries = list(self._remote_waiters.get(fingerprint, []))
+                    if message["type"] == "subscribe":
+                        for subscribed, _ in entries:
+                            self._loop.call_soon_threadsafe(self._resolve, subscribed, True)
+                    elif entries:
+                        result = json.loads(message["data"])
+                        for _, waiter in entries:
+                            self._loop.call_soon_threadsafe(self._resolve, waiter, result)
+            except Exception as e:
+                self.logger.error(f"Coalesced result listener error: {e}")
+                with self._waiters_lock:
+                    self._subscribed.clear()
+                time.sleep(1)
+            finally:
+                pubsub.close()
+
+    @staticmethod
+    def _resolve(waiter: asyncio.Future, result: Any):
+        if not waiter.done():
+            waiter.set_result(result)
+
+    async def _lead(self, fingerprint: str, future: asyncio.Future) -> Optional[str]:
+        """Register as local leader and resolve the cross-process role.
+
+        Returns the lock token when this request must call upstream, or None
+        after resolving `future` with another worker's result.
+        """
+        lock_token = await self._claim(fingerprint)
+        if lock_token is not None:
+            return lock_token
+
+        result = await self._wait_for_remote(fingerprint)
+        if result is None or result.get("abandoned"):
+            return ""  # Call upstream without holding the lock
+        future.set_result(result)
+        return None
+
+    async def run(self, fingerprint: str, call: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Run `call` once for all concurrent requests with this fingerprint"""
+        existing = self._inflight.get(fingerprint)
+        if existing is not None:
+            try:
+                return self._as_follower(await asyncio.shield(existing))
+            except LeaderAbandoned:
+                return await call()
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[fingerprint] = future
+        lock_token = None
+        try:
+            lock_token = await self._lead(fingerprint, future)
+            if lock_token is None:
+                return self._as_follower(future.result())
+
+            try:
+                result = await call()
+            except Exception as e:
+                result = {"error": str(e)}
+                future.set_result(result)
+                await self._publish(fingerprint, result, lock_token)
+                raise
+
+            future.set_result(result)
+            await self._publish(fingerprint, result, lock_token)
+            return result
+        finally:
+            if not future.done():
+                future.set_exception(LeaderAbandoned())
+                future.exception()  # Mark retrieved so asyncio does not log it
+                self._abandon(fingerprint, lock_token)
+            self._inflight.pop(fingerprint, None)
+
+    async def stream(self, fingerprint: str, stream_factory: Callable[[], AsyncIterator[Dict[str, Any]]],
+                     error_message: str) -> AsyncIterator[Dict[str, Any]]:
+        """Coalesce a token stream; followers receive the finished response as one token event"""
+        existing = self._inflight.get(fingerprint)
+        if existing is not None:
+            try:
+                result = await asyncio.shield(existing)
+            except LeaderAbandoned:
+                async for event in stream_factory():
+                    yield event
+                return
+            for event in self._follower_events(result, error_message):
+                yield event
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[fingerprint] = future
+        lock_token = None
+        try:
+            lock_token = await self._lead(fingerprint, future)
+            if lock_token is None:
+                for event in self._follower_events(future.result(), error_message):
+                    yield event
+                return
+
+            async for event in stream_factory():
+                if event["type"] == "done":
+                    if "error" in event:
+                        result = {"error": event["error"]}
+                    else:
+                        result = {"content": event["response"], "tokens_used": event.get("tokens_used", 0)}
+                    future.set_result(result)
+                    await self._publish(fingerprint, result, lock_token)
+                yield event
+        finally:
+            if not future.done():
+                future.set_exception(LeaderAbandoned())
+                future.exception()
+                self._abandon(fingerprint, lock_token)
+            self._inflight.pop(fingerprint, None)
+
+    def _follower_events(self, result: Dict[str, Any], error_message: str) -> List[Dict[str, Any]]:
+        """Stream events for a follower from a shared result"""
+        if "error" in result:
+            return [{"type": "done", "response": error_message, "error": result["error"], "tokens_used": 0}]
+        return [
+            {"type": "token", "content": result["content"]},
+            {"type": "done", "response": result["content"], "tokens_used": 0, "coalesced": True}
+        ]
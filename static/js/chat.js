@@ -141,25 +141,8 @@ class ChatInterface {
             // Show typing indicator
             this.showTypingIndicator();
 
-            // Send request to API
-            const response = await axios.post('/api/v1/chat/message', {
-                message: message
-            });
-
-            // Remove typing indicator
-            this.hideTypingIndicator();
-
-            if (response.data.error) {
-                throw new Error(response.data.error);
-            }
-
-            // Add AI response to chat
-            this.addMessage(response.data.response, 'ai', {
-                responseTime: response.data.response_time_ms,
-                intent: response.data.intent,
-                contextUsed: response.data.context_used,
-                cached: response.data.cached
-            });
+            // Send request to API and render the reply as it streams in
+            await this.streamResponse(message);
 
             // Update usage statistics
             this.updateUsageStats();
@@ -198,17 +181,8 @@ class ChatInterface {
         messageTime.innerHTML = `<small class="text-muted">${this.formatTimestamp(new Date())}</small>`;
 
         // Add metadata for AI messages
-        if (type === 'ai' && metadata.responseTime) {
-            const metadataDiv = document.createElement('div');
-            metadataDiv.className = 'message-metadata';
-            metadataDiv.innerHTML = `
-                <small class="text-muted">
-                    ${metadata.responseTime}ms
-                    ${metadata.cached ? ' • Cached' : ''}
-                    ${metadata.intent ? ' • ' + metadata.intent : ''}
-                </small>
-            `;
-            messageTime.appendChild(metadataDiv);
+        if (type === 'ai') {
+            this.appendMessageMetadata(messageTime, metadata);
         }
 
         // Add message actions
@@ -245,6 +219,118 @@ class ChatInterface {
 
         // Update recent topics
         this.updateRecentTopics();
+
+        return messageDiv;
+    }
+
+    /**
+     * Append response metadata (timing, cache, intent) to an AI message
+     */
+    appendMessageMetadata(messageTime, metadata) {
+        if (!metadata.responseTime) {
+            return;
+        }
+
+        const metadataDiv = document.createElement('div');
+        metadataDiv.className = 'message-metadata';
+        metadataDiv.innerHTML = `
+            <small class="text-muted">
+                ${metadata.responseTime}ms
+                ${metadata.cached ? ' • Cached' : ''}
+                ${metadata.intent ? ' • ' + metadata.intent : ''}
+            </small>
+        `;
+        messageTime.appendChild(metadataDiv);
+    }
+
+    /**
+     * Send a message over the streaming endpoint and render tokens as they arrive
+     */
+    async streamResponse(message) {
+        const response = await fetch('/api/v1/chat/message/stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream'
+            },
+            body: JSON.stringify({ message: message })
+        });
+
+        if (!response.ok) {
+            const data = await response.json().catch(() => ({}));
+            const error = new Error(data.error || `Request failed with status ${response.status}`);
+            error.response = { status: response.status, data: data };
+            throw error;
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let content = '';
+        let messageDiv = null;
+        let metadata = {};
+
+        const renderContent = () => {
+            if (!messageDiv) {
+                this.hideTypingIndicator();
+                messageDiv = this.addMessage(content, 'ai');
+            }
+            messageDiv.querySelector('.message-text').innerHTML = this.formatMessage(content);
+            this.scrollToBottom();
+        };
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+
+            buffer += decoder.decode(value, { stream: true });
+            const frames = buffer.split('\n\n');
+            buffer = frames.pop();
+
+            for (const frame of frames) {
+                const eventLine = frame.split('\n').find(line => line.startsWith('event: '));
+                const dataLine = frame.split('\n').find(line => line.startsWith('data: '));
+                if (!eventLine || !dataLine) {
+                    continue;
+                }
+
+                const event = eventLine.slice(7);
+                const data = JSON.parse(dataLine.slice(6));
+
+                if (event === 'token') {
+                    content += data.content;
+                    renderContent();
+                } else if (event === 'meta') {
+                    metadata.intent = data.intent;
+                } else if (event === 'done') {
+                    // A stream that failed before its first token only carries the fallback text here
+                    if (!content && data.response) {
+                        content = data.response;
+                        renderContent();
+                    }
+                    metadata = {
+                        responseTime: data.response_time_ms,
+                        intent: data.intent || metadata.intent,
+                        contextUsed: data.context_used,
+                        cached: data.cached
+                    };
+                } else if (event === 'error') {
+                    throw new Error(data.error);
+                }
+            }
+        }
+
+        this.hideTypingIndicator();
+        if (!messageDiv) {
+            renderContent();
+        }
+
+        this.appendMessageMetadata(messageDiv.querySelector('.message-time'), metadata);
+        const historyEntry = this.conversationHistory[this.conversationHistory.length - 1];
+        historyEntry.content = content;
+        historyEntry.metadata = metadata;
     }
 
     /**
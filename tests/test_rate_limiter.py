@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # fakeredis needs lupa to run Lua scripts
+
+from utils.rate_limiter import RateLimiter
+
+THREADS = 50
+TIER = 1
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis(server=fakeredis.FakeServer())
+
+def reserve_concurrently(limiter, session_id, count=THREADS):
+    """Call reserve from `count` threads released at the same moment"""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def worker(index):
+        barrier.wait()
+        results[index] = limiter.reserve(session_id, TIER)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def expected_limit(limiter):
+    if limiter.strategy == 'gcra':
+        return limiter.gcra_limits[TIER]['burst']
+    return limiter.rate_limits[TIER]
+
+@pytest.mark.parametrize("strategy", RateLimiter.STRATEGIES)
+def test_concurrent_reserve_allows_exactly_limit(redis_client, strategy):
+    limiter = RateLimiter(redis_client, strategy=strategy)
+
+    results = reserve_concurrently(limiter, "session-burst")
+
+    allowed = [result for result in results if result['allowed']]
+    assert len(allowed) == expected_limit(limiter)
+    assert all(result['reservation_id'] for result in allowed)
+    assert all(result['reason'] == 'minute' for result in results if not result['allowed'])
+    assert int(redis_client.get(limiter.get_daily_limit_key("session-burst"))) == len(allowed)
+
+@pytest.mark.parametrize("strategy", RateLimiter.STRATEGIES)
+def test_release_returns_one_slot(redis_client, strategy):
+    limiter = RateLimiter(redis_client, strategy=strategy)
+    session_id = "session-release"
+
+    reservations = [limiter.reserve(session_id, TIER) for _ in range(expected_limit(limiter))]
+    assert all(reservation['allowed'] for reservation in reservations)
+    assert not limiter.reserve(session_id, TIER)['allowed']
+
+    assert limiter.release(session_id, reservations[0])
+    assert not limiter.release(session_id, reservations[0])  # At most once
+
+    results = reserve_concurrently(limiter, session_id, count=10)
+    assert sum(result['allowed'] for result in results) == 1
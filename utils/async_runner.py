@@ -0,0 +1,95 @@
+import asyncio
+import os
+import queue
+import threading
+import logging
+from typing import Any, AsyncIterator, Awaitable, Iterator, Optional
+
+class AsyncRunner:
+    """Runs coroutines on one long-lived event loop per worker process.
+
+    Sync Flask views hand their awaitables to this loop instead of calling
+    asyncio.run() per request, so async clients (and their connection pools)
+    stay bound to a single loop and the number of in-flight calls is not
+    capped by a thread pool.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """Return the background loop, starting it on first use (and after fork)"""
+        if self._loop is None or self._pid != os.getpid():
+            with self._lock:
+                if self._loop is None or self._pid != os.getpid():
+                    self._start()
+        return self._loop
+
+    def _start(self):
+        """Start the event loop thread"""
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, name="async-runner", daemon=True)
+        thread.start()
+        self._loop = loop
+        self._thread = thread
+        self._pid = os.getpid()
+        self.logger.info("Async runner event loop started")
+
+    def submit(self, awaitable: Awaitable) -> "asyncio.Future":
+        """Schedule an awaitable on the loop and return a concurrent future"""
+        return asyncio.run_coroutine_threadsafe(self._wrap(awaitable), self.loop)
+
+    def run(self, awaitable: Awaitable, timeout: float = None) -> Any:
+        """Run an awaitable on the loop and block the calling thread for its result"""
+        future = self.submit(awaitable)
+        try:
+            return future.result(timeout=timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def iterate(self, async_iterator: AsyncIterator, timeout: float = None) -> Iterator[Any]:
+        """Consume an async iterator on the loop from a sync generator.
+
+        `timeout` bounds the wait for each item, not the whole iteration.
+        """
+        items = queue.Queue()
+
+        async def pump():
+            try:
+                async for item in async_iterator:
+                    items.put(("item", item))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                items.put(("error", e))
+            else:
+                items.put(("done", None))
+
+        future = self.submit(pump())
+        try:
+            while True:
+                kind, value = items.get(timeout=timeout)
+                if kind == "item":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    return
+        except queue.Empty:
+            raise TimeoutError("Timed out waiting for the next streamed item")
+        finally:
+            # Stops the upstream stream if the client went away mid-response
+            future.cancel()
+
+    @staticmethod
+    async def _wrap(awaitable: Awaitable) -> Any:
+        return await awaitable
+
+# Shared per-process runner
+async_runner = AsyncRunner()
@@ -0,0 +1,125 @@
+import os
+import time
+import random
+import logging
+import threading
+from typing import Dict, Any, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+
+# Statuses worth retrying: throttling and transient upstream failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class HttpClientError(Exception):
+    """An upstream request failed after all retries"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[str] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+_session_lock = threading.Lock()
+
+def get_shared_session() -> requests.Session:
+    """Process-wide requests session with pooled keep-alive connections.
+
+    Connections are reused across providers and threads. The session is
+    recreated after a fork so workers never share sockets with the parent.
+    """
+    global _session, _session_pid
+    if _session is not None and _session_pid == os.getpid():
+        return _session
+
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=int(os.environ.get("HTTP_POOL_HOSTS", "10")),  # Hosts with their own pool
+                pool_maxsize=int(os.environ.get("HTTP_POOL_MAXSIZE", "20")),  # Kept-alive connections per host
+                max_retries=0  # Retries are handled by HttpClient with jittered backoff
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+            _session_pid = os.getpid()
+    return _session
+
+class HttpClient:
+    """JSON client for one upstream provider.
+
+    Requests go through the shared pooled session with connect/read
+    timeouts. Connection errors, timeouts and retryable statuses are retried
+    with full-jitter exponential backoff (honouring Retry-After), and a
+    semaphore caps how many requests the process has in flight to the
+    provider at once.
+    """
+
+    def __init__(self, name: str, base_url: str, max_concurrency: int = 8,
+                 timeout: Tuple[float, float] = None, max_retries: int = None,
+                 session: requests.Session = None):
+        self.logger = logging.getLogger(__name__)
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.session = session
+
+        if timeout is None:
+            timeout = (
+                float(os.environ.get("HTTP_CONNECT_TIMEOUT", "3.05")),
+                float(os.environ.get("HTTP_READ_TIMEOUT", "10"))
+            )
+        self.timeout = timeout
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get("HTTP_MAX_RETRIES", "2"))
+        self.backoff_base = 0.2  # Seconds; doubled per attempt
+        self.backoff_max = 5.0
+        self.acquire_timeout = self.timeout[0] + self.timeout[1]  # Longest wait for a concurrency slot
+
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Seconds to sleep before the next attempt"""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass  # HTTP-date form; fall back to our own backoff
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def get_json(self, path: str, params: Dict[str, Any] = None) -> Any:
+        """GET base_url + path and decode the JSON body, retrying transient failures"""
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        session = self.session or get_shared_session()
+        last_error: Optional[HttpClientError] = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self._backoff(attempt - 1, last_error.retry_after))
+
+            if not self._slots.acquire(timeout=self.acquire_timeout):
+                raise HttpClientError(f"{self.name}: too many concurrent requests")
+            try:
+                response = session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = HttpClientError(f"{self.name}: {e}")
+                self.logger.warning(f"{self.name} request failed (attempt {attempt + 1}): {e}")
+                continue
+            finally:
+                self._slots.release()
+
+            if response.status_code in RETRY_STATUSES:
+                last_error = HttpClientError(
+                    f"{self.name}: HTTP {response.status_code}", response.status_code, response.headers.get("Retry-After")
+                )
+                self.logger.warning(f"{self.name} returned {response.status_code} (attempt {attempt + 1})")
+                response.close()
+                continue
+            if response.status_code >= 400:
+                raise HttpClientError(f"{self.name}: HTTP {response.status_code}", response.status_code)
+
+            try:
+                return response.json()
+            except ValueError as e:
+                raise HttpClientError(f"{self.name}: invalid JSON response: {e}")
+
+        raise last_error
@@ -1,14 +1,204 @@
-from typing import Dict, Any
+from typing import Dict, Any, List
+import math
 import json
+import logging
+from functools import lru_cache
 
-def get_financial_assistant_prompt(context: Dict[str, Any]) -> str:
-    """Generate system prompt for financial assistant"""
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # Optional; token counts fall back to a character heuristic
+    tiktoken = None
+
+# System prompt token budgets per intent
+PROMPT_BUDGETS = {
+    'general_financial': 1200,
+    'strategy_help': 1200,
+    'educational': 900,
+    'portfolio_analysis': 2000,
+    'market_data': 1500
+}
+DEFAULT_PROMPT_BUDGET = 1200
+
+# Compaction defaults for JSON embedded in prompts
+MAX_POSITIONS = 10
+FLOAT_DIGITS = 2
+
+_encoder = None
+_encoder_loaded = False
+
+def _get_encoder():
+    """Load the gpt-4o tokenizer once, if tiktoken and its encoding are available"""
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        _encoder_loaded = True
+        if tiktoken is not None:
+            try:
+                _encoder = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                logger.warning(f"Tokenizer unavailable, estimating prompt tokens: {e}")
+    return _encoder
+
+def count_tokens(text: str) -> int:
+    """Count tokens with the local tokenizer (about 4 characters per token without it)"""
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text))
+    return math.ceil(len(text) / 4)
+
+def _position_value(position: Dict[str, Any]) -> float:
+    """Market value of a position, from an explicit value or quantity x price"""
+    for key in ('value', 'market_value'):
+        if isinstance(position.get(key), (int, float)):
+            return float(position[key])
+    quantity, price = position.get('quantity'), position.get('price')
+    if isinstance(quantity, (int, float)) and isinstance(price, (int, float)):
+        return float(quantity) * float(price)
+    return 0.0
+
+def _compact_value(value: Any, max_positions: int, float_digits: int) -> Any:
+    """Drop nulls, round floats and keep only the largest positions"""
+    if isinstance(value, float):
+        return round(value, float_digits)
+    if isinstance(value, dict):
+        compacted = {}
+        for key, item in value.items():
+            if item is None:
+                continue
+            if key in ('positions', 'holdings') and isinstance(item, list) and len(item) > max_positions:
+                item = _aggregate_positions(item, max_positions)
+            compacted[key] = _compact_value(item, max_positions, float_digits)
+        return compacted
+    if isinstance(value, list):
+        return [_compact_value(item, max_positions, float_digits) for item in value if item is not None]
+    return value
+
+def _aggregate_positions(positions: List[Any], max_positions: int) -> List[Any]:
+    """Keep the top positions by value and fold the rest into one OTHER entry"""
+    ranked = sorted(
+        (position for position in positions if isinstance(position, dict)),
+        key=_position_value,
+        reverse=True
+    )
+    rest = ranked[max_positions:]
+    return ranked[:max_positions] + [{
+        'symbol': 'OTHER',
+        'positions': len(rest),
+        'value': sum(_position_value(position) for position in rest)
+    }]
+
+def compact_json(data: Any, max_positions: int = MAX_POSITIONS, float_digits: int = FLOAT_DIGITS) -> str:
+    """Serialize data for a prompt without indentation, nulls or long tails"""
+    return json.dumps(
+        _compact_value(data, max_positions, float_digits), separators=(',', ':'), default=str
+    )
+
+@lru_cache(maxsize=64)
+def _static_token_count(text: str) -> int:
+    """Token count for static prompt text (counted once per process)"""
+    return count_tokens(text)
+
+def _turn_tokens(turns: List[Dict[str, str]]) -> int:
+    """Token count for chat turns, including per-message overhead"""
+    return sum(count_tokens(turn['content']) + 4 for turn in turns)
+
+class PromptBuilder:
+    """Assembles a prompt from a static prefix and per-request sections within a token budget.
     
-    user_tier = context.get('session_info', {}).get('user_tier', 1)
-    conversation_length = context.get('conversation_length', 0)
-    recent_messages = context.get('recent_messages', [])
+    The prefix is always kept and always sent first. Dynamic sections follow in
+    the order they were added; when the total is over budget, optional sections
+    are dropped lowest priority first (required sections are always kept).
+    Conversation history is a section too, but is sent as chat turns rather
+    than text. `report` records tokens per section.
+    """
+    
+    def __init__(self, intent: str, prefix: str, budget: int = None):
+        self.intent = intent
+        self.prefix = prefix
+        self.budget = budget or PROMPT_BUDGETS.get(intent, DEFAULT_PROMPT_BUDGET)
+        self.sections = [{
+            'name': 'instructions',
+            'text': prefix,
+            'priority': 0,
+            'required': True,
+            'tokens': _static_token_count(prefix)
+        }]
+        self.turns = []
+        self.report = {}
     
-    base_prompt = """You are Dekr AI Assistant, a sophisticated financial AI assistant specializing in market analysis, investment guidance, and financial education. You provide intelligent, contextual support to help users understand markets, analyze portfolios, and make informed financial decisions.
+    def add(self, name: str, text: str, priority: int = 0, required: bool = False) -> "PromptBuilder":
+        """Add a dynamic section; empty text is ignored"""
+        if text:
+            self.sections.append({
+                'name': name,
+                'text': text.strip('\n'),
+                'priority': priority,
+                'required': required,
+                'tokens': count_tokens(text)
+            })
+        return self
+    
+    def add_turns(self, turns: List[Dict[str, str]], priority: int = 0) -> "PromptBuilder":
+        """Add conversation history, sent as user/assistant messages"""
+        if turns:
+            self.sections.append({
+                'name': 'recent_messages',
+                'turns': turns,
+                'priority': priority,
+                'required': False,
+                'tokens': _turn_tokens(turns)
+            })
+        return self
+    
+    def remaining(self) -> int:
+        """Tokens left after the sections added so far"""
+        return self.budget - sum(section['tokens'] for section in self.sections)
+    
+    def build(self) -> Dict[str, Any]:
+        """Fit the sections to the budget.
+        
+        Returns the static `prefix`, the dynamic `context` text, the history
+        `turns` and the token `report`.
+        """
+        kept = list(self.sections)
+        dropped = []
+        total = sum(section['tokens'] for section in kept)
+        
+        for section in sorted((s for s in kept if not s['required']), key=lambda s: s['priority']):
+            if total <= self.budget:
+                break
+            kept.remove(section)
+            dropped.append(section['name'])
+            total -= section['tokens']
+        
+        self.report = {
+            'intent': self.intent,
+            'budget': self.budget,
+            'total_tokens': total,
+            'sections': {section['name']: section['tokens'] for section in kept},
+            'dropped': dropped
+        }
+        if total > self.budget:
+            logger.warning(f"Prompt for {self.intent} is over budget: {self.report}")
+        else:
+            logger.debug(f"Prompt tokens for {self.intent}: {self.report}")
+        
+        dynamic = [section for section in kept[1:] if 'text' in section]
+        history = [section for section in kept if 'turns' in section]
+        return {
+            'prefix': self.prefix,
+            'context': "\n\n".join(section['text'] for section in dynamic),
+            'turns': history[0]['turns'] if history else [],
+            'report': self.report
+        }
+
+# Static instruction prefixes. They are built once at import and always sent first,
+# unchanged, so the provider can cache them; everything per-request comes after.
+
+FINANCIAL_ASSISTANT_PREFIX = """You are Dekr AI Assistant, a sophisticated financial AI assistant specializing in market analysis, investment guidance, and financial education. You provide intelligent, contextual support to help users understand markets, analyze portfolios, and make informed financial decisions.
 
 CORE CAPABILITIES:
 - Real-time market data interpretation and analysis
@@ -34,56 +224,34 @@ IMPORTANT DISCLAIMERS:
 - Always recommend consulting with qualified financial advisors for personalized advice
 - Emphasize the importance of risk management and diversification"""
 
-    # Add user tier specific capabilities - but maintain conversational tone for all tiers
-    if user_tier == 1:  # Freemium
-        tier_info = """
+TIER_INSTRUCTIONS = {
+    # Freemium
+    1: """
 USER TIER: Freemium (Limited features)
 - Maintain warm, conversational tone while focusing on basic market explanations
 - Engage in friendly dialogue about fundamental financial concepts
 - Use conversational language to encourage learning and understanding
 - Be approachable and supportive in all interactions
-- Keep responses conversational even when explaining basic principles"""
-    
-    elif user_tier == 2:  # Market Hours Pro
-        tier_info = """
+- Keep responses conversational even when explaining basic principles""",
+    # Market Hours Pro
+    2: """
 USER TIER: Market Hours Pro
 - Provide conversational portfolio analysis and insights
 - Use engaging dialogue to explain investment strategies
 - Offer market commentary in a friendly, discussion-like manner
 - Include sector analysis presented conversationally
-- Maintain personal, approachable tone throughout interactions"""
-    
-    else:  # Higher tiers (3-7)
-        tier_info = """
+- Maintain personal, approachable tone throughout interactions""",
+    # Higher tiers (3-7)
+    3: """
 USER TIER: Premium (Full access)
 - Provide comprehensive analysis through engaging conversation
 - Use conversational tone for detailed strategy recommendations
 - Present advanced market analysis as friendly discussion
 - Maintain personal, approachable style for sophisticated topics
 - Keep all interactions conversational regardless of complexity"""
-    
-    # Add conversation context
-    context_info = ""
-    if conversation_length > 0:
-        context_info = f"""
-CONVERSATION CONTEXT:
-- This is an ongoing conversation ({conversation_length} messages exchanged)
-- Recent conversation topics and context should inform your responses
-- Build upon previous discussions and maintain continuity"""
-    
-    # Add recent message context
-    if recent_messages:
-        context_info += f"""
-RECENT MESSAGES:
-{json.dumps(recent_messages[-3:], indent=2)}
-Use this context to provide more relevant and personalized responses."""
-    
-    return f"{base_prompt}\n\n{tier_info}\n\n{context_info}"
+}
 
-def get_educational_prompt(user_level: str, context: Dict[str, Any]) -> str:
-    """Generate system prompt for educational content"""
-    
-    base_prompt = """You are Dekr AI Assistant's educational specialist, focused on teaching financial concepts in an engaging and accessible way. Your role is to break down complex financial topics into understandable lessons.
+EDUCATIONAL_PREFIX = """You are Dekr AI Assistant's educational specialist, focused on teaching financial concepts in an engaging and accessible way. Your role is to break down complex financial topics into understandable lessons.
 
 EDUCATIONAL APPROACH:
 1. Start with fundamentals and build complexity gradually
@@ -100,30 +268,25 @@ TEACHING STYLE:
 - Interactive and engaging with natural conversation flow
 - Practical and applicable advice shared in discussion format
 - Builds confidence in financial literacy through supportive conversation"""
-    
-    # Adjust based on user level
-    if user_level == "beginner":
-        level_info = """
+
+LEVEL_INSTRUCTIONS = {
+    'beginner': """
 STUDENT LEVEL: Beginner
 - Use simple language and avoid jargon
 - Define all financial terms clearly
 - Provide step-by-step explanations
 - Use everyday analogies and examples
 - Focus on building foundational knowledge
-- Encourage questions and provide reassurance"""
-    
-    elif user_level == "intermediate":
-        level_info = """
+- Encourage questions and provide reassurance""",
+    'intermediate': """
 STUDENT LEVEL: Intermediate
 - Build on existing knowledge
 - Introduce more complex concepts gradually
 - Use some financial terminology with explanations
 - Provide practical examples and case studies
 - Connect concepts to real market scenarios
-- Challenge understanding with thoughtful questions"""
-    
-    else:  # Advanced
-        level_info = """
+- Challenge understanding with thoughtful questions""",
+    'advanced': """
 STUDENT LEVEL: Advanced
 - Dive deep into complex topics
 - Use professional financial terminology
@@ -131,13 +294,9 @@ STUDENT LEVEL: Advanced
 - Include current market examples and trends
 - Discuss nuanced aspects and edge cases
 - Encourage critical thinking and analysis"""
-    
-    return f"{base_prompt}\n\n{level_info}"
+}
 
-def get_portfolio_analysis_prompt(portfolio_data: Dict[str, Any], context: Dict[str, Any]) -> str:
-    """Generate system prompt for portfolio analysis"""
-    
-    base_prompt = """You are Dekr AI Assistant's portfolio analysis specialist. You analyze investment portfolios through warm, conversational dialogue. Think of yourself as a knowledgeable friend discussing someone's investments in a supportive, engaging way.
+PORTFOLIO_ANALYSIS_PREFIX = """You are Dekr AI Assistant's portfolio analysis specialist. You analyze investment portfolios through warm, conversational dialogue. Think of yourself as a knowledgeable friend discussing someone's investments in a supportive, engaging way.
 
 ANALYSIS FRAMEWORK:
 1. Performance Assessment
@@ -166,20 +325,8 @@ RESPONSE STRUCTURE:
 - Offer specific, actionable recommendations in a supportive, discussion-like manner
 - Include risk considerations and disclaimers naturally in conversation
 - Suggest next steps and monitoring approach as part of ongoing dialogue"""
-    
-    # Add portfolio context
-    portfolio_info = f"""
-PORTFOLIO DATA:
-{json.dumps(portfolio_data, indent=2)}
 
-Use this data to provide specific, relevant analysis and recommendations."""
-    
-    return f"{base_prompt}\n\n{portfolio_info}"
-
-def get_market_interpretation_prompt(market_data: Dict[str, Any]) -> str:
-    """Generate system prompt for market data interpretation"""
-    
-    base_prompt = """You are Dekr AI Assistant's market analysis specialist. You interpret market data through warm, conversational dialogue. Think of yourself as a knowledgeable friend discussing market movements in an engaging, supportive way.
+MARKET_INTERPRETATION_PREFIX = """You are Dekr AI Assistant's market analysis specialist. You interpret market data through warm, conversational dialogue. Think of yourself as a knowledgeable friend discussing market movements in an engaging, supportive way.
 
 INTERPRETATION FRAMEWORK:
 1. Data Analysis
@@ -208,13 +355,8 @@ RESPONSE APPROACH:
 - Use clear, accessible language in a discussion-like format
 - Include relevant context and comparisons as part of natural conversation
 - Emphasize important trends and signals through supportive, engaging communication"""
-    
-    return base_prompt
 
-def get_strategy_explanation_prompt(strategy_type: str, context: Dict[str, Any]) -> str:
-    """Generate system prompt for strategy explanations"""
-    
-    base_prompt = f"""You are Dekr AI Assistant's strategy specialist, focused on explaining and analyzing the "{strategy_type}" investment strategy through warm, conversational dialogue. Think of yourself as a knowledgeable friend sharing insights in an engaging, supportive way.
+STRATEGY_EXPLANATION_PREFIX = """You are Dekr AI Assistant's strategy specialist, focused on explaining and analyzing investment strategies through warm, conversational dialogue. Think of yourself as a knowledgeable friend sharing insights in an engaging, supportive way.
 
 EXPLANATION FRAMEWORK:
 1. Strategy Overview
@@ -243,5 +385,86 @@ TEACHING APPROACH:
 - Address common questions and concerns in a supportive, friendly manner
 - Emphasize practical application through natural conversation
 - Include relevant warnings and disclaimers as part of ongoing discussion"""
+
+def get_financial_assistant_prompt(context: Dict[str, Any]) -> Dict[str, Any]:
+    """Generate the prompt for the financial assistant"""
+    
+    user_tier = context.get('user_tier') or context.get('session_info', {}).get('user_tier', 1)
+    conversation_length = context.get('conversation_length', 0)
+    conversation_summary = context.get('conversation_summary', '')
+    recent_turns = context.get('recent_turns', [])
+    
+    builder = PromptBuilder('general_financial', FINANCIAL_ASSISTANT_PREFIX)
+    
+    # Add user tier specific capabilities - but maintain conversational tone for all tiers
+    builder.add('tier', TIER_INSTRUCTIONS[min(max(user_tier, 1), 3)], required=True)
+    
+    # Add conversation context
+    if conversation_length > 0:
+        builder.add('conversation', f"""
+CONVERSATION CONTEXT:
+- This is an ongoing conversation ({conversation_length} messages exchanged)
+- Recent conversation topics and context should inform your responses
+- Build upon previous discussions and maintain continuity""", priority=1)
+    
+    # Add conversation memory: rolling summary of older messages plus the last few turns
+    if conversation_summary:
+        builder.add('summary', f"""
+CONVERSATION SUMMARY:
+{conversation_summary}""", priority=3)
+    
+    builder.add_turns(recent_turns, priority=2)
+    
+    return builder.build()
+
+def get_educational_prompt(user_level: str, context: Dict[str, Any]) -> Dict[str, Any]:
+    """Generate the prompt for educational content"""
+    
+    # Adjust based on user level (anything past intermediate is taught as advanced)
+    level_info = LEVEL_INSTRUCTIONS.get(user_level, LEVEL_INSTRUCTIONS['advanced'])
+    
+    # Recent turns let follow-ups like "can you explain that more simply?" refer back
+    return PromptBuilder('educational', EDUCATIONAL_PREFIX).add('level', level_info, required=True).add_turns(
+        context.get('recent_turns', []), priority=2
+    ).build()
+
+def get_portfolio_analysis_prompt(portfolio_data: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
+    """Generate the prompt for portfolio analysis"""
+    
+    builder = PromptBuilder('portfolio_analysis', PORTFOLIO_ANALYSIS_PREFIX)
+    
+    guidance = "Use this data to provide specific, relevant analysis and recommendations."
+    if 'risk' in portfolio_data:
+        guidance += " State risk using the simulated VaR/CVaR figures in the data rather than estimating it."
+    
+    # Add portfolio context, keeping fewer individual positions until it fits the budget
+    for max_positions in (MAX_POSITIONS, 5, 3):
+        portfolio_info = f"""
+PORTFOLIO DATA:
+{compact_json(portfolio_data, max_positions=max_positions)}
+
+{guidance}"""
+        if count_tokens(portfolio_info) <= builder.remaining():
+            break
+    builder.add('portfolio_data', portfolio_info, required=True)
+    
+    return builder.build()
+
+def get_market_interpretation_prompt(market_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Generate the prompt for market data interpretation"""
+    
+    builder = PromptBuilder('market_data', MARKET_INTERPRETATION_PREFIX)
+    if market_data:
+        builder.add('market_data', f"""
+MARKET DATA:
+{compact_json(market_data)}
+
+Base your interpretation on this data.""", required=True)
+    
+    return builder.build()
+
+def get_strategy_explanation_prompt(strategy_type: str, context: Dict[str, Any]) -> Dict[str, Any]:
+    """Generate the prompt for strategy explanations"""
     
-    return base_prompt
+    return PromptBuilder('strategy_help', STRATEGY_EXPLANATION_PREFIX).add('strategy', f"""
+STRATEGY: Focus on the "{strategy_type}" investment strategy.""", required=True).build()
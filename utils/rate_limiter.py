@@ -1,15 +1,143 @@
+import os
 import time
+import uuid
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from datetime import datetime, timedelta
 
+# Atomically trims the per-minute window, checks both quotas and reserves one slot in each.
+# Returns {allowed, reason, remaining_minute, remaining_daily, retry_after_ms, reset_ms}.
+SLIDING_WINDOW_RESERVE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local rate_limit = tonumber(ARGV[3])
+local daily_limit = tonumber(ARGV[4])
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now - window)
+local minute_count = redis.call('ZCARD', KEYS[1])
+local daily_count = tonumber(redis.call('GET', KEYS[2]) or '0')
+local remaining_daily = -1
+if daily_limit >= 0 then
+    remaining_daily = math.max(daily_limit - daily_count, 0)
+end
+
+if minute_count >= rate_limit then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    local retry_after = window
+    if oldest[2] then
+        retry_after = math.max(tonumber(oldest[2]) + window - now, 0)
+    end
+    return {0, 'minute', 0, remaining_daily, retry_after, retry_after}
+end
+
+if daily_limit >= 0 and daily_count >= daily_limit then
+    local daily_reset = redis.call('PTTL', KEYS[2])
+    return {0, 'daily', rate_limit - minute_count, 0, daily_reset, daily_reset}
+end
+
+redis.call('ZADD', KEYS[1], now, ARGV[5])
+redis.call('PEXPIRE', KEYS[1], window)
+local new_daily = redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+if daily_limit >= 0 then
+    remaining_daily = math.max(daily_limit - new_daily, 0)
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {1, 'ok', rate_limit - minute_count - 1, remaining_daily, 0, tonumber(oldest[2]) + window - now}
+"""
+
+# Gives back a sliding window reservation if it is still in the window
+SLIDING_WINDOW_RELEASE_SCRIPT = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 1 then
+    local daily_count = tonumber(redis.call('GET', KEYS[2]) or '0')
+    if daily_count > 0 then
+        redis.call('DECR', KEYS[2])
+    end
+    return 1
+end
+return 0
+"""
+
+# Generic cell rate algorithm: KEYS[1] holds only the theoretical arrival time (TAT)
+# in milliseconds. A request is allowed when now >= TAT - interval * (burst - 1).
+# Returns the same fields as the sliding window script.
+GCRA_RESERVE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local daily_limit = tonumber(ARGV[4])
+local tolerance = interval * (burst - 1)
+
+local tat = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tat < now then
+    tat = now
+end
+
+local daily_count = tonumber(redis.call('GET', KEYS[2]) or '0')
+local remaining_daily = -1
+if daily_limit >= 0 then
+    remaining_daily = math.max(daily_limit - daily_count, 0)
+end
+
+local allow_at = tat - tolerance
+if now < allow_at then
+    return {0, 'minute', 0, remaining_daily, allow_at - now, tat - now}
+end
+
+if daily_limit >= 0 and daily_count >= daily_limit then
+    local daily_reset = redis.call('PTTL', KEYS[2])
+    local remaining = math.floor((now + tolerance - tat) / interval) + 1
+    return {0, 'daily', remaining, 0, daily_reset, daily_reset}
+end
+
+local new_tat = tat + interval
+redis.call('SET', KEYS[1], new_tat, 'PX', new_tat - now)
+local new_daily = redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+if daily_limit >= 0 then
+    remaining_daily = math.max(daily_limit - new_daily, 0)
+end
+local remaining = math.floor((now + tolerance - new_tat) / interval) + 1
+return {1, 'ok', remaining, remaining_daily, 0, new_tat - now}
+"""
+
+# Gives back one emission interval of a GCRA reservation and its daily count
+GCRA_RELEASE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tat > now then
+    local new_tat = math.max(tat - interval, now)
+    if new_tat > now then
+        redis.call('SET', KEYS[1], new_tat, 'PX', new_tat - now)
+    else
+        redis.call('DEL', KEYS[1])
+    end
+end
+local daily_count = tonumber(redis.call('GET', KEYS[2]) or '0')
+if daily_count > 0 then
+    redis.call('DECR', KEYS[2])
+end
+return 1
+"""
+
 class RateLimiter:
     """Rate limiter for API requests based on user tiers"""
     
-    def __init__(self, redis_client=None):
+    STRATEGIES = ('sliding_window', 'gcra')
+    
+    def __init__(self, redis_client=None, strategy: str = None):
         self.redis_client = redis_client
         self.logger = logging.getLogger(__name__)
         
+        # Per-minute limiting strategy: 'sliding_window' (sorted set per session)
+        # or 'gcra' (one timestamp per session, burst-aware)
+        strategy = strategy or os.environ.get("RATE_LIMIT_STRATEGY", "sliding_window")
+        if strategy not in self.STRATEGIES:
+            self.logger.warning(f"Unknown rate limit strategy '{strategy}', using sliding_window")
+            strategy = 'sliding_window'
+        self.strategy = strategy
+        
         # Tier-based limits (messages per day)
         self.daily_limits = {
             1: 10,    # Freemium
@@ -31,6 +159,51 @@ class RateLimiter:
             6: 30,    # Tier 6
             7: 50     # Tier 7
         }
+        
+        # GCRA limits: sustained requests per minute and how many may arrive at once
+        self.gcra_limits = {
+            1: {'rate': 2, 'burst': 2},     # Freemium
+            2: {'rate': 5, 'burst': 3},     # Market Hours Pro
+            3: {'rate': 10, 'burst': 5},    # Tier 3
+            4: {'rate': 15, 'burst': 5},    # Tier 4
+            5: {'rate': 20, 'burst': 10},   # Tier 5
+            6: {'rate': 30, 'burst': 10},   # Tier 6
+            7: {'rate': 50, 'burst': 20}    # Tier 7
+        }
+        
+        # Token budgets (OpenAI tokens per day / per minute, -1 = unlimited)
+        self.daily_token_limits = {
+            1: 20000,     # Freemium
+            2: 100000,    # Market Hours Pro
+            3: 250000,    # Tier 3
+            4: 500000,    # Tier 4
+            5: 1500000,   # Tier 5
+            6: 4000000,   # Tier 6
+            7: -1         # Tier 7 (unlimited)
+        }
+        
+        self.minute_token_limits = {
+            1: 4000,      # Freemium
+            2: 10000,     # Market Hours Pro
+            3: 20000,     # Tier 3
+            4: 30000,     # Tier 4
+            5: 40000,     # Tier 5
+            6: 60000,     # Tier 6
+            7: 100000     # Tier 7
+        }
+        
+        # Sliding window length for rate limits (milliseconds)
+        self.rate_window_ms = 60000
+        
+        self.reserve_script = None
+        self.release_script = None
+        if redis_client:
+            if self.strategy == 'gcra':
+                self.reserve_script = redis_client.register_script(GCRA_RESERVE_SCRIPT)
+                self.release_script = redis_client.register_script(GCRA_RELEASE_SCRIPT)
+            else:
+                self.reserve_script = redis_client.register_script(SLIDING_WINDOW_RESERVE_SCRIPT)
+                self.release_script = redis_client.register_script(SLIDING_WINDOW_RELEASE_SCRIPT)
     
     def get_daily_limit_key(self, session_id: str) -> str:
         """Generate key for daily limit tracking"""
@@ -41,74 +214,166 @@ class RateLimiter:
         """Generate key for rate limit tracking"""
         return f"rate_limit:{session_id}"
     
-    def check_daily_limit(self, session_id: str, user_tier: int) -> bool:
-        """Check if user has exceeded daily message limit"""
+    def get_daily_token_key(self, session_id: str) -> str:
+        """Generate key for daily token usage tracking"""
+        date_str = datetime.now().strftime('%Y-%m-%d')
+        return f"daily_tokens:{session_id}:{date_str}"
+    
+    def get_minute_token_key(self, session_id: str) -> str:
+        """Generate key for the current minute's token usage"""
+        return f"minute_tokens:{session_id}:{int(time.time() // 60)}"
+    
+    def get_gcra_key(self, session_id: str) -> str:
+        """Generate key for GCRA theoretical arrival time tracking"""
+        return f"gcra:{session_id}"
+    
+    def get_gcra_interval_ms(self, user_tier: int) -> int:
+        """Milliseconds between requests at the tier's sustained rate"""
+        rate = self.gcra_limits.get(user_tier, self.gcra_limits[1])['rate']
+        return max(1, 60000 // rate)
+    
+    def reserve(self, session_id: str, user_tier: int) -> Dict[str, Any]:
+        """Atomically check and reserve both the per-minute and the daily quota.
+        
+        A single Redis script call replaces the separate check/increment round
+        trips, so concurrent bursts cannot all pass the check. Release the
+        returned reservation if the request fails.
+        """
         if not self.redis_client:
-            return True  # Allow if Redis is not available
+            return {'allowed': True, 'reason': 'ok', 'reservation_id': None}  # Allow if Redis is not available
         
         daily_limit = self.daily_limits.get(user_tier, 10)
-        
-        # Unlimited for tier 7
-        if daily_limit == -1:
-            return True
+        reservation_id = uuid.uuid4().hex
+        now_ms = int(time.time() * 1000)
         
         try:
-            key = self.get_daily_limit_key(session_id)
-            current_count = self.redis_client.get(key)
-            current_count = int(current_count) if current_count else 0
+            if self.strategy == 'gcra':
+                gcra_limit = self.gcra_limits.get(user_tier, self.gcra_limits[1])
+                limit = gcra_limit['burst']
+                result = self.reserve_script(
+                    keys=[self.get_gcra_key(session_id), self.get_daily_limit_key(session_id)],
+                    args=[now_ms, self.get_gcra_interval_ms(user_tier), gcra_limit['burst'], daily_limit, 86400]
+                )
+            else:
+                limit = self.rate_limits.get(user_tier, 2)
+                result = self.reserve_script(
+                    keys=[self.get_rate_limit_key(session_id), self.get_daily_limit_key(session_id)],
+                    args=[now_ms, self.rate_window_ms, limit, daily_limit, reservation_id, 86400]
+                )
+            
+            allowed, reason, remaining_minute, remaining_daily, retry_after_ms, reset_ms = result
             
-            return current_count < daily_limit
+            return {
+                'allowed': bool(allowed),
+                'reason': reason.decode() if isinstance(reason, bytes) else reason,
+                'limit': limit,
+                'remaining_minute': remaining_minute,
+                'remaining_daily': remaining_daily,
+                'retry_after': -(-max(retry_after_ms, 0) // 1000),  # Whole seconds, rounded up
+                'reset': -(-max(reset_ms, 0) // 1000),
+                'user_tier': user_tier,
+                'reservation_id': reservation_id if allowed else None
+            }
+        except Exception as e:
+            self.logger.error(f"Error reserving rate limit: {e}")
+            return {'allowed': True, 'reason': 'ok', 'reservation_id': None}  # Allow on error
+    
+    def release(self, session_id: str, reservation: Optional[Dict[str, Any]]) -> bool:
+        """Give back a reservation for a request that failed (at most once)"""
+        if not self.redis_client or not reservation or not reservation.get('reservation_id'):
+            return False
+        
+        if reservation.get('released'):
+            return False
+        reservation['released'] = True
+        
+        try:
+            if self.strategy == 'gcra':
+                released = self.release_script(
+                    keys=[self.get_gcra_key(session_id), self.get_daily_limit_key(session_id)],
+                    args=[int(time.time() * 1000), self.get_gcra_interval_ms(reservation['user_tier'])]
+                )
+            else:
+                released = self.release_script(
+                    keys=[self.get_rate_limit_key(session_id), self.get_daily_limit_key(session_id)],
+                    args=[reservation['reservation_id']]
+                )
+            return bool(released)
         except Exception as e:
-            self.logger.error(f"Error checking daily limit: {e}")
-            return True  # Allow on error
+            self.logger.error(f"Error releasing rate limit reservation: {e}")
+            return False
     
-    def check_rate_limit(self, session_id: str, user_tier: int) -> bool:
-        """Check if user has exceeded rate limit"""
+    def check_token_budget(self, session_id: str, user_tier: int) -> Dict[str, Any]:
+        """Check whether the session has token budget left today and this minute.
+        
+        Token cost is only known after the call, so this admits a request while
+        any budget remains; record_tokens then charges the actual usage.
+        """
         if not self.redis_client:
-            return True  # Allow if Redis is not available
+            return {'allowed': True}  # Allow if Redis is not available
         
-        rate_limit = self.rate_limits.get(user_tier, 2)
+        daily_limit = self.daily_token_limits.get(user_tier, self.daily_token_limits[1])
+        minute_limit = self.minute_token_limits.get(user_tier, self.minute_token_limits[1])
         
         try:
-            key = self.get_rate_limit_key(session_id)
-            current_time = int(time.time())
-            window_start = current_time - 60  # 1 minute window
+            daily_used, minute_used = self.redis_client.mget(
+                self.get_daily_token_key(session_id), self.get_minute_token_key(session_id)
+            )
+            daily_used = int(daily_used) if daily_used else 0
+            minute_used = int(minute_used) if minute_used else 0
             
-            # Remove old entries
-            self.redis_client.zremrangebyscore(key, 0, window_start)
+            if daily_limit != -1 and daily_used >= daily_limit:
+                return {'allowed': False, 'reason': 'daily_tokens', 'limit': daily_limit,
+                        'retry_after': max(self.redis_client.ttl(self.get_daily_token_key(session_id)), 1)}
             
-            # Count current requests
-            current_count = self.redis_client.zcard(key)
+            if minute_limit != -1 and minute_used >= minute_limit:
+                return {'allowed': False, 'reason': 'minute_tokens', 'limit': minute_limit,
+                        'retry_after': 60 - int(time.time() % 60)}
             
-            return current_count < rate_limit
+            return {
+                'allowed': True,
+                'remaining_daily_tokens': -1 if daily_limit == -1 else daily_limit - daily_used,
+                'remaining_minute_tokens': -1 if minute_limit == -1 else minute_limit - minute_used
+            }
         except Exception as e:
-            self.logger.error(f"Error checking rate limit: {e}")
-            return True  # Allow on error
+            self.logger.error(f"Error checking token budget: {e}")
+            return {'allowed': True}  # Allow on error
     
-    def increment_usage(self, session_id: str) -> bool:
-        """Increment usage counters after successful request"""
-        if not self.redis_client:
+    def record_tokens(self, session_id: str, tokens_used: int) -> bool:
+        """Charge tokens spent by a request against the daily and per-minute budgets"""
+        if not self.redis_client or not tokens_used:
             return True
         
         try:
-            current_time = int(time.time())
-            
-            # Increment daily counter
-            daily_key = self.get_daily_limit_key(session_id)
-            self.redis_client.incr(daily_key)
-            self.redis_client.expire(daily_key, 86400)  # 24 hours
-            
-            # Add to rate limit tracker
-            rate_key = self.get_rate_limit_key(session_id)
-            self.redis_client.zadd(rate_key, {str(current_time): current_time})
-            self.redis_client.expire(rate_key, 60)  # 1 minute
+            daily_key = self.get_daily_token_key(session_id)
+            minute_key = self.get_minute_token_key(session_id)
             
+            pipe = self.redis_client.pipeline()
+            pipe.incrby(daily_key, tokens_used)
+            pipe.expire(daily_key, 86400)
+            pipe.incrby(minute_key, tokens_used)
+            pipe.expire(minute_key, 120)
+            pipe.execute()
             return True
         except Exception as e:
-            self.logger.error(f"Error incrementing usage: {e}")
+            self.logger.error(f"Error recording token usage: {e}")
             return False
     
-    def get_usage_stats(self, session_id: str) -> Dict[str, Any]:
+    def get_rate_limit_headers(self, reservation: Optional[Dict[str, Any]]) -> Dict[str, str]:
+        """Build standard RateLimit-* (and Retry-After) headers from a reservation"""
+        if not reservation or 'limit' not in reservation:
+            return {}
+        
+        headers = {
+            'RateLimit-Limit': str(reservation['limit']),
+            'RateLimit-Remaining': str(max(reservation['remaining_minute'], 0)),
+            'RateLimit-Reset': str(reservation['reset'])
+        }
+        if not reservation['allowed']:
+            headers['Retry-After'] = str(reservation['retry_after'])
+        return headers
+    
+    def get_usage_stats(self, session_id: str, user_tier: int = 1) -> Dict[str, Any]:
         """Get current usage statistics for a session"""
         if not self.redis_client:
             return {}
@@ -119,18 +384,33 @@ class RateLimiter:
             daily_count = self.redis_client.get(daily_key)
             daily_count = int(daily_count) if daily_count else 0
             
-            # Get rate limit usage
-            rate_key = self.get_rate_limit_key(session_id)
-            current_time = int(time.time())
-            window_start = current_time - 60
+            current_time = int(time.time() * 1000)
+            if self.strategy == 'gcra':
+                # Requests still "owed" to the bucket at the sustained rate
+                tat = self.redis_client.get(self.get_gcra_key(session_id))
+                backlog_ms = max(int(tat) - current_time, 0) if tat else 0
+                interval = self.get_gcra_interval_ms(user_tier)
+                rate_count = -(-backlog_ms // interval)
+            else:
+                # Get rate limit usage
+                rate_key = self.get_rate_limit_key(session_id)
+                window_start = current_time - self.rate_window_ms
+                
+                # Clean old entries
+                self.redis_client.zremrangebyscore(rate_key, 0, window_start)
+                rate_count = self.redis_client.zcard(rate_key)
             
-            # Clean old entries
-            self.redis_client.zremrangebyscore(rate_key, 0, window_start)
-            rate_count = self.redis_client.zcard(rate_key)
+            daily_tokens, minute_tokens = self.redis_client.mget(
+                self.get_daily_token_key(session_id), self.get_minute_token_key(session_id)
+            )
             
             return {
                 'daily_messages_used': daily_count,
                 'rate_limit_usage': rate_count,
+                'daily_tokens_used': int(daily_tokens) if daily_tokens else 0,
+                'daily_token_limit': self.daily_token_limits.get(user_tier, self.daily_token_limits[1]),
+                'minute_tokens_used': int(minute_tokens) if minute_tokens else 0,
+                'minute_token_limit': self.minute_token_limits.get(user_tier, self.minute_token_limits[1]),
                 'timestamp': datetime.now().isoformat()
             }
         except Exception as e:
@@ -178,7 +458,7 @@ class RateLimiter:
         
         try:
             # Get usage stats
-            stats = self.get_usage_stats(session_id)
+            stats = self.get_usage_stats(session_id, current_tier)
             daily_used = stats.get('daily_messages_used', 0)
             current_limit = self.daily_limits.get(current_tier, 10)
             
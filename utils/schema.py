@@ -0,0 +1,129 @@
+import logging
+from contextlib import contextmanager
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+# Key of the PostgreSQL advisory lock held while the schema is created or upgraded
+SCHEMA_LOCK_KEY = 0x64656b72
+
+@contextmanager
+def schema_lock(db):
+    """Serialize schema changes across worker processes.
+
+    Every gunicorn worker imports the app and initializes the database. On
+    PostgreSQL a session advisory lock makes one worker apply the changes
+    while the others wait and then find nothing left to do. SQLite is only
+    used for single-process development and is not locked.
+    """
+    engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        yield
+        return
+
+    with engine.connect() as connection:
+        connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+        try:
+            yield
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SCHEMA_LOCK_KEY})
+
+def _column_default_sql(column) -> str:
+    """Render a scalar Python-side default as a SQL literal, if there is one"""
+    default = column.default
+    if default is None or not getattr(default, 'is_scalar', False):
+        return ""
+    value = default.arg
+    if isinstance(value, bool):
+        return f" DEFAULT {int(value)}"
+    if isinstance(value, (int, float)):
+        return f" DEFAULT {value}"
+    if isinstance(value, str):
+        escaped = value.replace("'", "''")
+        return f" DEFAULT '{escaped}'"
+    return ""
+
+def add_missing_columns(db) -> list:
+    """Add model columns that are missing from existing tables.
+
+    db.create_all() only creates missing tables, so columns added to models
+    after a database was first created are applied here with ALTER TABLE.
+    Only nullable or defaulted columns can be added this way.
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+
+    with engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(
+                    f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{_column_default_sql(column)}'
+                ))
+                added.append(f"{table.name}.{column.name}")
+
+    return added
+
+# Cleanup run before a unique index is created on a table that may already hold duplicates.
+# Keeps the most recently updated row per key.
+UNIQUE_INDEX_DEDUPLICATION = {
+    'uq_user_contexts_session_id': (
+        "DELETE FROM user_contexts WHERE id IN ("
+        "SELECT id FROM ("
+        "SELECT id, ROW_NUMBER() OVER ("
+        "PARTITION BY session_id ORDER BY updated_at DESC, created_at DESC, id DESC"
+        ") AS row_num FROM user_contexts"
+        ") ranked WHERE row_num > 1)"
+    ),
+}
+
+def create_missing_indexes(db) -> list:
+    """Create model indexes that are missing from existing tables.
+
+    Like columns, indexes declared after a table was created are not picked
+    up by db.create_all(). Duplicate rows are removed before a unique index
+    is created so the CREATE does not fail.
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+
+    with engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing_indexes:
+                    continue
+
+                if index.unique and index.name in UNIQUE_INDEX_DEDUPLICATION:
+                    result = connection.execute(text(UNIQUE_INDEX_DEDUPLICATION[index.name]))
+                    if result.rowcount:
+                        logger.warning(f"Removed {result.rowcount} duplicate rows from {table.name} before creating {index.name}")
+
+                index.create(bind=connection)
+                created.append(index.name)
+
+    return created
+
+def upgrade_schema(db):
+    """Bring an existing database up to date with the models (idempotent)"""
+    added_columns = add_missing_columns(db)
+    for column in added_columns:
+        logger.info(f"Added missing column {column}")
+
+    created_indexes = create_missing_indexes(db)
+    for index_name in created_indexes:
+        logger.info(f"Created missing index {index_name}")
@@ -0,0 +1,126 @@
+import re
+import hashlib
+from typing import List, Set
+
+# Words that do not change what a short financial question is asking
+STOP_WORDS = {
+    'a', 'an', 'the', 'is', 'are', 'was', 'were', 'be', 'been', 'am', 'do', 'does', 'did',
+    'what', 'whats', 'how', 'why', 'when', 'which', 'who', 'can', 'could', 'would', 'should',
+    'will', 'shall', 'may', 'might', 'i', 'me', 'my', 'we', 'our', 'you', 'your', 'it', 'its',
+    'this', 'that', 'these', 'those', 'of', 'to', 'in', 'on', 'for', 'with', 'about', 'and',
+    'or', 'please', 'tell', 'explain', 'describe', 'mean', 'means', 'meaning', 'there', 'some',
+    'any', 'just', 'really', 'exactly', 'so', 'as', 'at', 'by', 'from', 'into', 'like'
+}
+
+# Ordered suffix rules for a light stemmer (suffix, replacement, minimum stem length)
+SUFFIX_RULES = [
+    ('ies', 'y', 3),
+    ('ing', '', 4),
+    ('ed', '', 4),
+    ('es', '', 4),
+    ('s', '', 3),
+]
+
+# MinHash parameters: 16 bands x 4 rows
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+MERSENNE_PRIME = (1 << 61) - 1
+
+def _permutation_params(count: int) -> List[tuple]:
+    """Derive fixed (a, b) pairs for the universal hash family"""
+    params = []
+    for i in range(count):
+        digest = hashlib.blake2b(f"minhash:{i}".encode(), digest_size=16).digest()
+        a = int.from_bytes(digest[:8], 'big') % MERSENNE_PRIME or 1
+        b = int.from_bytes(digest[8:], 'big') % MERSENNE_PRIME
+        params.append((a, b))
+    return params
+
+PERMUTATIONS = _permutation_params(NUM_PERMUTATIONS)
+
+def stem_word(word: str) -> str:
+    """Strip common English suffixes"""
+    for suffix, replacement, min_stem in SUFFIX_RULES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= min_stem:
+            return word[:-len(suffix)] + replacement
+    return word
+
+def normalize_text(text: str) -> str:
+    """Fold case, punctuation, whitespace and stop words; stem what remains"""
+    if not isinstance(text, str):
+        return ""
+
+    text = text.lower().replace("'", "")
+    words = re.findall(r"[a-z0-9&]+", text)
+    stems = [stem_word(word) for word in words if word not in STOP_WORDS]
+
+    # Questions made only of stop words keep their words so they do not all collapse to ""
+    if not stems:
+        stems = words
+
+    return " ".join(stems)
+
+def key_tokens(text: str) -> Set[str]:
+    """Numbers and ticker-like tokens, which must match exactly for two questions to be the same.
+
+    "10-year" and "30-year", or "AAPL" and "MSFT", are near-identical as
+    text but ask different questions.
+    """
+    if not isinstance(text, str):
+        return set()
+    numbers = re.findall(r"\d+(?:\.\d+)?", text)
+    tickers = re.findall(r"\$?\b[A-Z]{2,5}\b", text)
+    return set(numbers) | {ticker.lstrip('$').lower() for ticker in tickers}
+
+def term_similarity(normalized_a: str, normalized_b: str) -> float:
+    """Jaccard similarity of the content terms (stems) of two normalized texts"""
+    terms_a, terms_b = set(normalized_a.split()), set(normalized_b.split())
+    if not terms_a and not terms_b:
+        return 1.0
+    return len(terms_a & terms_b) / len(terms_a | terms_b)
+
+# Words that make a message refer back to earlier turns
+FOLLOW_UP_WORDS = {
+    'it', 'that', 'this', 'those', 'these', 'them', 'they', 'above', 'again', 'previous',
+    'earlier', 'more', 'simpler', 'simply', 'else', 'also', 'instead', 'example',
+    'understand', 'confused', 'clarify', 'elaborate', 'continue'
+}
+
+def is_follow_up(text: str) -> bool:
+    """Whether a message refers back to earlier turns ("explain that simpler", "what about it?")"""
+    if not isinstance(text, str):
+        return True
+    words = re.findall(r"[a-z0-9&]+", text.lower().replace("'", ""))
+    return any(word in FOLLOW_UP_WORDS for word in words)
+
+def shingles(normalized_text: str, size: int = 4) -> Set[str]:
+    """Character shingles of normalized text"""
+    if len(normalized_text) <= size:
+        return {normalized_text}
+    return {normalized_text[i:i + size] for i in range(len(normalized_text) - size + 1)}
+
+def minhash_signature(normalized_text: str) -> List[int]:
+    """Compute a MinHash signature over character shingles"""
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'big')
+        for shingle in shingles(normalized_text)
+    ]
+    return [
+        min((a * value + b) % MERSENNE_PRIME for value in hashes)
+        for a, b in PERMUTATIONS
+    ]
+
+def lsh_band_hashes(signature: List[int]) -> List[str]:
+    """Hash each LSH band of a signature to a short bucket id"""
+    rows = len(signature) // LSH_BANDS
+    return [
+        hashlib.md5(",".join(str(v) for v in signature[band * rows:(band + 1) * rows]).encode()).hexdigest()[:16]
+        for band in range(LSH_BANDS)
+    ]
+
+def estimate_similarity(signature_a: List[int], signature_b: List[int]) -> float:
+    """Estimate Jaccard similarity from two MinHash signatures"""
+    if not signature_a or len(signature_a) != len(signature_b):
+        return 0.0
+    matches = sum(1 for a, b in zip(signature_a, signature_b) if a == b)
+    return matches / len(signature_a)
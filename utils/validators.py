@@ -181,3 +181,21 @@ def validate_news_query(params: Dict[str, Any]) -> Dict[str, Any]:
                 return {'valid': False, 'error': f'Invalid symbol format: {symbol}'}
     
     return {'valid': True}
+
+# Message fields the history endpoint can project
+HISTORY_FIELDS = ['id', 'user_message', 'ai_response', 'timestamp', 'context_used', 'response_time_ms', 'tokens_used']
+
+def validate_history_fields(fields_param: str) -> Dict[str, Any]:
+    """Validate a comma-separated `fields=` projection for chat history"""
+    if not fields_param:
+        return {'valid': True, 'fields': None}
+    
+    fields = [field.strip() for field in fields_param.split(',') if field.strip()]
+    for field in fields:
+        if field not in HISTORY_FIELDS:
+            return {'valid': False, 'error': f'Invalid field: {field}'}
+    
+    if not fields:
+        return {'valid': False, 'error': 'No fields requested'}
+    
+    return {'valid': True, 'fields': fields}